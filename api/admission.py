@@ -0,0 +1,148 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+
+OUTCOMES = ("admitted", "rate_limited", "overloaded")
+
+
+class TokenBuckets:
+    """Per-key token buckets holding up to `burst` tokens, refilled at `rate` per second
+
+    Only the `max_keys` most recently seen keys are tracked; a key seen again
+    after being dropped starts with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refill(self, key: str, now: float) -> float:
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def _store(self, key: str, tokens: float, now: float) -> None:
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def take(self, key: str, cost: float = 1.0) -> float:
+        """Spend `cost` tokens; returns 0 on success, else the seconds until they are available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, now)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate
+            self._store(key, tokens, now)
+        return wait
+
+    def charge(self, key: str, cost: float) -> None:
+        """Spend tokens that were used anyway; the bucket may go negative and recovers later"""
+        now = time.monotonic()
+        with self._lock:
+            self._store(key, self._refill(key, now) - cost, now)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class AdmissionSlot:
+    """The in-flight slot of one admitted request
+
+    Released when the request finishes, unless the request hands its work
+    to a background job with `hand_over()`; the job then calls the returned
+    function once it has finished.
+    """
+
+    def __init__(self, release: Callable[[], None]):
+        self._release = release
+        self.handed_over = False
+
+    def hand_over(self) -> Callable[[], None]:
+        self.handed_over = True
+        return self._release
+
+
+class AdmissionController:
+    """Decides whether an expensive request may start, before its body is read
+
+    A request is shed with 503 while `max_in_flight` admitted requests are
+    still running, or while the inference queue would make it wait longer
+    than `max_queue_wait_ms`. Otherwise it spends a token from its user's
+    bucket, and is rejected with 429 when the bucket is empty. Both carry a
+    Retry-After header. `queue_wait` returns the current expected wait in
+    seconds. Admitted requests must call `release()` once finished.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_in_flight: int,
+        max_queue_wait_ms: float,
+        max_users: int = 10000,
+        queue_wait: Optional[Callable[[], float]] = None
+    ):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.buckets = TokenBuckets(rate, burst, max_users)
+        self.max_in_flight = max_in_flight
+        self.max_queue_wait = max_queue_wait_ms / 1000
+        self.queue_wait = queue_wait or (lambda: 0.0)
+        self.in_flight = 0
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+
+    def _reject(self, outcome: str, status_code: int, detail: str, retry_after: float) -> HTTPException:
+        self.counts[outcome] += 1
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def admit(self, user: str, cost: float = 1.0) -> None:
+        """Admit a request from `user` or raise 503/429; call on the event loop"""
+        wait = self.queue_wait()
+        if self.in_flight >= self.max_in_flight or wait > self.max_queue_wait:
+            raise self._reject(
+                "overloaded",
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "The server is busy with other predictions, please retry shortly",
+                max(wait, self.max_queue_wait)
+            )
+        retry_after = self.buckets.take(user, cost)
+        if retry_after:
+            raise self._reject(
+                "rate_limited",
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "Too many prediction requests, please slow down",
+                retry_after
+            )
+        self.in_flight += 1
+        self.counts["admitted"] += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_wait_ms": round(self.queue_wait() * 1000, 2),
+            "max_queue_wait_ms": round(self.max_queue_wait * 1000, 2),
+            "rate": self.buckets.rate,
+            "burst": self.buckets.burst,
+            "users": len(self.buckets),
+            **self.counts,
+        }
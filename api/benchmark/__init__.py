@@ -0,0 +1 @@
+# Offline benchmark harness for SkinCheck API
@@ -0,0 +1,62 @@
+import io
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+
+from PIL import Image
+
+# Sample lesion photo shipped at the repository root
+DEFAULT_SOURCE = os.path.join(os.path.dirname(__file__), "..", "..", "test.jpg")
+# Longest side in pixels; the upload validator accepts 100..4096
+DEFAULT_SIZES = (256, 512, 1024, 2048, 4000)
+FORMATS = {"JPEG": ("image/jpeg", ".jpg"), "PNG": ("image/png", ".png")}
+
+
+@dataclass
+class CorpusImage:
+    name: str
+    content: bytes
+    content_type: str
+    width: int
+    height: int
+
+    def variant(self, n: int) -> bytes:
+        """Same pixels with different bytes, so each upload has its own hash
+
+        JPEG gets a comment segment right after SOI; PNG gets a text chunk
+        right after IHDR. Decoders ignore both.
+        """
+        marker = f"skincheck-benchmark-{n}".encode()
+        if self.content_type == "image/jpeg":
+            return self.content[:2] + b"\xff\xfe" + struct.pack(">H", len(marker) + 2) + marker + self.content[2:]
+        chunk = b"tEXt" + b"benchmark\x00" + marker
+        crc = struct.pack(">I", zlib.crc32(chunk))
+        ihdr_end = 8 + 8 + 13 + 4
+        return self.content[:ihdr_end] + struct.pack(">I", len(chunk) - 4) + chunk + crc + self.content[ihdr_end:]
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "bytes": len(self.content),
+            "content_type": self.content_type,
+            "width": self.width,
+            "height": self.height,
+        }
+
+
+def build_corpus(source: str = DEFAULT_SOURCE, sizes=DEFAULT_SIZES, formats=("JPEG",)) -> list[CorpusImage]:
+    """`source` re-encoded at each longest-side size in each format"""
+    with Image.open(source) as original:
+        original = original.convert("RGB")
+    corpus = []
+    for size in sizes:
+        scale = size / max(original.size)
+        width, height = max(1, round(original.width * scale)), max(1, round(original.height * scale))
+        resized = original.resize((width, height), Image.LANCZOS)
+        for image_format in formats:
+            content_type, extension = FORMATS[image_format]
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **({"quality": 90} if image_format == "JPEG" else {}))
+            corpus.append(CorpusImage(f"test_{size}{extension}", buffer.getvalue(), content_type, width, height))
+    return corpus
@@ -0,0 +1,578 @@
+import asyncio
+import contextvars
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Optional
+
+import jwt
+from gotrue.errors import AuthApiError
+
+# Round-trip latency injected per kind of Supabase call, in milliseconds
+DEFAULT_LATENCY_MS = {
+    "auth": 40.0,
+    "select": 25.0,
+    "insert": 30.0,
+    "update": 30.0,
+    "delete": 25.0,
+    "storage_upload": 80.0,
+    "storage_download": 40.0,
+    "storage_remove": 30.0,
+    "storage_copy": 30.0,
+    "storage_info": 20.0,
+    "storage_list": 30.0,
+}
+
+
+# Set while AsyncFakeSupabase runs a synchronous fake call whose delay it already awaited
+_awaited = contextvars.ContextVar("fake_supabase_awaited", default=False)
+
+
+class LatencyProfile:
+    """Delays that stand in for network round trips to Supabase
+
+    Calls through the synchronous fake sleep on the calling thread, calls
+    through AsyncFakeSupabase await the delay instead. Each call is recorded
+    per operation for the stage breakdown.
+    """
+
+    def __init__(self, latency_ms: Optional[dict] = None, jitter: float = 0.1, seed: int = 0):
+        self.latency_ms = {**DEFAULT_LATENCY_MS, **(latency_ms or {})}
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = {}
+
+    def delay(self, operation: str) -> float:
+        """Record one call and return its delay in seconds"""
+        base = self.latency_ms.get(operation, 0.0) / 1000
+        with self._lock:
+            delay = max(0.0, base * (1 + self._random.uniform(-self.jitter, self.jitter)))
+            count, total = self.calls.get(operation, (0, 0.0))
+            self.calls[operation] = (count + 1, total + delay)
+        return delay
+
+    def wait(self, operation: str) -> None:
+        if _awaited.get():
+            return
+        delay = self.delay(operation)
+        if delay:
+            time.sleep(delay)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                operation: {"calls": count, "total_ms": round(total * 1000, 2), "avg_ms": round(total / count * 1000, 2)}
+                for operation, (count, total) in sorted(self.calls.items())
+            }
+
+
+def _parse_value(raw: str):
+    if raw.startswith('"'):
+        return json.loads(raw)
+    if re.fullmatch(r"-?\d+", raw):
+        return int(raw)
+    return raw
+
+
+_COMPARISONS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "is": lambda a, b: a is None if b == "null" else a is b,
+}
+
+
+def _split_top_level(expression: str) -> list[str]:
+    parts, depth, current = [], 0, ""
+    in_quotes = False
+    for char in expression:
+        if char == '"':
+            in_quotes = not in_quotes
+        elif not in_quotes and char == "(":
+            depth += 1
+        elif not in_quotes and char == ")":
+            depth -= 1
+        if char == "," and depth == 0 and not in_quotes:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+def _compile_filter(expression: str):
+    """PostgREST logical filter, e.g. `created_at.lt."x",and(id.eq.1,...)`, as a predicate"""
+    match = re.fullmatch(r"(and|or)\((.*)\)", expression)
+    if match:
+        combine = all if match.group(1) == "and" else any
+        predicates = [_compile_filter(part) for part in _split_top_level(match.group(2))]
+        return lambda row: combine(predicate(row) for predicate in predicates)
+    column, operator, raw = expression.split(".", 2)
+    value = _parse_value(raw)
+    compare = _COMPARISONS[operator]
+    return lambda row: compare(row.get(column), value)
+
+
+class FakeQuery:
+    def __init__(self, client: "FakeSupabase", table: str):
+        self._client = client
+        self._table = table
+        self._operation = "select"
+        self._columns = "*"
+        self._payload = None
+        self._conflict = None
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._offset = 0
+        self._count = None
+        self._negate = False
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _filter(self, predicate):
+        if self._negate:
+            self._negate = False
+            self._filters.append(lambda row: not predicate(row))
+        else:
+            self._filters.append(predicate)
+        return self
+
+    def select(self, columns: str = "*", count: Optional[str] = None):
+        self._operation = "select"
+        self._columns = columns
+        self._count = count
+        return self
+
+    def insert(self, records, **kwargs):
+        self._operation = "insert"
+        self._payload = records if isinstance(records, list) else [records]
+        self._conflict = None
+        return self
+
+    def upsert(self, records, on_conflict: str = "id", **kwargs):
+        self.insert(records)
+        self._conflict = on_conflict
+        return self
+
+    def update(self, values: dict):
+        self._operation = "update"
+        self._payload = values
+        return self
+
+    def delete(self):
+        self._operation = "delete"
+        return self
+
+    def eq(self, column, value):
+        return self._filter(lambda row: row.get(column) == value)
+
+    def neq(self, column, value):
+        return self._filter(lambda row: row.get(column) != value)
+
+    def in_(self, column, values):
+        values = set(values)
+        return self._filter(lambda row: row.get(column) in values)
+
+    def is_(self, column, value):
+        expected = None if value in (None, "null") else value
+        return self._filter(lambda row: row.get(column) is expected)
+
+    def lt(self, column, value):
+        return self._filter(lambda row: _COMPARISONS["lt"](row.get(column), value))
+
+    def gt(self, column, value):
+        return self._filter(lambda row: _COMPARISONS["gt"](row.get(column), value))
+
+    def like(self, column, pattern):
+        regex = re.compile("".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern), re.DOTALL)
+        return self._filter(lambda row: row.get(column) is not None and regex.fullmatch(row.get(column)) is not None)
+
+    def or_(self, expression: str):
+        self._filters.append(_compile_filter(f"or({expression})"))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    def _matches(self, row: dict) -> bool:
+        return all(predicate(row) for predicate in self._filters)
+
+    def _project(self, row: dict) -> dict:
+        if self._columns.strip() == "*":
+            return dict(row)
+        columns = [column.strip() for column in self._columns.split(",")]
+        return {column: row.get(column) for column in columns}
+
+    def execute(self):
+        self._client.latency.wait(self._operation)
+        with self._client.lock:
+            rows = self._client.tables.setdefault(self._table, [])
+            if self._operation == "insert":
+                inserted = []
+                existing = {row.get(self._conflict): row for row in rows} if self._conflict else {}
+                for record in self._payload:
+                    row = existing.get(record.get(self._conflict)) if self._conflict else None
+                    if row is not None:
+                        row.update(record)
+                        self._client.touch(row)
+                    else:
+                        row = self._client.new_row(self._table, record)
+                        rows.append(row)
+                    inserted.append(row)
+                return SimpleNamespace(data=[dict(row) for row in inserted], count=None)
+            matched = [row for row in rows if self._matches(row)]
+            if self._operation == "update":
+                for row in matched:
+                    row.update(self._payload)
+                    self._client.touch(row)
+                return SimpleNamespace(data=[dict(row) for row in matched], count=None)
+            if self._operation == "delete":
+                self._client.tables[self._table] = [row for row in rows if not self._matches(row)]
+                return SimpleNamespace(data=[dict(row) for row in matched], count=None)
+            for column, desc in reversed(self._order):
+                matched.sort(key=lambda row: (row.get(column) is not None, row.get(column)), reverse=desc)
+            count = len(matched) if self._count else None
+            end = None if self._limit is None else self._offset + self._limit
+            return SimpleNamespace(data=[self._project(row) for row in matched[self._offset:end]], count=count)
+
+
+class FakeBucket:
+    def __init__(self, client: "FakeSupabase", name: str):
+        self._client = client
+        self._name = name
+
+    def upload(self, path: str, file, file_options: Optional[dict] = None):
+        self._client.latency.wait("storage_upload")
+        content = file if isinstance(file, (bytes, bytearray)) else file.read()
+        with self._client.lock:
+            objects = self._client.objects.setdefault(self._name, {})
+            if path in objects and str((file_options or {}).get("upsert", "false")).lower() != "true":
+                raise Exception("The resource already exists")
+            objects[path] = bytes(content)
+            self._client.modified[(self._name, path)] = datetime.now(timezone.utc)
+        return SimpleNamespace(path=path, full_path=f"{self._name}/{path}", fullPath=f"{self._name}/{path}")
+
+    def download(self, path: str) -> bytes:
+        self._client.latency.wait("storage_download")
+        with self._client.lock:
+            objects = self._client.objects.get(self._name, {})
+            if path not in objects:
+                raise Exception("Object not found")
+            return objects[path]
+
+    def remove(self, paths: list[str]) -> list[dict]:
+        self._client.latency.wait("storage_remove")
+        with self._client.lock:
+            objects = self._client.objects.get(self._name, {})
+            return [{"name": path} for path in paths if objects.pop(path, None) is not None]
+
+    def copy(self, from_path: str, to_path: str) -> dict:
+        self._client.latency.wait("storage_copy")
+        with self._client.lock:
+            objects = self._client.objects.get(self._name, {})
+            if from_path not in objects:
+                raise Exception("Object not found")
+            if to_path in objects:
+                raise Exception("The resource already exists")
+            objects[to_path] = objects[from_path]
+            self._client.modified[(self._name, to_path)] = datetime.now(timezone.utc)
+        return {"path": to_path}
+
+    def list(self, path: str = "", options: Optional[dict] = None) -> list[dict]:
+        """Objects directly inside the folder `path`, by name"""
+        self._client.latency.wait("storage_list")
+        options = options or {}
+        folder = f"{path.strip('/')}/" if path.strip("/") else ""
+        with self._client.lock:
+            objects = self._client.objects.get(self._name, {})
+            names = sorted(
+                name[len(folder):] for name in objects
+                if name.startswith(folder) and "/" not in name[len(folder):]
+            )
+            offset = options.get("offset", 0)
+            entries = []
+            for name in names[offset:offset + options.get("limit", 100)]:
+                modified = self._client.modified.get((self._name, folder + name), self._client.started)
+                entries.append({
+                    "name": name,
+                    "created_at": modified.isoformat(),
+                    "updated_at": modified.isoformat(),
+                    "metadata": {"size": len(objects[folder + name])},
+                })
+            return entries
+
+    def info(self, path: str) -> dict:
+        self._client.latency.wait("storage_info")
+        with self._client.lock:
+            objects = self._client.objects.get(self._name, {})
+            if path not in objects:
+                raise Exception("Object not found")
+            return {"name": path, "size": len(objects[path])}
+
+    def exists(self, path: str) -> bool:
+        self._client.latency.wait("storage_info")
+        with self._client.lock:
+            return path in self._client.objects.get(self._name, {})
+
+    def get_public_url(self, path: str) -> str:
+        return f"{self._client.url}/storage/v1/object/public/{self._name}/{path}"
+
+
+class FakeStorage:
+    def __init__(self, client: "FakeSupabase"):
+        self._client = client
+
+    def from_(self, bucket: str) -> FakeBucket:
+        return FakeBucket(self._client, bucket)
+
+
+class FakeAuth:
+    """Supabase Auth stand-in that issues real HS256 access tokens"""
+
+    def __init__(self, client: "FakeSupabase"):
+        self._client = client
+
+    def _user(self, record: dict) -> SimpleNamespace:
+        return SimpleNamespace(
+            id=record["id"],
+            email=record["email"],
+            role="authenticated",
+            user_metadata=record.get("user_metadata", {}),
+            app_metadata={"provider": "email"},
+        )
+
+    def sign_up(self, credentials: dict):
+        self._client.latency.wait("auth")
+        with self._client.lock:
+            if credentials["email"] in self._client.users:
+                raise AuthApiError("User already registered", 422, None)
+            record = {
+                "id": str(uuid.uuid4()),
+                "email": credentials["email"],
+                "password": credentials["password"],
+                "user_metadata": credentials.get("options", {}).get("data", {}),
+            }
+            self._client.users[record["email"]] = record
+        return SimpleNamespace(user=self._user(record), session=None)
+
+    def sign_in_with_password(self, credentials: dict):
+        self._client.latency.wait("auth")
+        record = self._client.users.get(credentials["email"])
+        if record is None or record["password"] != credentials["password"]:
+            raise AuthApiError("Invalid login credentials", 400, None)
+        session = SimpleNamespace(access_token=self._client.issue_token(record), token_type="bearer")
+        return SimpleNamespace(user=self._user(record), session=session)
+
+    def get_user(self, token: Optional[str] = None):
+        self._client.latency.wait("auth")
+        claims = jwt.decode(token, self._client.jwt_secret, algorithms=["HS256"], audience="authenticated")
+        record = next((user for user in self._client.users.values() if user["id"] == claims["sub"]), None)
+        if record is None:
+            return None
+        return SimpleNamespace(user=self._user(record))
+
+
+class FakeSupabase:
+    """In-memory stand-in for the parts of the Supabase client the API uses"""
+
+    def __init__(self, url: str, jwt_secret: str, latency: Optional[LatencyProfile] = None):
+        self.url = url
+        self.jwt_secret = jwt_secret
+        self.latency = latency or LatencyProfile()
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.objects = {}
+        # (bucket, path) -> last write; objects seeded directly count as written at `started`
+        self.modified = {}
+        self.started = datetime.now(timezone.utc)
+        self.users = {}
+        self._ids = itertools.count(1)
+        self._clock = datetime.now(timezone.utc)
+        self.auth = FakeAuth(self)
+        self.storage = FakeStorage(self)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[dict] = None) -> SimpleNamespace:
+        """Call one of the database functions below, named `_rpc_<name>`"""
+        function = getattr(self, f"_rpc_{name}")
+
+        def execute():
+            self.latency.wait("update")
+            with self.lock:
+                return SimpleNamespace(data=function(**(params or {})), count=None)
+
+        return SimpleNamespace(execute=execute)
+
+    def _rpc_rescore_uploads(self, updates: list[dict]) -> list[int]:
+        """api/rescore.py's rescore_uploads: new predictions for rows still at their previous version"""
+        rows = {row["id"]: row for row in self.tables.get("uploads", [])}
+        written = []
+        for update in updates:
+            row = rows.get(update["id"])
+            if row is None or row.get("model_version") != update["previous_version"]:
+                continue
+            row.update({column: update[column] for column in ("prediction_result", "prediction_confidence", "model_version")})
+            self.touch(row)
+            written.append(row["id"])
+        return written
+
+    def new_row(self, table: str, record: dict) -> dict:
+        # Strictly increasing timestamps keep (created_at, id) ordering deterministic
+        self._clock += timedelta(microseconds=1)
+        now = self._clock.isoformat()
+        return {"id": next(self._ids), "created_at": now, "updated_at": now, **record}
+
+    def touch(self, row: dict) -> None:
+        """Advance a rewritten row's updated_at, as the trigger on `uploads` does"""
+        self._clock += timedelta(microseconds=1)
+        row["updated_at"] = self._clock.isoformat()
+
+    def add_user(self, email: str, password: str) -> dict:
+        with self.lock:
+            record = {"id": str(uuid.uuid4()), "email": email, "password": password, "user_metadata": {}}
+            self.users[email] = record
+        return record
+
+    def issue_token(self, record: dict, lifetime: int = 3600) -> str:
+        now = int(time.time())
+        return jwt.encode({
+            "sub": record["id"],
+            "email": record["email"],
+            "aud": "authenticated",
+            "role": "authenticated",
+            "iat": now,
+            "exp": now + lifetime,
+            "user_metadata": record.get("user_metadata", {}),
+        }, self.jwt_secret, algorithm="HS256")
+
+
+async def _awaited_call(latency: LatencyProfile, operation: str, call):
+    delay = latency.delay(operation)
+    if delay:
+        await asyncio.sleep(delay)
+    token = _awaited.set(True)
+    try:
+        return call()
+    finally:
+        _awaited.reset(token)
+
+
+class AsyncFakeQuery:
+    """Query builder of AsyncFakeSupabase: chains like FakeQuery, `execute` is awaited"""
+
+    def __init__(self, query: FakeQuery):
+        self._query = query
+
+    def __getattr__(self, name: str):
+        method = getattr(self._query, name)
+
+        def chained(*args, **kwargs):
+            method(*args, **kwargs)
+            return self
+        return chained
+
+    @property
+    def not_(self):
+        self._query.not_
+        return self
+
+    async def execute(self):
+        return await _awaited_call(self._query._client.latency, self._query._operation, self._query.execute)
+
+
+class AsyncFakeBucket:
+    OPERATIONS = {
+        "upload": "storage_upload",
+        "download": "storage_download",
+        "remove": "storage_remove",
+        "copy": "storage_copy",
+        "info": "storage_info",
+        "exists": "storage_info",
+        "list": "storage_list",
+    }
+
+    def __init__(self, bucket: FakeBucket):
+        self._bucket = bucket
+
+    def __getattr__(self, name: str):
+        method = getattr(self._bucket, name)
+
+        async def call(*args, **kwargs):
+            return await _awaited_call(
+                self._bucket._client.latency, self.OPERATIONS.get(name, ""), lambda: method(*args, **kwargs)
+            )
+        return call
+
+
+class AsyncFakeAuth:
+    def __init__(self, auth: FakeAuth):
+        self._auth = auth
+
+    def __getattr__(self, name: str):
+        method = getattr(self._auth, name)
+
+        async def call(*args, **kwargs):
+            return await _awaited_call(self._auth._client.latency, "auth", lambda: method(*args, **kwargs))
+        return call
+
+
+class AsyncFakeStorage:
+    def __init__(self, fake: FakeSupabase):
+        self._fake = fake
+
+    def from_(self, bucket: str) -> AsyncFakeBucket:
+        return AsyncFakeBucket(self._fake.storage.from_(bucket))
+
+
+class AsyncFakeSupabase:
+    """The async client surface over the same in-memory data as `fake`"""
+
+    def __init__(self, fake: FakeSupabase):
+        self.fake = fake
+        self.auth = AsyncFakeAuth(fake.auth)
+        self.storage = AsyncFakeStorage(fake)
+
+    def table(self, name: str) -> AsyncFakeQuery:
+        return AsyncFakeQuery(self.fake.table(name))
+
+
+def install(fake: FakeSupabase) -> None:
+    """Make every `create_client` and `acreate_client` call use `fake`; call before importing api.main"""
+    import supabase as supabase_package
+
+    async def acreate_client(*args, **kwargs):
+        return AsyncFakeSupabase(fake)
+
+    supabase_package.create_client = lambda *args, **kwargs: fake
+    supabase_package.acreate_client = acreate_client
@@ -0,0 +1,322 @@
+"""End-to-end API benchmark against an in-process Supabase stand-in
+
+    python -m api.benchmark.run --scenarios predict history auth_profile --concurrency 1 8 32
+
+The app runs in this process behind httpx's ASGI transport. Every Supabase
+client is replaced by api.benchmark.fake_supabase, which serves auth,
+storage and table calls from memory after an injected delay (--latency
+storage_upload=120 ...). Uploads come from test.jpg re-encoded at several
+resolutions. Each scenario and concurrency level reports p50/p95/p99
+latency, throughput, errors, peak RSS and a per-stage breakdown; the whole
+run is written as JSON so runs can be compared.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import os
+import platform
+import resource
+import secrets
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from ..telemetry import percentile
+from .corpus import DEFAULT_SIZES, DEFAULT_SOURCE, build_corpus
+from .fake_supabase import DEFAULT_LATENCY_MS, FakeSupabase, LatencyProfile, install
+
+SCENARIOS = ("predict", "predict_batch", "history", "history_conditional", "auth_profile", "login")
+PASSWORD = "benchmark-password"
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _parse_latency(values: list[str]) -> dict:
+    latency = {}
+    for value in values:
+        operation, _, milliseconds = value.partition("=")
+        if operation not in DEFAULT_LATENCY_MS or not milliseconds:
+            raise argparse.ArgumentTypeError(
+                f"--latency expects OPERATION=MS with OPERATION in {sorted(DEFAULT_LATENCY_MS)}"
+            )
+        latency[operation] = float(milliseconds)
+    return latency
+
+
+def configure_environment() -> None:
+    """Settings the app reads at import time; anything already set wins"""
+    os.environ.setdefault("SUPABASE_URL", "http://supabase.benchmark.local")
+    os.environ.setdefault("SUPABASE_KEY", "benchmark-anon-key")
+    os.environ.setdefault("SUPABASE_JWT_SECRET", secrets.token_hex(32))
+    os.environ.setdefault("SUPABASE_BUCKET", "uploads")
+    os.environ.setdefault("IMAGE_BASE_URL", "http://images.benchmark.local")
+
+
+class Workload:
+    """Builds the requests of each scenario and the data they need"""
+
+    def __init__(self, fake: FakeSupabase, corpus: list, users: int, history_rows: int, batch_images: int, unique_images: bool):
+        self.corpus = corpus
+        self.batch_images = batch_images
+        self.unique_images = unique_images
+        self._counter = itertools.count()
+        self.users = [fake.add_user(f"user{n}@benchmark.local", PASSWORD) for n in range(users)]
+        self.tokens = [fake.issue_token(user, lifetime=24 * 3600) for user in self.users]
+        self.etags = {}
+        for user in self.users:
+            for n in range(history_rows):
+                fake.table("uploads").insert({
+                    "file_name": f"seed_{n}.jpg",
+                    "file_hash": secrets.token_hex(32),
+                    "user_uuid": user["id"],
+                    "localization": "back",
+                    "url": f"uploads/seed_{n}.jpg",
+                    "prediction_result": "Benign",
+                    "prediction_confidence": 0.9,
+                    "model_version": "seed",
+                }).execute()
+        # Seeding must not count towards the first scenario's stage breakdown
+        fake.latency.reset()
+
+    def _image(self, n: int):
+        image = self.corpus[n % len(self.corpus)]
+        content = image.variant(n) if self.unique_images else image.content
+        return image, content
+
+    def request(self, scenario: str) -> dict:
+        n = next(self._counter)
+        user = n % len(self.users)
+        headers = {"Authorization": f"Bearer {self.tokens[user]}"}
+        if scenario == "predict":
+            image, content = self._image(n)
+            return {
+                "method": "POST", "url": "/predict/", "params": {"localization": "back"}, "headers": headers,
+                "files": {"image": (image.name, content, image.content_type)},
+            }
+        if scenario == "predict_batch":
+            files = []
+            for k in range(self.batch_images):
+                image, content = self._image(n * self.batch_images + k)
+                files.append(("images", (image.name, content, image.content_type)))
+            return {
+                "method": "POST", "url": "/predict/batch", "headers": headers,
+                "files": files, "data": {"localization": "back"},
+            }
+        if scenario in ("history", "history_conditional"):
+            if scenario == "history_conditional" and user in self.etags:
+                headers["If-None-Match"] = self.etags[user]
+            return {"method": "GET", "url": "/predict/history", "params": {"limit": 20}, "headers": headers, "user": user}
+        if scenario == "auth_profile":
+            return {"method": "GET", "url": "/auth/profile", "headers": headers}
+        if scenario == "login":
+            return {
+                "method": "POST", "url": "/auth/",
+                "params": {"email": self.users[user]["email"], "password": PASSWORD},
+            }
+        raise ValueError(f"Unknown scenario {scenario}")
+
+
+async def wait_until_ready(timeout: float = 600.0) -> None:
+    from ..inference import runtime
+    deadline = time.monotonic() + timeout
+    while not runtime.readiness.ready:
+        if runtime.readiness.state == "failed":
+            raise RuntimeError(f"Model failed to load: {runtime.readiness.error}")
+        if time.monotonic() > deadline:
+            raise TimeoutError("Model did not become ready")
+        await asyncio.sleep(0.2)
+
+
+def reset_stage_stats(fake: FakeSupabase) -> None:
+    from ..inference import runtime
+    from ..pipeline import pipeline_stats
+    fake.latency.reset()
+    pipeline_stats.reset()
+    if runtime.engine is not None:
+        runtime.engine.reset_stats()
+
+
+def stage_breakdown(fake: FakeSupabase) -> dict:
+    from ..inference import runtime
+    from ..pipeline import pipeline_stats
+    return {
+        "pipeline": pipeline_stats.as_dict()["routes"],
+        "batching": runtime.engine.stats() if runtime.engine is not None else None,
+        "supabase": fake.latency.as_dict(),
+    }
+
+
+async def run_level(client, workload: Workload, scenario: str, concurrency: int, requests: int, warmup: int,
+                    on_measure_start=None) -> dict:
+    latencies = []
+    statuses = {}
+
+    async def send(record: bool) -> None:
+        spec = workload.request(scenario)
+        user = spec.pop("user", None)
+        started = time.perf_counter()
+        response = await client.request(**spec)
+        elapsed = time.perf_counter() - started
+        if scenario == "history_conditional" and "etag" in response.headers:
+            workload.etags[user] = response.headers["etag"]
+        if record:
+            latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    for _ in range(warmup):
+        await send(record=False)
+    if on_measure_start is not None:
+        on_measure_start()
+
+    remaining = itertools.count()
+
+    async def worker() -> None:
+        while next(remaining) < requests:
+            await send(record=True)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    errors = sum(count for code, count in statuses.items() if code >= 400)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 0.5) * 1000, 2),
+            "p95": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99": round(percentile(ordered, 0.99) * 1000, 2),
+            "mean": round(statistics.fmean(ordered) * 1000, 2),
+            "max": round(ordered[-1] * 1000, 2),
+        },
+    }
+
+
+async def run(args, fake: FakeSupabase, corpus: list) -> list[dict]:
+    import httpx
+    from ..main import app
+
+    if not args.verbose:
+        logging.getLogger("api-logger").setLevel(logging.WARNING)
+    workload = Workload(fake, corpus, args.users, args.history_rows, args.batch_images, not args.repeat_images)
+    results = []
+    # What the app prints only shows with --verbose
+    app_stdout = contextlib.nullcontext(sys.stderr) if args.verbose else open(os.devnull, "w")
+    with app_stdout as app_output:
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            await wait_until_ready()
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                for scenario in args.scenarios:
+                    for concurrency in args.concurrency:
+                        with contextlib.redirect_stdout(app_output):
+                            result = await run_level(
+                                client, workload, scenario, concurrency, args.requests, args.warmup,
+                                on_measure_start=lambda: reset_stage_stats(fake)
+                            )
+                        result["rss_bytes"] = _rss_bytes()
+                        result["peak_rss_bytes"] = _peak_rss_bytes()
+                        result["stages"] = stage_breakdown(fake)
+                        results.append(result)
+                        print(
+                            f"{scenario:<20} {concurrency:>5} {result['throughput_rps']:>9} "
+                            f"{result['latency_ms']['p50']:>9} {result['latency_ms']['p95']:>9} "
+                            f"{result['latency_ms']['p99']:>9} {result['errors']:>7} "
+                            f"{result['peak_rss_bytes'] / 2**20:>10.1f}",
+                            flush=True
+                        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API end to end with a fake Supabase")
+    parser.add_argument("--scenarios", nargs="+", default=["predict", "history", "auth_profile"], choices=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before each level")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="OPERATION=MS",
+                        help=f"Injected Supabase latency; defaults: {DEFAULT_LATENCY_MS}")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative +/- jitter on injected latency")
+    parser.add_argument("--image", default=DEFAULT_SOURCE, help="Source image of the upload corpus")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES), help="Longest-side sizes of the corpus")
+    parser.add_argument("--formats", nargs="+", default=["JPEG"], choices=["JPEG", "PNG"])
+    parser.add_argument("--repeat-images", action="store_true",
+                        help="Upload identical bytes each time, so the prediction cache answers repeats")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--history-rows", type=int, default=200, help="Seeded uploads per user")
+    parser.add_argument("--batch-images", type=int, default=4, help="Images per predict_batch request")
+    parser.add_argument("--output", help="Results JSON path (default: benchmark-<UTC timestamp>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's own output (sent to stderr)")
+    args = parser.parse_args(argv)
+
+    configure_environment()
+    latency = LatencyProfile(_parse_latency(args.latency), jitter=args.jitter)
+    fake = FakeSupabase(os.environ["SUPABASE_URL"], os.environ["SUPABASE_JWT_SECRET"], latency)
+    # Must happen before the app is imported: modules create their clients at import time
+    install(fake)
+
+    corpus = build_corpus(args.image, args.sizes, args.formats)
+    started_at = datetime.now(timezone.utc)
+    print(f"{'scenario':<20} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'peak MiB':>10}")
+    results = asyncio.run(run(args, fake, corpus))
+
+    import torch
+    from ..inference import runtime
+    report = {
+        "started_at": started_at.isoformat(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+        },
+        "config": {
+            "inference": {key: value for key, value in runtime.stats().items() if key in ("mode", "backend", "model_version")},
+            "environment": {
+                key: value for key, value in sorted(os.environ.items())
+                if key.startswith(("INFERENCE_", "PIPELINE_", "PREDICTION_CACHE", "HISTORY_", "AUTH_", "LOG_", "UPLOAD_", "MODEL_"))
+            },
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "users": args.users,
+            "history_rows": args.history_rows,
+            "batch_images": args.batch_images,
+            "unique_images": not args.repeat_images,
+            "latency_ms": latency.latency_ms,
+            "jitter": latency.jitter,
+        },
+        "corpus": [image.as_dict() for image in corpus],
+        "results": results,
+    }
+    output = args.output or f"benchmark-{started_at.strftime('%Y%m%dT%H%M%SZ')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
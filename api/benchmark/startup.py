@@ -0,0 +1,141 @@
+"""Startup profile: what importing the app costs, module by module
+
+    python -m api.benchmark.startup [--load] [--top 25] [--runs 3] [--output startup.json]
+
+Imports api.main in a fresh interpreter under `python -X importtime` and
+reports the time until the app can serve (the "boot" phase), broken down by
+top-level package, by api module (cumulative, so each includes what it
+imports) and by the slowest individual modules. With --load the model is
+then loaded as the first predict request would, and its imports are
+reported as a separate "load" phase.
+
+With --runs N the fastest run is reported; the first run after installing
+or editing the code also pays for compiling bytecode.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Optional
+
+MARKER = "-- startup profile: load --"
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHILD = f"""
+import json, sys, time
+started = time.perf_counter()
+import api.main
+timings = {{"boot_s": time.perf_counter() - started}}
+if {{load}}:
+    from api.inference import runtime
+    print({MARKER!r}, file=sys.stderr, flush=True)
+    loading = time.perf_counter()
+    runtime.load()
+    timings["load_s"] = time.perf_counter() - loading
+    runtime.stop()
+print(json.dumps(timings))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Per-phase lists of (module, self µs, cumulative µs, depth) from -X importtime output"""
+    phases = {"boot": [], "load": []}
+    phase = "boot"
+    for line in stderr.splitlines():
+        if line == MARKER:
+            phase = "load"
+            continue
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # One space after the separator, then two per nesting level
+        module = name[1:]
+        depth = (len(module) - len(module.lstrip())) // 2
+        phases[phase].append((module.strip(), int(self_us), int(cumulative_us), depth))
+    return phases
+
+
+def summarize(modules: list, top: int) -> dict:
+    packages = defaultdict(int)
+    for module, self_us, _, _ in modules:
+        packages[module.split(".")[0]] += self_us
+    api_modules = [(module, cumulative_us) for module, _, cumulative_us, _ in modules if module.split(".")[0] == "api"]
+    slowest = sorted(modules, key=lambda entry: entry[1], reverse=True)[:top]
+
+    def ms(us: int) -> float:
+        return round(us / 1000, 1)
+
+    return {
+        "modules": len(modules),
+        "import_ms": ms(sum(self_us for _, self_us, _, _ in modules)),
+        "packages": [
+            {"package": package, "self_ms": ms(us)}
+            for package, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        ],
+        "api_modules": [
+            {"module": module, "cumulative_ms": ms(us)}
+            for module, us in sorted(api_modules, key=lambda item: item[1], reverse=True)[:top]
+        ],
+        "slowest_modules": [
+            {"module": module, "self_ms": ms(self_us), "cumulative_ms": ms(cumulative_us)}
+            for module, self_us, cumulative_us, _ in slowest
+        ],
+    }
+
+
+def profile(load: bool = False, top: int = 25, env: Optional[dict] = None) -> dict:
+    """Import the app (and with `load`, the model) in a fresh interpreter and summarize the cost"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD.replace("{load}", str(load))],
+        cwd=ROOT,
+        env={**os.environ, **(env or {})},
+        capture_output=True,
+        text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing the app failed:\n{completed.stderr[-4000:]}")
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    phases = parse_importtime(completed.stderr)
+    report = {"boot": {"wall_s": round(timings["boot_s"], 3), **summarize(phases["boot"], top)}}
+    if load:
+        report["load"] = {"wall_s": round(timings["load_s"], 3), **summarize(phases["load"], top)}
+    return report
+
+
+def print_phase(name: str, phase: dict) -> None:
+    print(f"\n{name}: {phase['wall_s']:.2f} s wall, {phase['modules']} modules, {phase['import_ms']:.0f} ms importing")
+    print(f"  {'package':<40} {'self ms':>10}")
+    for entry in phase["packages"]:
+        print(f"  {entry['package']:<40} {entry['self_ms']:>10.1f}")
+    if phase["api_modules"]:
+        print(f"  {'api module':<40} {'cumul. ms':>10}")
+        for entry in phase["api_modules"]:
+            print(f"  {entry['module']:<40} {entry['cumulative_ms']:>10.1f}")
+    print(f"  {'slowest module':<40} {'self ms':>10} {'cumul. ms':>10}")
+    for entry in phase["slowest_modules"]:
+        print(f"  {entry['module'][:40]:<40} {entry['self_ms']:>10.1f} {entry['cumulative_ms']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the import cost of starting the API")
+    parser.add_argument("--load", action="store_true", help="Also load the model and profile its imports")
+    parser.add_argument("--top", type=int, default=25, help="Entries per table")
+    parser.add_argument("--runs", type=int, default=1, help="Profile this many times and report the fastest boot")
+    parser.add_argument("--output", help="Also write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    reports = [profile(args.load, args.top) for _ in range(args.runs)]
+    report = min(reports, key=lambda r: r["boot"]["wall_s"])
+    print_phase("boot (import api.main)", report["boot"])
+    if args.load:
+        print_phase("load (first model load)", report["load"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
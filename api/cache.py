@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after a time-to-live
+
+    Safe to share between the event loop and worker threads. Each entry can
+    carry its own expiry, which is never later than the cache-wide TTL.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        """Store a value; `expires_at` is a time.monotonic() deadline"""
+        deadline = time.monotonic() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._entries[key] = (value, deadline)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ResponseCache:
+    """Serialized responses grouped by owner, all dropped when the owner's data changes
+
+    Take a `token()` before reading the data a response is built from and
+    pass it to `set`; a response read before a later `invalidate` is then
+    never stored.
+    """
+
+    def __init__(self, max_owners: int = 1024, ttl: float = 30.0, max_entries_per_owner: int = 32):
+        self.ttl = ttl
+        self.max_entries_per_owner = max_entries_per_owner
+        self._owners = TTLCache(max_entries=max_owners, ttl=ttl)
+        self._invalidated = TTLCache(max_entries=max_owners, ttl=ttl)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def token(self) -> int:
+        return self._generation
+
+    def get(self, owner: Hashable, key: Hashable) -> Any:
+        entries = self._owners.get(owner)
+        value = entries.get(key) if entries is not None else None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, owner: Hashable, key: Hashable, value: Any, token: int) -> None:
+        with self._lock:
+            if self._invalidated.get(owner, -1) > token:
+                return
+            entries = self._owners.get(owner)
+            if entries is None:
+                entries = {}
+                self._owners.set(owner, entries)
+            entries[key] = value
+            while len(entries) > self.max_entries_per_owner:
+                entries.pop(next(iter(entries)))
+
+    def invalidate(self, owner: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._invalidated.set(owner, self._generation)
+            self._owners.pop(owner)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "owners": len(self._owners),
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,227 @@
+"""Content-addressed storage for uploaded images
+
+With CONTENT_ADDRESSED_STORAGE on (it is off by default), an upload is
+stored under the SHA-256 of its bytes instead of a random name:
+
+    sha256/<hex digest><extension>
+
+Every `uploads` row for the same image points at that one object through
+its `url` column (file_name keeps the per-upload name). Before uploading,
+the API looks for a row that already references the object; when there is
+one, the storage upload and the derivatives are skipped and the row reuses
+them. Objects are written with upsert, so two identical uploads racing each
+other simply write the same bytes twice. An upload whose row fails to save
+leaves its content-addressed objects behind, since a concurrent upload of
+the same image may be about to reference them.
+
+Objects stored earlier under random names are migrated with:
+
+    python -m api.content_store dedupe [--dry-run] [--concurrency 4] [--min-age 3600]
+
+Each row's object is copied to its content address on the storage server
+(or dropped, when that address already holds the same bytes), the row is
+repointed, and the old object is deleted. Derivatives are moved along with
+their original. The command reports how much space it reclaimed, and pages
+by id through rows not yet migrated, so it can be stopped and rerun.
+
+It then sweeps the content addresses no row references, such as those left
+by failed uploads. Objects changed within the last `--min-age` seconds are
+kept, as an upload in progress may not have inserted its row yet.
+"""
+import argparse
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from .derivatives import COLUMNS, derivative_path
+
+logger = logging.getLogger("api-logger")
+
+CONTENT_ADDRESSED_STORAGE = os.environ.get("CONTENT_ADDRESSED_STORAGE", "false").lower() == "true"
+PREFIX = "sha256"
+# Extensions that name the same format, so identical bytes get one address
+EXTENSIONS = {".jpeg": ".jpg", ".tif": ".tiff"}
+
+counts = {"uploaded": 0, "deduplicated": 0}
+
+
+def object_key(file_hash: str, file_name: str) -> str:
+    """Content address of an image, keeping its (normalized) extension for readable URLs"""
+    extension = os.path.splitext(file_name)[1].lower()
+    return f"{PREFIX}/{file_hash}{EXTENSIONS.get(extension, extension)}"
+
+
+def is_content_addressed(url: str, bucket_name: str) -> bool:
+    return url.startswith(f"{bucket_name}/{PREFIX}/")
+
+
+def stored_columns(row: dict) -> dict:
+    """Derivative columns of an existing row that are filled in"""
+    return {column: row[column] for column in COLUMNS.values() if row.get(column)}
+
+
+def object_size(bucket, path: str) -> int:
+    info = bucket.info(path)
+    size = info.get("size")
+    if size is None:
+        size = (info.get("metadata") or {}).get("size", 0)
+    return int(size or 0)
+
+
+def stats() -> dict:
+    return {"content_addressed": CONTENT_ADDRESSED_STORAGE, **counts}
+
+
+def dedupe(client, bucket_name: str, limit: Optional[int] = None, page_size: int = 100,
+           concurrency: int = 4, dry_run: bool = False) -> dict:
+    """Move existing uploads to their content addresses, dropping duplicate objects"""
+    bucket = client.storage.from_(bucket_name)
+    prefix = f"{bucket_name}/"
+    report = {"processed": 0, "moved": 0, "deduplicated": 0, "skipped": 0, "failed": 0, "bytes_reclaimed": 0}
+    # Addresses known to hold their object; with --dry-run nothing is copied, so remember them here
+    present = set()
+
+    def relocate(old: str, new: str) -> int:
+        """Copy `old` to `new` unless it is already there; returns the bytes that deleting `old` frees"""
+        if new in present or bucket.exists(new):
+            present.add(new)
+            return object_size(bucket, old)
+        if not dry_run:
+            bucket.copy(old, new)
+        present.add(new)
+        return 0
+
+    def process(row: dict) -> tuple[str, int]:
+        url = row.get("url") or ""
+        if not row.get("file_hash") or not url.startswith(prefix):
+            logger.warning(f"Skipping upload {row['id']}: no file hash or object in {bucket_name}")
+            return "skipped", 0
+        old = url[len(prefix):]
+        key = object_key(row["file_hash"], row.get("file_name") or old)
+        removals = [old]
+        reclaimed = relocate(old, key)
+        changes = {"url": f"{prefix}{key}"}
+        for kind, column in COLUMNS.items():
+            stored = row.get(column) or ""
+            if stored.startswith(prefix) and not is_content_addressed(stored, bucket_name):
+                old_derivative = stored[len(prefix):]
+                new_derivative = derivative_path(key, kind)
+                reclaimed += relocate(old_derivative, new_derivative)
+                changes[column] = f"{prefix}{new_derivative}"
+                removals.append(old_derivative)
+        if not dry_run:
+            # Repoint the row before deleting, so it never references a missing object.
+            # The update moves its updated_at, which changes the owner's history ETag
+            client.table("uploads").update(changes).eq("id", row["id"]).execute()
+            bucket.remove(removals)
+        return ("deduplicated" if reclaimed else "moved"), reclaimed
+
+    def process_group(rows: list) -> list:
+        # Rows sharing an address run in order, so only the first copies the object
+        outcomes = []
+        for row in rows:
+            try:
+                outcomes.append(process(row))
+            except Exception as e:
+                logger.error(f"Failed to migrate upload {row['id']}: {e}")
+                outcomes.append(("failed", 0))
+        return outcomes
+
+    last_id = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while limit is None or report["processed"] < limit:
+            size = page_size if limit is None else min(page_size, limit - report["processed"])
+            columns = ", ".join(["id", "file_name", "file_hash", "url", *COLUMNS.values()])
+            query = client.table("uploads").select(columns).not_.like("url", f"{prefix}{PREFIX}/%")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            rows = query.order("id").limit(size).execute().data
+            if not rows:
+                break
+            groups = defaultdict(list)
+            for row in rows:
+                groups[row.get("file_hash") or row["id"]].append(row)
+            for outcomes in executor.map(process_group, groups.values()):
+                for outcome, reclaimed in outcomes:
+                    report["processed"] += 1
+                    report[outcome] += 1
+                    report["bytes_reclaimed"] += reclaimed
+            # Failed rows keep their old url; step past them instead of retrying forever
+            last_id = rows[-1]["id"]
+            logger.info(f"Dedupe: {report}")
+    return report
+
+
+def sweep(client, bucket_name: str, min_age: float = 3600, page_size: int = 100, dry_run: bool = False) -> dict:
+    """Delete content-addressed objects that no `uploads` row references"""
+    bucket = client.storage.from_(bucket_name)
+    prefix = f"{bucket_name}/"
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=min_age)
+    report = {"checked": 0, "recent": 0, "unreferenced": 0, "bytes_reclaimed": 0}
+    unreferenced = []
+
+    def changed_at(entry: dict) -> Optional[datetime]:
+        value = entry.get("updated_at") or entry.get("created_at")
+        return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+    offset = 0
+    while True:
+        entries = bucket.list(PREFIX, {"limit": page_size, "offset": offset, "sortBy": {"column": "name", "order": "asc"}})
+        if not entries:
+            break
+        offset += len(entries)
+        paths = {f"{PREFIX}/{entry['name']}": entry for entry in entries}
+        referenced = set()
+        for column in ["url", *COLUMNS.values()]:
+            urls = [f"{prefix}{path}" for path in paths]
+            rows = client.table("uploads").select(column).in_(column, urls).execute().data
+            referenced.update(row[column][len(prefix):] for row in rows)
+        for path, entry in paths.items():
+            report["checked"] += 1
+            if path in referenced:
+                continue
+            changed = changed_at(entry)
+            if changed is None or changed > cutoff:
+                report["recent"] += 1
+                continue
+            report["unreferenced"] += 1
+            report["bytes_reclaimed"] += int((entry.get("metadata") or {}).get("size") or 0)
+            unreferenced.append(path)
+    # Deleted after listing, so removals do not shift the listing's offsets
+    if not dry_run:
+        for start in range(0, len(unreferenced), page_size):
+            bucket.remove(unreferenced[start:start + page_size])
+    logger.info(f"Sweep: {report}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage content-addressed storage of uploaded images")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("dedupe", help="Move existing uploads to content addresses and drop duplicates")
+    run.add_argument("--bucket", default=os.environ.get("SUPABASE_BUCKET"))
+    run.add_argument("--limit", type=int, help="Stop after this many uploads")
+    run.add_argument("--page-size", type=int, default=100)
+    run.add_argument("--concurrency", type=int, default=4, help="Distinct images processed in parallel")
+    run.add_argument("--dry-run", action="store_true", help="Report what would be reclaimed without changing anything")
+    run.add_argument("--min-age", type=float, default=3600,
+                     help="Seconds an unreferenced object must be unchanged before the sweep deletes it")
+    args = parser.parse_args(argv)
+
+    if not args.bucket:
+        parser.error("--bucket or SUPABASE_BUCKET is required")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    from .supabase import supabase
+    report = dedupe(supabase, args.bucket, args.limit, args.page_size, args.concurrency, args.dry_run)
+    print(report)
+    swept = sweep(supabase, args.bucket, args.min_age, args.page_size, args.dry_run)
+    print(swept)
+    reclaimed = report["bytes_reclaimed"] + swept["bytes_reclaimed"]
+    print(f"{'Would reclaim' if args.dry_run else 'Reclaimed'} {reclaimed / (1024 * 1024):.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import httpx
+from dotenv import load_dotenv
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
+
+from .telemetry import span
+
+load_dotenv()
+
+logger = logging.getLogger("api-logger")
+
+# One pooled keep-alive connection pool serves every PostgREST, Storage and
+# Auth call of this worker process
+SUPABASE_TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", "20"))
+SUPABASE_CONNECT_TIMEOUT = float(os.environ.get("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_MAX_CONNECTIONS = int(os.environ.get("SUPABASE_MAX_CONNECTIONS", "64"))
+SUPABASE_MAX_KEEPALIVE = int(os.environ.get("SUPABASE_MAX_KEEPALIVE", "32"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.environ.get("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+# Reads are retried on network errors and timeouts, with exponential backoff;
+# writes only when the connection could not be opened, so they never run twice
+SUPABASE_RETRIES = int(os.environ.get("SUPABASE_RETRIES", "2"))
+SUPABASE_RETRY_BACKOFF = float(os.environ.get("SUPABASE_RETRY_BACKOFF", "0.2"))
+
+T = TypeVar("T")
+
+
+class SupabaseData:
+    """Async access to the tables, storage buckets and auth calls the API uses
+
+    Owns the async Supabase clients of this process, on one shared httpx
+    connection pool. Signing a user in switches a Supabase client over to
+    that user's token, so sign-in and sign-up get a client of their own and
+    the data client keeps the service key. `start()` opens them (the app
+    does so on startup, otherwise the first call does) and `close()`
+    releases the pool's connections.
+    """
+
+    def __init__(self, url: Optional[str] = None, key: Optional[str] = None):
+        self.url = url
+        self.key = key
+        self._client = None
+        self._auth = None
+        self._http = None
+        self._opening = None
+        self.retries = 0
+
+    async def start(self) -> AsyncClient:
+        if self._client is not None:
+            return self._client
+        if self._opening is None:
+            self._opening = asyncio.ensure_future(self._open())
+        try:
+            return await asyncio.shield(self._opening)
+        except BaseException:
+            if self._opening.done():
+                self._opening = None
+            raise
+
+    async def _open(self) -> AsyncClient:
+        url = self.url or os.environ.get("SUPABASE_URL")
+        key = self.key or os.environ.get("SUPABASE_KEY")
+        if not url or not key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY environment variables must be set")
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+            # A client given its own transport ignores `limits`, so they go on the transport
+            transport=httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_MAX_CONNECTIONS,
+                    max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                    keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY
+                ),
+                # Retries failed connection attempts, which never reached the server
+                retries=SUPABASE_RETRIES
+            ),
+            follow_redirects=True
+        )
+        def options() -> AsyncClientOptions:
+            # Server-side clients keep no session between requests
+            return AsyncClientOptions(httpx_client=self._http, persist_session=False, auto_refresh_token=False)
+
+        self._auth = await acreate_client(url, key, options=options())
+        self._client = await acreate_client(url, key, options=options())
+        return self._client
+
+    async def close(self) -> None:
+        http, self._http, self._client, self._auth, self._opening = self._http, None, None, None, None
+        if http is not None:
+            await http.aclose()
+
+    async def _read(self, call: Callable[[AsyncClient], Awaitable[T]]) -> T:
+        """Run an idempotent call, retrying network errors and timeouts"""
+        client = await self.start()
+        for attempt in range(SUPABASE_RETRIES + 1):
+            try:
+                return await call(client)
+            except httpx.TransportError as e:
+                if attempt == SUPABASE_RETRIES:
+                    raise
+                self.retries += 1
+                logger.warning(f"Retrying Supabase request after {type(e).__name__}")
+                await asyncio.sleep(SUPABASE_RETRY_BACKOFF * 2 ** attempt)
+
+    async def _write(self, call: Callable[[AsyncClient], Awaitable[T]]) -> T:
+        return await call(await self.start())
+
+    async def _user_auth(self, call: Callable[[AsyncClient], Awaitable[T]]) -> T:
+        await self.start()
+        return await call(self._auth)
+
+    # uploads
+
+    async def find_prediction(self, file_hash: str, model_version: str) -> Optional[dict]:
+        """Prediction columns of an earlier upload of the same bytes scored by `model_version`"""
+        with span("db.select"):
+            response = await self._read(lambda client: client.table("uploads").select(
+                "prediction_result, prediction_confidence"
+            ).eq("file_hash", file_hash).eq("model_version", model_version).limit(1).execute())
+        return response.data[0] if response.data else None
+
+    async def find_upload_by_object(self, file_hash: str, url: str) -> Optional[dict]:
+        """An upload already referencing the stored object at `url`"""
+        with span("db.select"):
+            # "*" rather than a column list, so databases without the derivative columns still work
+            response = await self._read(lambda client: client.table("uploads").select("*").eq(
+                "file_hash", file_hash
+            ).eq("url", url).limit(1).execute())
+        return response.data[0] if response.data else None
+
+    async def find_upload_by_prefix(self, user_uuid: str, prefix: str) -> Optional[dict]:
+        """A user's upload whose file_name starts with `prefix`"""
+        with span("db.select"):
+            response = await self._read(lambda client: client.table("uploads").select("*").eq(
+                "user_uuid", user_uuid
+            ).like("file_name", f"{prefix}%").limit(1).execute())
+        return response.data[0] if response.data else None
+
+    async def uploads_by_ids(self, user_uuid: str, ids: list[int], columns: str) -> list[dict]:
+        """A user's uploads with the given ids, in no particular order"""
+        if not ids:
+            return []
+        with span("db.select"):
+            response = await self._read(lambda client: client.table("uploads").select(columns).eq(
+                "user_uuid", user_uuid
+            ).in_("id", ids).execute())
+        return response.data or []
+
+    async def latest_update(self, user_uuid: str) -> Optional[str]:
+        """When any of a user's uploads was last inserted or rewritten"""
+        with span("db.select"):
+            response = await self._read(lambda client: client.table("uploads").select("updated_at").eq(
+                "user_uuid", user_uuid
+            ).order("updated_at", desc=True).limit(1).execute())
+        return response.data[0]["updated_at"] if response.data else None
+
+    async def insert_uploads(self, records: list[dict]) -> list[dict]:
+        with span("db.insert"):
+            response = await self._write(lambda client: client.table("uploads").insert(records).execute())
+        return response.data or []
+
+    async def upload_history(self, user_uuid: str, columns: str, position: Optional[dict], limit: int) -> list[dict]:
+        """Newest-first page of a user's uploads, starting after the (created_at, id) `position`"""
+        def query(client: AsyncClient):
+            builder = client.table("uploads").select(columns).eq("user_uuid", user_uuid)
+            if position is not None:
+                created_at = json.dumps(position["created_at"])
+                builder = builder.or_(
+                    f"created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{position['id']})"
+                )
+            return builder.order("created_at", desc=True).order("id", desc=True).limit(limit).execute()
+
+        with span("db.select"):
+            response = await self._read(query)
+        return response.data or []
+
+    # logs
+
+    async def insert_logs(self, records: list[dict]) -> None:
+        with span("logs.write"):
+            await self._write(lambda client: client.table("logs").insert(records).execute())
+
+    # items
+
+    async def list_items(self) -> list[dict]:
+        with span("db.select"):
+            response = await self._read(lambda client: client.table("items").select("*").execute())
+        return response.data or []
+
+    async def get_item(self, item_id: int) -> Optional[dict]:
+        with span("db.select"):
+            response = await self._read(lambda client: client.table("items").select("*").eq("id", item_id).execute())
+        return response.data[0] if response.data else None
+
+    async def insert_item(self, content: str) -> Optional[dict]:
+        with span("db.insert"):
+            response = await self._write(lambda client: client.table("items").insert({"content": content}).execute())
+        return response.data[0] if response.data else None
+
+    # storage
+
+    async def upload_object(self, bucket: str, path: str, content: bytes, content_type: str,
+                            upsert: bool = False) -> Optional[str]:
+        """Store an object; returns its `bucket/path`, or None if storage did not confirm it"""
+        options = {"content_type": content_type}
+        if upsert:
+            options["upsert"] = "true"
+        with span("storage.upload"):
+            response = await self._write(lambda client: client.storage.from_(bucket).upload(path, content, options))
+        return response.fullPath if response.path else None
+
+    async def remove_objects(self, bucket: str, paths: list[str]) -> None:
+        if paths:
+            with span("storage.remove"):
+                await self._read(lambda client: client.storage.from_(bucket).remove(paths))
+
+    # auth
+
+    async def get_user(self, token: str) -> Any:
+        """The user an access token belongs to, as Supabase Auth sees it now"""
+        with span("auth.remote"):
+            return await self._read(lambda client: client.auth.get_user(token))
+
+    async def sign_in(self, email: str, password: str) -> Any:
+        with span("auth.sign_in"):
+            return await self._user_auth(lambda client: client.auth.sign_in_with_password({
+                "email": email,
+                "password": password
+            }))
+
+    async def sign_up(self, email: str, password: str, metadata: dict) -> Any:
+        with span("auth.sign_up"):
+            return await self._user_auth(lambda client: client.auth.sign_up({
+                "email": email,
+                "password": password,
+                "options": {"data": metadata}
+            }))
+
+    def stats(self) -> dict:
+        return {
+            "connected": self._client is not None,
+            "max_connections": SUPABASE_MAX_CONNECTIONS,
+            "max_keepalive": SUPABASE_MAX_KEEPALIVE,
+            "timeout": SUPABASE_TIMEOUT,
+            "retries": self.retries,
+        }
+
+
+data = SupabaseData()
@@ -0,0 +1,190 @@
+"""Compact derivatives stored next to each uploaded original
+
+    thumbnail    longest side THUMBNAIL_SIZE, WebP (or JPEG), for history screens
+    model_input  the exact 224x224 image the model scored, lossless PNG
+
+Uploads store them with the original from the image that is already
+decoded for validation. Their storage paths go into two nullable columns
+of `uploads`, which history prefixes with IMAGE_BASE_URL like `url`:
+
+    alter table uploads add column thumbnail_url text, add column model_input_url text;
+
+Generate them for rows stored before this existed, or with different
+settings, with:
+
+    python -m api.derivatives backfill [--limit N] [--concurrency 4]
+
+The backfill pages by id through rows missing a derivative, so it can be
+stopped and restarted at any point. Filling in a row moves its updated_at
+(the trigger is described with the history settings in
+api/routers/upload.py), so clients revalidating their history get a new
+ETag and the new thumbnails. API workers' history caches catch up within
+HISTORY_CACHE_TTL.
+"""
+import argparse
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+
+from .data import data
+from .inference.preprocess import INPUT_SIZE, decode, model_input_image, open_image
+from .telemetry import span
+
+logger = logging.getLogger("api-logger")
+
+DERIVATIVES_ENABLED = os.environ.get("DERIVATIVES_ENABLED", "true").lower() == "true"
+# Longest side in pixels. JPEGs are decoded at the reduced scale the model
+# needs (at least 224px on the short side), and thumbnails never upscale it
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", "256"))
+THUMBNAIL_FORMAT = os.environ.get("THUMBNAIL_FORMAT", "WEBP").upper()
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", "75"))
+STORE_MODEL_INPUT = os.environ.get("STORE_MODEL_INPUT", "false").lower() == "true"
+
+FORMATS = {"WEBP": ("image/webp", ".webp"), "JPEG": ("image/jpeg", ".jpg"), "PNG": ("image/png", ".png")}
+# Derivative kind -> `uploads` column holding its storage path
+COLUMNS = {"thumbnail": "thumbnail_url", "model_input": "model_input_url"}
+
+if THUMBNAIL_FORMAT not in ("WEBP", "JPEG"):
+    raise ValueError("THUMBNAIL_FORMAT must be 'WEBP' or 'JPEG'")
+
+
+def enabled_kinds() -> list[str]:
+    if not DERIVATIVES_ENABLED:
+        return []
+    return ["thumbnail", "model_input"] if STORE_MODEL_INPUT else ["thumbnail"]
+
+
+def derivative_path(file_name: str, kind: str) -> str:
+    """Object path of a derivative, next to the original `file_name`"""
+    stem = os.path.splitext(file_name)[0]
+    if kind == "thumbnail":
+        return f"{stem}.thumb{FORMATS[THUMBNAIL_FORMAT][1]}"
+    return f"{stem}.{INPUT_SIZE}{FORMATS['PNG'][1]}"
+
+
+def render(image: Image.Image, kind: str) -> tuple[bytes, str]:
+    """Encode one derivative of a decoded RGB image; returns (content, content type)"""
+    buffer = io.BytesIO()
+    if kind == "thumbnail":
+        thumbnail = image.copy()
+        thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BILINEAR)
+        thumbnail.save(buffer, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        return buffer.getvalue(), FORMATS[THUMBNAIL_FORMAT][0]
+    model_input_image(image).save(buffer, "PNG")
+    return buffer.getvalue(), FORMATS["PNG"][0]
+
+
+def store(bucket, bucket_name: str, file_name: str, image: Image.Image,
+          kinds: Optional[list[str]] = None, upsert: bool = False) -> dict:
+    """Render and upload derivatives of one original; returns {kind: object path}
+
+    Best effort: a derivative that fails is logged and left out, so it never
+    fails the upload it belongs to. `bucket` is a storage bucket client.
+    """
+    stored = {}
+    for kind in enabled_kinds() if kinds is None else kinds:
+        path = derivative_path(file_name, kind)
+        try:
+            with span(f"derivative.{kind}"):
+                content, content_type = render(image, kind)
+                options = {"content_type": content_type}
+                if upsert:
+                    options["upsert"] = "true"
+                bucket.upload(path, content, options)
+            stored[kind] = path
+        except Exception as e:
+            logger.error(f"Failed to store {kind} for {bucket_name}/{file_name}: {e}")
+    return stored
+
+
+async def store_async(bucket_name: str, file_name: str, image: Image.Image,
+                      kinds: Optional[list[str]] = None, upsert: bool = False) -> dict:
+    """`store` for the API: renders in the threadpool and uploads on the shared async client"""
+    stored = {}
+    for kind in enabled_kinds() if kinds is None else kinds:
+        path = derivative_path(file_name, kind)
+        try:
+            with span(f"derivative.{kind}"):
+                content, content_type = await run_in_threadpool(render, image, kind)
+                if await data.upload_object(bucket_name, path, content, content_type, upsert) is None:
+                    raise RuntimeError("storage did not confirm the upload")
+            stored[kind] = path
+        except Exception as e:
+            logger.error(f"Failed to store {kind} for {bucket_name}/{file_name}: {e}")
+    return stored
+
+
+def columns(bucket_name: str, paths: dict) -> dict:
+    """`uploads` columns for stored derivatives, in the same bucket/path form as `url`"""
+    return {COLUMNS[kind]: f"{bucket_name}/{path}" for kind, path in paths.items()}
+
+
+def backfill(client, bucket_name: str, limit: Optional[int] = None, page_size: int = 100,
+             concurrency: int = 4, kinds: Optional[list[str]] = None) -> dict:
+    """Add the missing `kinds` of derivatives to existing `uploads` rows"""
+    kinds = kinds or enabled_kinds() or ["thumbnail"]
+    bucket = client.storage.from_(bucket_name)
+    prefix = f"{bucket_name}/"
+    counts = {"processed": 0, "updated": 0, "failed": 0}
+    missing_any = ",".join(f"{COLUMNS[kind]}.is.null" for kind in kinds)
+
+    def process(row: dict) -> bool:
+        url = row.get("url") or ""
+        file_name = url[len(prefix):] if url.startswith(prefix) else row["file_name"]
+        try:
+            image = decode(open_image(bucket.download(file_name)))
+        except Exception as e:
+            logger.error(f"Skipping upload {row['id']}: cannot read {file_name}: {e}")
+            return False
+        missing = [kind for kind in kinds if not row.get(COLUMNS[kind])]
+        paths = store(bucket, bucket_name, file_name, image, missing, upsert=True)
+        if paths:
+            client.table("uploads").update(columns(bucket_name, paths)).eq("id", row["id"]).execute()
+        return len(paths) == len(missing)
+
+    last_id = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while limit is None or counts["processed"] < limit:
+            size = page_size if limit is None else min(page_size, limit - counts["processed"])
+            selected = ", ".join(["id", "file_name", "url", *(COLUMNS[kind] for kind in kinds)])
+            query = client.table("uploads").select(selected).or_(missing_any)
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            rows = query.order("id").limit(size).execute().data
+            if not rows:
+                break
+            for ok in executor.map(process, rows):
+                counts["processed"] += 1
+                counts["updated" if ok else "failed"] += 1
+            # Failed rows keep their null columns; step past them instead of retrying forever
+            last_id = rows[-1]["id"]
+            logger.info(f"Backfill: {counts}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage derivatives of uploaded images")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("backfill", help="Generate derivatives for uploads that have none")
+    run.add_argument("--bucket", default=os.environ.get("SUPABASE_BUCKET"))
+    run.add_argument("--limit", type=int, help="Stop after this many uploads")
+    run.add_argument("--page-size", type=int, default=100)
+    run.add_argument("--concurrency", type=int, default=4, help="Uploads processed in parallel")
+    run.add_argument("--kinds", nargs="+", choices=sorted(COLUMNS), help="Derivatives to generate")
+    args = parser.parse_args(argv)
+
+    if not args.bucket:
+        parser.error("--bucket or SUPABASE_BUCKET is required")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    from .supabase import supabase
+    counts = backfill(supabase, args.bucket, args.limit, args.page_size, args.concurrency, args.kinds)
+    print(counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import fcntl
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from .telemetry import span
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger("api-logger")
+
+# The model also returns each image's pooled ViT embedding (the CLS token its
+# classifier reads), and every new upload's embedding is appended to its
+# user's files under EMBEDDING_STORE_DIR. The directory must be on storage
+# every API worker can read and write.
+EMBEDDINGS_ENABLED = os.environ.get("EMBEDDINGS_ENABLED", "false").lower() == "true"
+EMBEDDING_STORE_DIR = os.environ.get("EMBEDDING_STORE_DIR", "embeddings")
+# Rows scored per matrix product; bounds a search's working memory
+EMBEDDING_SEARCH_CHUNK = int(os.environ.get("EMBEDDING_SEARCH_CHUNK", "4096"))
+
+_NAME = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+def split_embedding(result: dict) -> tuple[dict, Optional["np.ndarray"]]:
+    """A model result without its embedding, and the embedding if it had one"""
+    if "embedding" not in result:
+        return result, None
+    prediction = dict(result)
+    return prediction, prediction.pop("embedding")
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped embedding files, one pair per user and model version
+
+        <root>/<model version>/<user uuid>.vec    float16 rows, L2-normalized
+        <root>/<model version>/<user uuid>.ids    int64 `uploads` id of each row
+
+    Searches map both files read-only and score them in chunks of
+    `chunk_rows` with one matrix product each, so memory stays flat as a
+    history grows and old images never go through the model again.
+    Embeddings of different model versions are not comparable, so each
+    version has its own directory. Appends are serialized with a file lock.
+    """
+
+    def __init__(self, root: str, chunk_rows: int = 4096):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self.appended = 0
+        self.searches = 0
+        self.rows_scanned = 0
+
+    def _paths(self, model_version: str, user_uuid: str) -> tuple[str, str]:
+        # Both end up in a file path, so only plain names are accepted
+        if not _NAME.match(model_version) or not _NAME.match(user_uuid):
+            raise ValueError("Invalid model version or user id")
+        stem = os.path.join(self.root, model_version, user_uuid)
+        return f"{stem}.vec", f"{stem}.ids"
+
+    @contextmanager
+    def _locked(self, ids_path: str):
+        with self._locks_lock:
+            lock = self._locks.setdefault(ids_path, threading.Lock())
+        with lock, open(ids_path, "ab") as ids_file:
+            # Other worker processes append to the same files
+            fcntl.flock(ids_file, fcntl.LOCK_EX)
+            try:
+                yield ids_file
+            finally:
+                fcntl.flock(ids_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _count(vec_path: str, ids_path: str, dim: int) -> int:
+        """Rows present in both files; an append cut short leaves a longer tail in one of them"""
+        try:
+            return min(os.path.getsize(vec_path) // (dim * 2), os.path.getsize(ids_path) // 8)
+        except FileNotFoundError:
+            return 0
+
+    def append(self, model_version: str, user_uuid: str, upload_ids: list[int], vectors: Iterable) -> None:
+        """Add the embeddings of a user's uploads, given in the same order as `upload_ids`"""
+        import numpy as np
+        if not len(upload_ids):
+            return
+        matrix = np.asarray(list(vectors), dtype=np.float32)
+        if matrix.ndim != 2 or len(matrix) != len(upload_ids):
+            raise ValueError("Expected one embedding vector per upload id")
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = (matrix / np.maximum(norms, 1e-12)).astype(np.float16)
+        dim = matrix.shape[1]
+
+        vec_path, ids_path = self._paths(model_version, user_uuid)
+        os.makedirs(os.path.dirname(vec_path), exist_ok=True)
+        with self._locked(ids_path) as ids_file, open(vec_path, "ab") as vec_file:
+            rows = self._count(vec_path, ids_path, dim)
+            # Drop a torn tail before appending, so the files stay row-aligned
+            vec_file.truncate(rows * dim * 2)
+            ids_file.truncate(rows * 8)
+            vec_file.write(matrix.tobytes())
+            vec_file.flush()
+            ids_file.write(np.asarray(upload_ids, dtype=np.int64).tobytes())
+            ids_file.flush()
+        self.appended += len(upload_ids)
+
+    def search(self, model_version: str, user_uuid: str, query, limit: int = 10,
+               exclude: Iterable[int] = ()) -> list[tuple[int, float]]:
+        """A user's `limit` uploads most similar to `query`, as (upload id, cosine similarity), best first"""
+        import numpy as np
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        dim = len(query)
+        vec_path, ids_path = self._paths(model_version, user_uuid)
+        rows = self._count(vec_path, ids_path, dim)
+        self.searches += 1
+        if not rows or limit < 1:
+            return []
+
+        vectors = np.memmap(vec_path, dtype=np.float16, mode="r", shape=(rows, dim))
+        ids = np.memmap(ids_path, dtype=np.int64, mode="r", shape=(rows,))
+        excluded = np.asarray(list(exclude), dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        best_ids = np.empty(0, dtype=np.int64)
+        for start in range(0, rows, self.chunk_rows):
+            chunk_ids = np.asarray(ids[start:start + self.chunk_rows])
+            scores = vectors[start:start + self.chunk_rows].astype(np.float32) @ query
+            if len(excluded):
+                scores[np.isin(chunk_ids, excluded)] = -np.inf
+            # Keep only the running top `limit` across chunks
+            best_scores = np.concatenate([best_scores, scores])
+            best_ids = np.concatenate([best_ids, chunk_ids])
+            # An upload indexed twice (a re-score run restarted mid-page) is one result
+            best_ids, first = np.unique(best_ids, return_index=True)
+            best_scores = best_scores[first]
+            if len(best_scores) > limit:
+                keep = np.argpartition(best_scores, -limit)[-limit:]
+                best_scores, best_ids = best_scores[keep], best_ids[keep]
+        self.rows_scanned += rows
+
+        order = np.argsort(-best_scores, kind="stable")
+        return [
+            (int(best_ids[i]), round(float(best_scores[i]), 4))
+            for i in order if np.isfinite(best_scores[i])
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": EMBEDDINGS_ENABLED,
+            "appended": self.appended,
+            "searches": self.searches,
+            "rows_scanned": self.rows_scanned,
+        }
+
+
+embedding_store = EmbeddingStore(EMBEDDING_STORE_DIR, EMBEDDING_SEARCH_CHUNK)
+
+
+async def index_uploads(model_version: str, user_uuid: str, uploads: list[tuple[int, Optional["np.ndarray"]]]) -> None:
+    """Add new (upload id, embedding) pairs to a user's store
+
+    Best effort, like derivatives: a failure is logged and never fails the
+    upload. Uploads without an embedding are skipped. The store keeps ids
+    in an int64 file, so this relies on `uploads.id` being an integer; any
+    other id makes the append fail, which is only logged.
+    """
+    uploads = [(upload_id, embedding) for upload_id, embedding in uploads if embedding is not None]
+    if not uploads:
+        return
+    try:
+        with span("embeddings.append"):
+            await run_in_threadpool(
+                embedding_store.append,
+                model_version,
+                user_uuid,
+                [upload_id for upload_id, _ in uploads],
+                [embedding for _, embedding in uploads]
+            )
+    except Exception as e:
+        logger.error(f"Failed to index {len(uploads)} embeddings for user {user_uuid}: {e}")
@@ -0,0 +1,177 @@
+"""Self-contained model artifact for SkinCancerPredictor
+
+An artifact is a directory holding everything needed to rebuild the model
+without network access:
+
+    config.json        ViT configuration, including the 7-class label mapping
+    model.safetensors  weights, laid out for memory-mapped loading
+    skincheck.json     manifest: model version and benign/malignant grouping
+
+Build one from a training checkpoint with:
+
+    python -m api.inference.artifact build --output models/skincheck-vit
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+
+import torch
+from safetensors.torch import load_file, save_file
+from transformers import ViTConfig, ViTForImageClassification
+
+ARTIFACT_FORMAT = 1
+CONFIG_FILE = "config.json"
+WEIGHTS_FILE = "model.safetensors"
+MANIFEST_FILE = "skincheck.json"
+
+BASE_MODEL = "google/vit-base-patch16-224-in21k"
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+BENIGN_INDICES = [0, 3, 4, 6]
+MALIGNANT_INDICES = [1, 2, 5]
+
+
+def is_artifact(path) -> bool:
+    return bool(path) and os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def read_manifest(artifact_dir) -> dict:
+    with open(os.path.join(artifact_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"Unsupported model artifact format: {manifest.get('format')}")
+    return manifest
+
+
+def _file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_artifact(checkpoint_path, output_dir, base_model: str = BASE_MODEL, model_version: str = None) -> dict:
+    """Package a state-dict checkpoint into a local artifact directory"""
+    os.makedirs(output_dir, exist_ok=True)
+
+    config = ViTConfig.from_pretrained(base_model, num_labels=7)
+    config.id2label = {i: f"class_{i}" for i in range(7)}
+    config.label2id = {label: i for i, label in config.id2label.items()}
+    config.to_json_file(os.path.join(output_dir, CONFIG_FILE))
+
+    state_dict = torch.load(checkpoint_path, map_location="cpu")
+    # safetensors refuses shared or non-contiguous storage
+    state_dict = {name: tensor.detach().clone().contiguous() for name, tensor in state_dict.items()}
+
+    # Fail now, not at serving time, if the checkpoint does not fit the config
+    with torch.device("meta"):
+        model = ViTForImageClassification(config)
+    model.load_state_dict(state_dict, assign=True)
+
+    weights_path = os.path.join(output_dir, WEIGHTS_FILE)
+    save_file(state_dict, weights_path)
+    weights_sha256 = _file_sha256(weights_path)
+
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "model_version": model_version or f"vit-{weights_sha256[:12]}",
+        "weights_sha256": weights_sha256,
+        "base_model": base_model,
+        "binary_class_names": {"0": "Benign", "1": "Malignant"},
+        "benign_indices": BENIGN_INDICES,
+        "malignant_indices": MALIGNANT_INDICES,
+        "input_size": [3, config.image_size, config.image_size],
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def map_weights(weights_path) -> dict:
+    """Tensors that view a private memory mapping of a safetensors file
+
+    Unlike `load_file`, nothing is copied: the tensors point straight at the
+    page cache, so every process mapping the same file shares one physical
+    copy of the weights. Writing to a tensor would give that process its own
+    copy of the touched pages; inference never writes to them.
+    """
+    with open(weights_path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    data_start = 8 + header_size
+    storage = torch.UntypedStorage.from_file(str(weights_path), shared=False, nbytes=os.path.getsize(weights_path))
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = (data_start + offset for offset in info["data_offsets"])
+        if begin % dtype.itemsize:
+            # Misaligned for its dtype, so it cannot be viewed in place
+            raw = torch.empty(0, dtype=torch.uint8).set_(storage, begin, (end - begin,))
+            tensors[name] = raw.clone().view(dtype).reshape(info["shape"])
+        else:
+            tensors[name] = torch.empty(0, dtype=dtype).set_(storage, begin // dtype.itemsize, info["shape"])
+    return tensors
+
+
+def load_artifact(artifact_dir, device="cpu", shared_weights: bool = False):
+    """Build the model straight from an artifact; returns (model, manifest)
+
+    The module tree is created on the meta device, so no weights are
+    allocated or randomly initialised, and the loaded tensors are assigned in
+    place instead of being copied into it. On CPU, `shared_weights` keeps the
+    tensors on the file mapping so processes serving the same artifact share
+    its memory; otherwise each process gets a private copy, which keeps
+    working if the file is overwritten while the server runs.
+    """
+    manifest = read_manifest(artifact_dir)
+    config = ViTConfig.from_json_file(os.path.join(artifact_dir, CONFIG_FILE))
+    with torch.device("meta"):
+        model = ViTForImageClassification(config)
+    weights_path = os.path.join(artifact_dir, WEIGHTS_FILE)
+    if torch.device(device).type != "cpu":
+        state_dict = load_file(weights_path, device=str(device))
+    elif shared_weights:
+        state_dict = map_weights(weights_path)
+    else:
+        state_dict = {name: tensor.clone() for name, tensor in map_weights(weights_path).items()}
+    model.load_state_dict(state_dict, assign=True)
+    model.eval()
+    return model, manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Package the SkinCheck model as a local artifact")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Build an artifact from a training checkpoint")
+    build.add_argument("--checkpoint", help="Path to vit_checkpoint.pth (downloaded from the Hub if omitted)")
+    build.add_argument("--output", required=True, help="Artifact directory to write")
+    build.add_argument("--base-model", default=BASE_MODEL)
+    build.add_argument("--model-version", help="Version tag stored with predictions")
+    args = parser.parse_args(argv)
+
+    checkpoint = args.checkpoint
+    if not checkpoint:
+        from huggingface_hub import hf_hub_download
+        checkpoint = hf_hub_download(repo_id="Arif194/SkinCheck", filename="vit_checkpoint.pth")
+    manifest = build_artifact(checkpoint, args.output, base_model=args.base_model, model_version=args.model_version)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
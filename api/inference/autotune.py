@@ -0,0 +1,256 @@
+"""Benchmark inference settings on this host and remember the best ones
+
+    python -m api.inference.autotune --objective throughput --processes 4
+
+Every combination of backend, intra-op thread count and batch size is timed
+on synthetic inputs. Thread counts are capped at this host's CPUs divided by
+--processes, the number of processes that run the model at the same time
+(uvicorn workers, times INFERENCE_WORKERS in process mode), so the winner
+does not oversubscribe cores once every worker is up.
+
+Objectives:
+
+    throughput  most images per second, among settings whose batch p95
+                stays within --target-ms
+    latency     fastest single image (p95), with the largest batch size
+                that still stays within --target-ms
+
+The winner is stored in INFERENCE_AUTOTUNE_FILE under a key made of the CPU
+model, CPU count, torch version, device, model version and process count.
+The API applies it on boot (see INFERENCE_AUTOTUNE in runtime.py).
+
+int8 is left out of the default candidates because it changes the model's
+outputs; check it with api.inference.parity before passing --backends int8.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import torch
+
+from ..telemetry import percentile
+from .artifact import is_artifact, read_manifest
+from .backends import BACKENDS, INPUT_SHAPE
+from .predictor import SkinCancerPredictor, checkpoint_version
+
+AUTOTUNE_FILE = os.environ.get("INFERENCE_AUTOTUNE_FILE", "models/autotune.json")
+OBJECTIVES = ("throughput", "latency")
+DEFAULT_BACKENDS = ("eager", "torchscript")
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8, 16)
+DEFAULT_TARGET_MS = 250.0
+
+
+def cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def host_key(model_version: str, device, processes: int) -> str:
+    """Identifies the hardware and deployment shape a tuning result is valid for"""
+    return "|".join([
+        cpu_model(),
+        f"{available_cpus()}cpu",
+        f"torch-{torch.__version__}",
+        str(device),
+        model_version,
+        f"x{processes}",
+    ])
+
+
+def thread_candidates(processes: int) -> list[int]:
+    """Powers of two up to this process's share of the CPUs, plus the share itself"""
+    budget = max(1, available_cpus() // max(1, processes))
+    candidates = {budget}
+    threads = 1
+    while threads < budget:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def measure(predictor: SkinCancerPredictor, batch_size: int, iterations: int) -> dict:
+    batch = torch.rand((batch_size, *INPUT_SHAPE))
+    predictor.binary_probabilities(batch)
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        predictor.binary_probabilities(batch)
+        latencies.append(time.perf_counter() - started)
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "images_per_s": round(batch_size / statistics.fmean(latencies), 2),
+    }
+
+
+def choose(measurements: list[dict], objective: str, target_ms: float) -> dict:
+    """Pick backend, threads and batch size from `measure` rows"""
+    if objective == "throughput":
+        within = [m for m in measurements if m["p95_ms"] <= target_ms] or measurements
+        best = max(within, key=lambda m: m["images_per_s"])
+        return {"backend": best["backend"], "torch_threads": best["threads"], "max_batch_size": best["batch_size"]}
+
+    smallest = min(m["batch_size"] for m in measurements)
+    best = min((m for m in measurements if m["batch_size"] == smallest), key=lambda m: m["p95_ms"])
+    same = [
+        m for m in measurements
+        if m["backend"] == best["backend"] and m["threads"] == best["threads"] and m["p95_ms"] <= target_ms
+    ]
+    batch_size = max((m["batch_size"] for m in same), default=smallest)
+    return {"backend": best["backend"], "torch_threads": best["threads"], "max_batch_size": batch_size}
+
+
+def tune(
+    model_path,
+    device="cpu",
+    processes: int = 1,
+    objective: str = "throughput",
+    target_ms: float = DEFAULT_TARGET_MS,
+    backends=DEFAULT_BACKENDS,
+    batch_sizes=DEFAULT_BATCH_SIZES,
+    iterations: int = 10,
+    log: Callable[[str], None] = lambda message: None
+) -> dict:
+    """Time every candidate on this host and return the chosen settings"""
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {OBJECTIVES}")
+    on_cpu = torch.device(device).type == "cpu"
+    threads_to_try = thread_candidates(processes) if on_cpu else [torch.get_num_threads()]
+    original_threads = torch.get_num_threads()
+    measurements = []
+    try:
+        for backend in backends:
+            try:
+                predictor = SkinCancerPredictor(model_path=model_path, device=device, backend=backend, shared_weights=True)
+            except Exception as e:
+                log(f"Skipping backend {backend}: {e}")
+                continue
+            for threads in threads_to_try:
+                torch.set_num_threads(threads)
+                for batch_size in batch_sizes:
+                    row = {"backend": backend, "threads": threads, "batch_size": batch_size}
+                    row.update(measure(predictor, batch_size, iterations))
+                    measurements.append(row)
+                    log(
+                        f"{backend:<12} threads={threads:<3} batch={batch_size:<3} "
+                        f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms {row['images_per_s']} img/s"
+                    )
+            del predictor
+    finally:
+        torch.set_num_threads(original_threads)
+    if not measurements:
+        raise RuntimeError("No inference backend could be benchmarked")
+
+    return {
+        **choose(measurements, objective, target_ms),
+        # ViT's forward pass has no independent ops to run side by side
+        "interop_threads": 1,
+        "objective": objective,
+        "target_ms": target_ms,
+        "processes": processes,
+        "tuned_at": datetime.now(timezone.utc).isoformat(),
+        "measurements": measurements,
+    }
+
+
+def _read(path) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load_tuned(model_version: str, device, processes: int, path=AUTOTUNE_FILE) -> Optional[dict]:
+    """Stored settings for this host, model and process count, if any"""
+    return _read(path).get(host_key(model_version, device, processes))
+
+
+def store_tuned(settings: dict, model_version: str, device, processes: int, path=AUTOTUNE_FILE) -> None:
+    entries = _read(path)
+    entries[host_key(model_version, device, processes)] = settings
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(temporary, path)
+
+
+def ensure_tuned(model_path, model_version: str, device="cpu", processes: int = 1, path=AUTOTUNE_FILE, **options) -> dict:
+    """Stored settings, tuning and storing them first when there are none
+
+    Workers booting together take a file lock, so only the first one tunes
+    (without the others competing for the CPUs) and the rest reuse its result.
+    """
+    import fcntl
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        settings = load_tuned(model_version, device, processes, path)
+        if settings is None:
+            settings = tune(model_path, device=device, processes=processes, **options)
+            store_tuned(settings, model_version, device, processes, path)
+        return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune inference threads, batch size and backend for this host")
+    parser.add_argument("--model", default=os.environ.get("MODEL_ARTIFACT_DIR", "models/skincheck-vit"),
+                        help="Model artifact directory or vit_checkpoint.pth")
+    parser.add_argument("--objective", choices=OBJECTIVES, default="throughput")
+    parser.add_argument("--target-ms", type=float, default=DEFAULT_TARGET_MS, help="Batch p95 latency budget")
+    parser.add_argument("--processes", type=int, default=1, help="Processes running the model on this host")
+    parser.add_argument("--backends", nargs="+", default=list(DEFAULT_BACKENDS), choices=sorted(BACKENDS))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--output", default=AUTOTUNE_FILE, help="Settings file to update")
+    parser.add_argument("--dry-run", action="store_true", help="Print the result without storing it")
+    args = parser.parse_args(argv)
+
+    version = os.environ.get("MODEL_VERSION")
+    if not version:
+        version = read_manifest(args.model)["model_version"] if is_artifact(args.model) else checkpoint_version(args.model)
+    settings = tune(
+        args.model,
+        device=args.device,
+        processes=args.processes,
+        objective=args.objective,
+        target_ms=args.target_ms,
+        backends=args.backends,
+        batch_sizes=args.batch_sizes,
+        iterations=args.iterations,
+        log=print
+    )
+    chosen = {key: value for key, value in settings.items() if key != "measurements"}
+    print(json.dumps(chosen, indent=2))
+    if not args.dry_run:
+        store_tuned(settings, version, args.device, args.processes, args.output)
+        print(f"Stored under {host_key(version, args.device, args.processes)!r} in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import torch
+from torch import nn
+
+INPUT_SHAPE = (3, 224, 224)
+
+
+class EagerBackend:
+    """Plain float32 PyTorch forward pass"""
+
+    name = "eager"
+
+    def __init__(self, model: nn.Module, device="cpu"):
+        self.model = model
+        self.device = device
+
+    def logits(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            return self.model(pixel_values=batch.to(self.device)).logits
+
+    def features(self, batch: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """Logits and the pooled (CLS token) embedding the classifier reads, from one forward pass"""
+        with torch.inference_mode():
+            return _classify(self.model, batch.to(self.device))
+
+
+class QuantizedBackend(EagerBackend):
+    """Linear layers dynamically quantized to int8; CPU only"""
+
+    name = "int8"
+
+    def __init__(self, model: nn.Module, device="cpu"):
+        if torch.device(device).type != "cpu":
+            raise ValueError("The int8 backend only runs on CPU")
+        # In place, so the float32 Linear weights are not kept alongside the int8 ones
+        quantized = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+        super().__init__(quantized.eval(), device)
+
+
+def _classify(model: nn.Module, pixel_values: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    # What ViTForImageClassification.forward does, keeping the pooled output
+    pooled = model.vit(pixel_values=pixel_values)[0][:, 0, :]
+    return model.classifier(pooled), pooled
+
+
+class _Features(nn.Module):
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        return _classify(self.model, pixel_values)
+
+
+class TorchScriptBackend:
+    """Traced, frozen TorchScript graph of the classifier"""
+
+    name = "torchscript"
+
+    def __init__(self, model: nn.Module, device="cpu"):
+        self.device = device
+        example = torch.zeros((2, *INPUT_SHAPE), device=device)
+        with torch.inference_mode():
+            traced = torch.jit.trace(_Features(model).eval(), example, check_trace=False)
+        self.module = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+    def logits(self, batch: torch.Tensor) -> torch.Tensor:
+        return self.features(batch)[0]
+
+    def features(self, batch: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        with torch.inference_mode():
+            return self.module(batch.to(self.device))
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (EagerBackend, QuantizedBackend, TorchScriptBackend)
+}
+
+
+def create_backend(name: str, model: nn.Module, device="cpu"):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}'. Available: {sorted(BACKENDS)}")
+    return BACKENDS[name](model, device)
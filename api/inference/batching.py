@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from ..telemetry import current_spans, inference_batch_duration, inference_batch_size, stage_duration
+
+
+class BatchingEngine:
+    """Dynamic micro-batching in front of SkinCancerPredictor
+
+    Concurrent callers submit preprocessed (3, 224, 224) tensors. A single
+    background task drains the queue into batches of up to `max_batch_size`,
+    waiting at most `max_wait_ms` after the first pending item, runs one
+    stacked forward pass and resolves every caller's future with its own row.
+
+    `predictor` is anything with a `predict_tensor(batch)` method: an
+    in-process SkinCancerPredictor (run on a dedicated thread) or an
+    InferenceWorkerPool (awaited directly). `concurrency` is how many batches
+    may be in flight at once and should match the number of model replicas.
+
+    Each batch's forward pass is reported as the "model" stage of every
+    request with an image in it, as the forward runs outside their context.
+    """
+
+    def __init__(self, predictor, max_batch_size: int = 8, max_wait_ms: float = 10.0, concurrency: int = 1):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.concurrency = concurrency
+        self._queue = None
+        self._slots = None
+        self._worker = None
+        self._dispatches = set()
+        self._async_predictor = asyncio.iscoroutinefunction(predictor.predict_tensor)
+        # In-process forward passes run on their own threads, off the event loop
+        self._executor = None if self._async_predictor else ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="inference"
+        )
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self._requests = 0
+        self._batches = 0
+        self._batched_items = 0
+        self._largest_batch = 0
+        self._peak_queue_depth = 0
+        self._queue_wait_total = 0.0
+        self._inference_time_total = 0.0
+        # Moving average of one forward pass, for estimated_wait()
+        self._recent_forward = 0.0
+
+    def _ensure_started(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+        if self._worker is None or self._worker.done():
+            # Started from a fresh context, so the worker does not hold on to
+            # the stage timings of the request that happened to start it
+            loop = asyncio.get_running_loop()
+            self._worker = contextvars.Context().run(loop.create_task, self._run())
+
+    async def submit(self, tensor: torch.Tensor) -> dict:
+        """Queue one preprocessed image and wait for its prediction"""
+        results = await self.submit_many([tensor])
+        return results[0]
+
+    async def submit_many(self, tensors: list[torch.Tensor]) -> list[dict]:
+        """Queue several images at once so they land in the same batch when possible"""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        futures = []
+        enqueued_at = time.perf_counter()
+        spans = current_spans()
+        for tensor in tensors:
+            future = loop.create_future()
+            self._queue.put_nowait((tensor, future, enqueued_at, spans))
+            futures.append(future)
+        self._requests += len(tensors)
+        self._peak_queue_depth = max(self._peak_queue_depth, self._queue.qsize())
+        return await asyncio.gather(*futures)
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            batch = await self._collect()
+            # Callers that disconnected while queued do not need a forward pass
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                self._slots.release()
+                continue
+            dispatch = loop.create_task(self._dispatch(batch))
+            self._dispatches.add(dispatch)
+            dispatch.add_done_callback(self._dispatches.discard)
+
+    async def _forward(self, stacked: torch.Tensor) -> list[dict]:
+        if self._async_predictor:
+            return await self.predictor.predict_tensor(stacked)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.predictor.predict_tensor, stacked)
+
+    async def _dispatch(self, batch: list) -> None:
+        started = time.perf_counter()
+        queue_wait = sum(started - item[2] for item in batch)
+        try:
+            results = await self._forward(torch.stack([item[0] for item in batch]))
+        except Exception as e:
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            elapsed = time.perf_counter() - started
+            self._inference_time_total += elapsed
+            self._recent_forward = elapsed if not self._recent_forward else 0.8 * self._recent_forward + 0.2 * elapsed
+            self._slots.release()
+            stage_duration.observe(elapsed, "model")
+            # Once per request, however many of its images the batch holds
+            for spans in {id(spans): spans for _, _, _, spans in batch}.values():
+                spans.append(("model", elapsed))
+
+        inference_batch_size.observe(len(batch))
+        inference_batch_duration.observe(elapsed)
+
+        self._batches += 1
+        self._queue_wait_total += queue_wait
+        self._batched_items += len(batch)
+        self._largest_batch = max(self._largest_batch, len(batch))
+        for (_, future, _, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def estimated_wait(self) -> float:
+        """Seconds an image submitted now should wait before its forward pass starts
+
+        Computed from the images already queued and recent forward pass
+        times, so it drops back to zero as soon as the queue drains.
+        """
+        backlog = self._queue.qsize() if self._queue is not None else 0
+        if len(self._dispatches) >= self.concurrency:
+            # Every replica is busy: the next batch also waits for one to free up
+            backlog += self.max_batch_size * self.concurrency
+        return math.ceil(backlog / self.max_batch_size) / self.concurrency * self._recent_forward
+
+    def stats(self) -> dict:
+        """Batching configuration and queue statistics"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "concurrency": self.concurrency,
+            "batches_in_flight": len(self._dispatches),
+            "max_wait_ms": self.max_wait_ms,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "peak_queue_depth": self._peak_queue_depth,
+            "requests": self._requests,
+            "batches": self._batches,
+            "largest_batch": self._largest_batch,
+            "avg_batch_size": round(self._batched_items / self._batches, 2) if self._batches else 0.0,
+            "avg_queue_wait_ms": round(self._queue_wait_total / self._batched_items * 1000, 2) if self._batched_items else 0.0,
+            "avg_inference_ms": round(self._inference_time_total / self._batches * 1000, 2) if self._batches else 0.0,
+            "estimated_wait_ms": round(self.estimated_wait() * 1000, 2),
+        }
@@ -0,0 +1,184 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from ..cache import TTLCache
+
+
+class PredictionCache:
+    """Prediction results keyed by image content hash and model version
+
+    Lookups go to an in-memory LRU tier first, then to `lookup` (a coroutine
+    function, or a blocking callable run in the threadpool, that searches
+    previously stored predictions, e.g. the `uploads` table), and only then
+    run inference. Concurrent requests for the same
+    key share a single in-flight computation.
+    """
+
+    def __init__(
+        self,
+        model_version: str,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        lookup: Optional[Callable[[str, str], Any]] = None
+    ):
+        self.model_version = model_version
+        self._memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._lookup = lookup
+        self._in_flight = {}
+        self.hits = 0
+        self.database_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.lookup_errors = 0
+
+    async def get_or_compute(self, file_hash: str, compute: Callable[[], Awaitable[dict]]) -> tuple[dict, str]:
+        """Return (prediction, source) where source is memory, database, coalesced or inference"""
+        key = (file_hash, self.model_version)
+        cached = self._memory.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached, "memory"
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            result, _ = await asyncio.shield(task)
+            return result, "coalesced"
+
+        task = asyncio.ensure_future(self._load(key, compute))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+        # The computation is shared, so one caller going away must not cancel it
+        return await asyncio.shield(task)
+
+    def _finish(self, key: tuple, task: asyncio.Future) -> None:
+        self._in_flight.pop(key, None)
+        # Mark the error as retrieved even if every waiter disconnected
+        if not task.cancelled():
+            task.exception()
+
+    async def _find(self, file_hash: str, model_version: str) -> Optional[dict]:
+        if asyncio.iscoroutinefunction(self._lookup):
+            return await self._lookup(file_hash, model_version)
+        return await run_in_threadpool(self._lookup, file_hash, model_version)
+
+    async def _load(self, key: tuple, compute: Callable[[], Awaitable[dict]]) -> tuple[dict, str]:
+        file_hash, model_version = key
+        if self._lookup is not None:
+            try:
+                stored = await self._find(file_hash, model_version)
+            except Exception:
+                self.lookup_errors += 1
+                stored = None
+            if stored is not None:
+                self.database_hits += 1
+                self._memory.set(key, stored)
+                return stored, "database"
+
+        self.misses += 1
+        result = await compute()
+        self._memory.set(key, result)
+        return result, "inference"
+
+    async def get_or_compute_many(
+        self,
+        file_hashes: list[str],
+        compute_many: Callable[[list[str]], Awaitable[list[dict]]]
+    ) -> list[tuple[dict, str]]:
+        """Like get_or_compute for several images, with a single `compute_many` call
+
+        `compute_many` receives the hashes that were found in no tier and
+        returns their predictions in the same order, so all misses can share
+        one stacked forward pass.
+        """
+        loop = asyncio.get_running_loop()
+        results = [None] * len(file_hashes)
+        waiting = {}
+        owned = {}
+        for index, file_hash in enumerate(file_hashes):
+            key = (file_hash, self.model_version)
+            cached = self._memory.get(key)
+            if cached is not None:
+                self.hits += 1
+                results[index] = (cached, "memory")
+            elif key in owned:
+                # The same image twice in one request
+                self.coalesced += 1
+                waiting[index] = (owned[key], True)
+            elif key in self._in_flight:
+                self.coalesced += 1
+                waiting[index] = (self._in_flight[key], True)
+            else:
+                future = loop.create_future()
+                self._in_flight[key] = future
+                future.add_done_callback(lambda f, key=key: self._finish(key, f))
+                owned[key] = future
+                waiting[index] = (future, False)
+
+        if owned:
+            loader = asyncio.ensure_future(self._load_many(owned, compute_many))
+            # Shared with concurrent callers, so don't let this one cancel it
+            await asyncio.shield(loader)
+
+        for index, (future, coalesced) in waiting.items():
+            result, source = await asyncio.shield(future)
+            results[index] = (result, "coalesced" if coalesced else source)
+        return results
+
+    async def _load_many(self, owned: dict, compute_many: Callable[[list[str]], Awaitable[list[dict]]]) -> None:
+        keys = list(owned)
+        try:
+            stored = [None] * len(keys)
+            if self._lookup is not None:
+                lookups = await asyncio.gather(
+                    *(self._find(file_hash, model_version) for file_hash, model_version in keys),
+                    return_exceptions=True
+                )
+                for position, found in enumerate(lookups):
+                    if isinstance(found, Exception):
+                        self.lookup_errors += 1
+                    elif found is not None:
+                        stored[position] = found
+
+            missing = []
+            for key, found in zip(keys, stored):
+                if found is None:
+                    missing.append(key)
+                else:
+                    self.database_hits += 1
+                    self._memory.set(key, found)
+                    owned[key].set_result((found, "database"))
+
+            if missing:
+                self.misses += len(missing)
+                computed = await compute_many([file_hash for file_hash, _ in missing])
+                for key, result in zip(missing, computed):
+                    self._memory.set(key, result)
+                    owned[key].set_result((result, "inference"))
+        except BaseException as e:
+            for future in owned.values():
+                if not future.done():
+                    future.set_exception(e if isinstance(e, Exception) else RuntimeError("Prediction was cancelled"))
+            if not isinstance(e, Exception):
+                raise
+
+    def invalidate(self, file_hash: str) -> None:
+        self._memory.pop((file_hash, self.model_version))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.database_hits + self.coalesced + self.misses
+        return {
+            "model_version": self.model_version,
+            "entries": len(self._memory),
+            "max_entries": self._memory.max_entries,
+            "ttl_seconds": self._memory.ttl,
+            "hits": self.hits,
+            "database_hits": self.database_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "lookup_errors": self.lookup_errors,
+            "evictions": self._memory.evictions,
+            "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
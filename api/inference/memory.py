@@ -0,0 +1,170 @@
+"""Per-process memory of a multi-worker deployment (Linux)
+
+    python -m api.inference.memory --parent <uvicorn master pid>
+    python -m api.inference.memory --compare 4
+
+RSS counts every resident page, including the ones other processes map too,
+so it overstates what a worker costs. USS (unique set size) only counts the
+pages no other process shares: it is what one more worker adds to the node.
+PSS splits shared pages evenly, so the PSS of all workers adds up to their
+real footprint.
+
+`--parent` reports a running server: the given process and all of its
+descendants (uvicorn workers, inference worker processes). `--compare N`
+loads the model in N fresh processes, once with mapped weights
+(MODEL_SHARED_WEIGHTS=true) and once with private copies, and reports both.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+
+# smaps_rollup fields, in kB
+_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def process_memory(pid: int) -> dict:
+    """RSS, PSS, USS and shared bytes of one process"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in _FIELDS:
+                values[name] = int(rest.split()[0]) * 1024
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+        "swap": values.get("Swap", 0),
+    }
+
+
+def _parent_pids() -> dict:
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after its ')'
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+    return parents
+
+
+def process_tree(pid: int) -> list[int]:
+    """`pid` followed by all of its descendants"""
+    children = {}
+    for child, parent in _parent_pids().items():
+        children.setdefault(parent, []).append(child)
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(sorted(children.get(current, []), reverse=True))
+    return tree
+
+
+def _command(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            command = f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+    except OSError:
+        return "?"
+    return command or "?"
+
+
+def report(pids: list[int]) -> dict:
+    processes = []
+    for pid in pids:
+        try:
+            processes.append({"pid": pid, "command": _command(pid), **process_memory(pid)})
+        except OSError:
+            # Exited while we were looking
+            continue
+    return {
+        "processes": processes,
+        "total": {key: sum(p[key] for p in processes) for key in ("rss", "pss", "uss")},
+    }
+
+
+def _load_and_wait(model_path, backend, shared_weights, loaded, release):
+    import torch
+    torch.set_num_threads(1)
+    from .predictor import SkinCancerPredictor
+
+    predictor = SkinCancerPredictor(model_path=model_path, backend=backend, shared_weights=shared_weights)
+    predictor.warmup()
+    loaded.release()
+    release.wait()
+
+
+def compare(model_path: str, workers: int, backend: str = "eager") -> dict:
+    """Footprint of `workers` model replicas, with mapped and with private weights"""
+    ctx = mp.get_context("spawn")
+    results = {}
+    for shared_weights in (True, False):
+        loaded, release = ctx.Semaphore(0), ctx.Event()
+        processes = [
+            ctx.Process(target=_load_and_wait, args=(model_path, backend, shared_weights, loaded, release), daemon=True)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for _ in processes:
+                if not loaded.acquire(timeout=600):
+                    raise TimeoutError("Model replicas did not load in time")
+            results["mapped" if shared_weights else "private"] = report([p.pid for p in processes])
+        finally:
+            release.set()
+            for process in processes:
+                process.join(10)
+    return results
+
+
+def _mb(value: int) -> str:
+    return f"{value / 2 ** 20:.1f}"
+
+
+def _print_report(title: str, data: dict) -> None:
+    print(title)
+    print(f"  {'pid':>7} {'rss MB':>9} {'pss MB':>9} {'uss MB':>9}  command")
+    for p in data["processes"]:
+        print(f"  {p['pid']:>7} {_mb(p['rss']):>9} {_mb(p['pss']):>9} {_mb(p['uss']):>9}  {p['command'][:60]}")
+    total = data["total"]
+    print(f"  {'total':>7} {_mb(total['rss']):>9} {_mb(total['pss']):>9} {_mb(total['uss']):>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-process RSS, PSS and USS of the API workers")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--parent", type=int, help="Report this process and all of its descendants")
+    target.add_argument("--pids", type=int, nargs="+", help="Report these processes")
+    target.add_argument("--compare", type=int, metavar="N", help="Load N model replicas with mapped and private weights")
+    parser.add_argument("--model", default=os.environ.get("MODEL_ARTIFACT_DIR", "models/skincheck-vit"),
+                        help="Model artifact directory, for --compare")
+    parser.add_argument("--backend", default="eager", help="Inference backend, for --compare")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        result = compare(args.model, args.compare, args.backend)
+        for mode, data in result.items():
+            _print_report(f"{mode} weights, {args.compare} replicas", data)
+        saved = result["private"]["total"]["pss"] - result["mapped"]["total"]["pss"]
+        print(f"mapped weights save {_mb(saved)} MB across {args.compare} replicas")
+    else:
+        result = report(process_tree(args.parent) if args.parent else args.pids)
+        _print_report("processes", result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Accuracy and speed parity of the inference backends against eager float32
+
+    python -m api.inference.parity --images path/to/reference/images
+
+Every image in the folder runs through each backend. The report gives
+batch latency, throughput, the largest Benign/Malignant probability drift
+from eager fp32 and how often the predicted class flips.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import torch
+from PIL import Image
+
+from ..telemetry import percentile
+from .backends import BACKENDS
+from .predictor import SkinCancerPredictor
+from .preprocess import decode, to_model_input
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tiff", ".tif"}
+
+
+def load_images(folder: str):
+    names = sorted(
+        name for name in os.listdir(folder)
+        if os.path.splitext(name.lower())[1] in IMAGE_EXTENSIONS
+    )
+    if not names:
+        raise ValueError(f"No reference images found in {folder}")
+    images = torch.empty((len(names), 3, 224, 224))
+    for name, row in zip(names, images):
+        with Image.open(os.path.join(folder, name)) as img:
+            to_model_input(decode(img), out=row)
+    return names, images
+
+
+def run_backend(model_path, backend: str, images: torch.Tensor, batch_size: int, repeats: int, device="cpu") -> dict:
+    predictor = SkinCancerPredictor(model_path=model_path, device=device, backend=backend)
+    predictor.warmup([min(batch_size, len(images))])
+
+    latencies = []
+    probabilities = None
+    started = time.perf_counter()
+    for _ in range(repeats):
+        chunks = []
+        for start in range(0, len(images), batch_size):
+            batch_started = time.perf_counter()
+            chunks.append(predictor.binary_probabilities(images[start:start + batch_size]))
+            latencies.append(time.perf_counter() - batch_started)
+        probabilities = torch.cat(chunks)
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "probabilities": probabilities,
+        "batch_latency_ms": {
+            "p50": round(percentile(ordered, 0.5) * 1000, 2),
+            "p95": round(percentile(ordered, 0.95) * 1000, 2),
+            "mean": round(statistics.fmean(latencies) * 1000, 2),
+        },
+        "throughput_images_per_s": round(len(images) * repeats / elapsed, 2),
+    }
+
+
+def compare(reference: torch.Tensor, candidate: torch.Tensor, names: list[str]) -> dict:
+    drift = (candidate[:, 1] - reference[:, 1]).abs()
+    flipped = (candidate[:, 1] >= candidate[:, 0]) != (reference[:, 1] >= reference[:, 0])
+    return {
+        "max_probability_drift": round(drift.max().item(), 6),
+        "mean_probability_drift": round(drift.mean().item(), 6),
+        "flip_rate": round(flipped.float().mean().item(), 6),
+        "flipped_images": [name for name, flip in zip(names, flipped.tolist()) if flip],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare inference backends against eager fp32")
+    parser.add_argument("--images", required=True, help="Folder of reference images")
+    parser.add_argument("--model", default=os.environ.get("MODEL_ARTIFACT_DIR", "models/skincheck-vit"),
+                        help="Model artifact directory or vit_checkpoint.pth")
+    parser.add_argument("--backends", nargs="+", default=sorted(BACKENDS), choices=sorted(BACKENDS))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    names, images = load_images(args.images)
+
+    backends = ["eager"] + [name for name in args.backends if name != "eager"]
+    runs = {name: run_backend(args.model, name, images, args.batch_size, args.repeats) for name in backends}
+    reference = runs["eager"]["probabilities"]
+
+    report = {
+        "images": len(names),
+        "batch_size": args.batch_size,
+        "repeats": args.repeats,
+        "torch_threads": torch.get_num_threads(),
+        "backends": {},
+    }
+    for name in backends:
+        run = runs[name]
+        entry = {key: value for key, value in run.items() if key != "probabilities"}
+        entry.update(compare(reference, run["probabilities"], names))
+        report["backends"][name] = entry
+
+    print(f"{'backend':<12} {'p50 ms':>9} {'p95 ms':>9} {'img/s':>9} {'max drift':>10} {'flip rate':>10}")
+    for name, entry in report["backends"].items():
+        print(
+            f"{name:<12} {entry['batch_latency_ms']['p50']:>9} {entry['batch_latency_ms']['p95']:>9} "
+            f"{entry['throughput_images_per_s']:>9} {entry['max_probability_drift']:>10} {entry['flip_rate']:>10}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
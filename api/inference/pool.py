@@ -0,0 +1,258 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import torch
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised for requests that were running on a worker process that died"""
+
+
+def _worker_main(worker_id, model_path, device, backend, shared_weights, embeddings, torch_threads, task_queue, result_queue):
+    """Entry point of an inference worker process"""
+    torch.set_num_threads(torch_threads)
+    from .predictor import SkinCancerPredictor
+
+    predictor = SkinCancerPredictor(
+        model_path=model_path, device=device, backend=backend, shared_weights=shared_weights, embeddings=embeddings
+    )
+    predictor.warmup()
+    result_queue.put(("ready", worker_id, None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, shm_name, shape = task
+        try:
+            # The API process owns the block and unlinks it once the result is in
+            shm = shared_memory.SharedMemory(name=shm_name)
+        except Exception as e:
+            result_queue.put((task_id, None, f"Failed to attach input tensor: {e}"))
+            continue
+        try:
+            batch = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            results = predictor.predict_tensor(torch.from_numpy(batch))
+            result_queue.put((task_id, results, None))
+        except Exception as e:
+            result_queue.put((task_id, None, repr(e)))
+        finally:
+            # Drop every view of the buffer before closing it
+            batch = None
+            shm.close()
+
+
+class _Worker:
+    def __init__(self, worker_id, process, task_queue):
+        self.worker_id = worker_id
+        self.process = process
+        self.task_queue = task_queue
+        self.in_flight = set()
+        self.ready = False
+
+
+class InferenceWorkerPool:
+    """Runs SkinCancerPredictor in dedicated worker processes
+
+    Input batches are copied once into a shared memory block; only its name
+    and shape travel through the task queue. Results come back on a shared
+    result queue and resolve asyncio futures, so callers await inference
+    without ever blocking the event loop. A monitor thread restarts workers
+    that die and fails the requests they were holding.
+    """
+
+    def __init__(
+        self,
+        model_path,
+        device="cpu",
+        backend: str = "eager",
+        shared_weights: bool = False,
+        embeddings: bool = False,
+        workers: int = 2,
+        torch_threads: int = 1,
+        start_method: str = "spawn",
+        monitor_interval: float = 1.0
+    ):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.model_path = model_path
+        self.device = str(device)
+        self.backend = backend
+        self.shared_weights = shared_weights
+        self.embeddings = embeddings
+        self.size = workers
+        self.torch_threads = torch_threads
+        self.monitor_interval = monitor_interval
+        self._ctx = mp.get_context(start_method)
+        self._result_queue = None
+        self._workers = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._restarts = 0
+        self._completed = 0
+        self._failed = 0
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._stopping.clear()
+        # Workers must share this process's tracker, otherwise each of them
+        # would also try to clean up the input blocks it attaches to
+        resource_tracker.ensure_running()
+        self._result_queue = self._ctx.Queue()
+        for worker_id in range(self.size):
+            self._spawn(worker_id)
+        self._threads = [
+            threading.Thread(target=self._listen, name="inference-results", daemon=True),
+            threading.Thread(target=self._monitor, name="inference-monitor", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _spawn(self, worker_id: int) -> None:
+        task_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker_id, self.model_path, self.device, self.backend, self.shared_weights,
+                self.embeddings, self.torch_threads, task_queue, self._result_queue
+            ),
+            name=f"inference-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        self._workers[worker_id] = _Worker(worker_id, process, task_queue)
+
+    def wait_ready(self, timeout: float = 600.0) -> None:
+        """Block until every worker has loaded and warmed up its model"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._workers and all(w.ready for w in self._workers.values()):
+                    return
+            if time.monotonic() > deadline:
+                raise TimeoutError("Inference workers did not become ready in time")
+            time.sleep(0.1)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers = {}
+        for worker in workers:
+            worker.task_queue.put(None)
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        if self._result_queue is not None:
+            # Wakes the listener thread so it can exit
+            self._result_queue.put(None)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for task_id, (loop, future, _) in pending.items():
+            loop.call_soon_threadsafe(self._resolve, future, None, "Inference pool stopped")
+
+    async def predict_tensor(self, batch: torch.Tensor) -> list[dict]:
+        """Run one stacked batch on the least busy worker"""
+        batch = batch.detach().to(dtype=torch.float32, device="cpu").contiguous()
+        shm = shared_memory.SharedMemory(create=True, size=max(batch.numel() * 4, 1))
+        try:
+            np.ndarray(tuple(batch.shape), dtype=np.float32, buffer=shm.buf)[...] = batch.numpy()
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            task_id = next(self._task_ids)
+            with self._lock:
+                if not self._workers:
+                    raise RuntimeError("Inference pool is not running")
+                worker = min(self._workers.values(), key=lambda w: (not w.ready, len(w.in_flight)))
+                worker.in_flight.add(task_id)
+                self._pending[task_id] = (loop, future, worker.worker_id)
+            worker.task_queue.put((task_id, shm.name, tuple(batch.shape)))
+            return await future
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @staticmethod
+    def _resolve(future, results, error) -> None:
+        if future.done():
+            return
+        if error is not None:
+            exc = error if isinstance(error, Exception) else RuntimeError(f"Inference worker error: {error}")
+            future.set_exception(exc)
+        else:
+            future.set_result(results)
+
+    def _listen(self) -> None:
+        while not self._stopping.is_set():
+            message = self._result_queue.get()
+            if message is None:
+                break
+            key, results, error = message
+            if key == "ready":
+                with self._lock:
+                    worker = self._workers.get(results)
+                    if worker is not None:
+                        worker.ready = True
+                continue
+            with self._lock:
+                entry = self._pending.pop(key, None)
+                if entry is not None:
+                    worker = self._workers.get(entry[2])
+                    if worker is not None:
+                        worker.in_flight.discard(key)
+                    if error is None:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+            if entry is not None:
+                loop, future, _ = entry
+                loop.call_soon_threadsafe(self._resolve, future, results, error)
+
+    def _monitor(self) -> None:
+        while not self._stopping.wait(self.monitor_interval):
+            with self._lock:
+                dead = [w for w in self._workers.values() if not w.process.is_alive()]
+                for worker in dead:
+                    lost = [(task_id, self._pending.pop(task_id)) for task_id in worker.in_flight if task_id in self._pending]
+                    self._failed += len(lost)
+                    self._restarts += 1
+                    self._spawn(worker.worker_id)
+                    for task_id, (loop, future, _) in lost:
+                        error = WorkerCrashedError(
+                            f"Inference worker {worker.worker_id} exited with code {worker.process.exitcode}"
+                        )
+                        loop.call_soon_threadsafe(self._resolve, future, None, error)
+
+    def stats(self) -> dict:
+        """Worker pool configuration and health"""
+        with self._lock:
+            workers = [
+                {
+                    "worker_id": w.worker_id,
+                    "pid": w.process.pid,
+                    "alive": w.process.is_alive(),
+                    "ready": w.ready,
+                    "in_flight": len(w.in_flight),
+                }
+                for w in self._workers.values()
+            ]
+            return {
+                "mode": "process",
+                "backend": self.backend,
+                "shared_weights": self.shared_weights,
+                "workers": workers,
+                "torch_threads": self.torch_threads,
+                "restarts": self._restarts,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
@@ -0,0 +1,117 @@
+import hashlib
+
+import torch
+from PIL import Image
+from transformers import ViTForImageClassification
+from .artifact import is_artifact, load_artifact
+from .backends import create_backend
+from .preprocess import decode, to_model_input
+
+
+def preprocess(image: Image.Image) -> torch.Tensor:
+    """Turn a PIL image into a single (3, 224, 224) model input"""
+    return to_model_input(decode(image))
+
+
+def checkpoint_version(model_path, length: int = 12) -> str:
+    """Short content hash of a checkpoint, used to tag cached and stored predictions"""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f"vit-{digest.hexdigest()[:length]}"
+
+
+class SkinCancerPredictor:
+    def __init__(self, model_path, device='cpu', backend='eager', shared_weights=False, embeddings=False):
+        """`model_path` is a packaged artifact directory or a raw vit_checkpoint.pth
+
+        `backend` picks the forward-pass engine: eager, int8 or torchscript.
+        `shared_weights` maps an artifact's weights instead of copying them,
+        so processes serving the same artifact share one copy. With
+        `embeddings`, every prediction also carries the image's pooled
+        embedding under "embedding" (a float32 numpy vector).
+        """
+        self.shared_weights = shared_weights
+        self.embeddings = embeddings
+        self.device = device
+        self.binary_class_names = {0: "Benign", 1: "Malignant"}
+        self.benign_indices = [0, 3, 4, 6]
+        self.malignant_indices = [1, 2, 5]
+        self.model_version = None
+        self.model = self._load_model(model_path)
+        self.backend = create_backend(backend, self.model, device)
+
+    def _load_model(self, model_path):
+        if is_artifact(model_path):
+            model, manifest = load_artifact(model_path, device=self.device, shared_weights=self.shared_weights)
+            self.model_version = manifest["model_version"]
+            self.binary_class_names = {int(k): v for k, v in manifest["binary_class_names"].items()}
+            self.benign_indices = manifest["benign_indices"]
+            self.malignant_indices = manifest["malignant_indices"]
+            return model
+
+        # Legacy path: fetch the base model, then overwrite it with the checkpoint
+        model = ViTForImageClassification.from_pretrained(
+            'google/vit-base-patch16-224-in21k',
+            num_labels=7,
+            ignore_mismatched_sizes=True
+        )
+        model.load_state_dict(torch.load(model_path, map_location=self.device))
+        model.to(self.device)
+        model.eval()
+        return model
+
+    def preprocess(self, image: Image.Image) -> torch.Tensor:
+        return preprocess(image)
+
+    def predict_tensor(self, batch: torch.Tensor):
+        """Run one forward pass over a stacked (N, 3, 224, 224) batch"""
+        if not self.embeddings:
+            return self._format(self.binary_probabilities(batch))
+        logits, embeddings = self.backend.features(batch)
+        return self._format(self._binary(logits), embeddings.float().cpu())
+
+    def binary_probabilities(self, batch: torch.Tensor) -> torch.Tensor:
+        """Unrounded (N, 2) Benign/Malignant probabilities for a stacked batch"""
+        return self._binary(self.backend.logits(batch))
+
+    def _binary(self, logits: torch.Tensor) -> torch.Tensor:
+        probabilities_7_class = torch.softmax(logits.float(), dim=1).cpu()
+        binary = torch.stack([
+            probabilities_7_class[:, self.benign_indices].sum(dim=1),
+            probabilities_7_class[:, self.malignant_indices].sum(dim=1),
+        ], dim=1)
+        total = binary.sum(dim=1, keepdim=True)
+        return torch.where(total > 0, binary / total.clamp_min(1e-12), binary)
+
+    def _format(self, binary: torch.Tensor, embeddings: torch.Tensor = None):
+        results = []
+        for row, (prob_benign, prob_malignant) in enumerate(binary.tolist()):
+            predicted_index = 0 if prob_benign > prob_malignant else 1
+            confidence = max(prob_benign, prob_malignant)
+            results.append({
+                "prediction": self.binary_class_names[predicted_index],
+                "confidence": round(confidence, 4),
+                "probabilities": {
+                    "Benign": round(prob_benign, 4),
+                    "Malignant": round(prob_malignant, 4)
+                }
+            })
+            if embeddings is not None:
+                results[-1]["embedding"] = embeddings[row].numpy()
+        return results
+
+    def warmup(self, batch_sizes=(1,)) -> None:
+        """Run throwaway forward passes so the first real request is not the slow one"""
+        for batch_size in batch_sizes:
+            self.binary_probabilities(torch.zeros((batch_size, 3, 224, 224)))
+
+    def predict_batch(self, images: list[Image.Image]):
+        batch = torch.empty((len(images), 3, 224, 224))
+        for row, image in zip(batch, images):
+            to_model_input(decode(image), out=row)
+        return self.predict_tensor(batch)
+
+    def predict(self, image: Image.Image):
+        return self.predict_batch([image])[0]
@@ -0,0 +1,70 @@
+import io
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+from PIL import Image
+
+if TYPE_CHECKING:
+    import torch
+
+INPUT_SIZE = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+@lru_cache(maxsize=None)
+def _normalization():
+    """(x / 255 - mean) / std folded into one multiply and one subtract per pixel
+
+    numpy (and torch, in to_model_input) are imported on first use, so the
+    web routes can decode and validate images without loading the ML stack.
+    """
+    import numpy as np
+    mean = np.array(MEAN, dtype=np.float32)
+    std = np.array(STD, dtype=np.float32)
+    return (1.0 / (255.0 * std)).reshape(3, 1, 1), (mean / std).reshape(3, 1, 1)
+
+
+def open_image(content) -> Image.Image:
+    """Parse only the image header of bytes or a file object; pixel data is not decoded yet"""
+    if isinstance(content, (bytes, bytearray)):
+        content = io.BytesIO(content)
+    else:
+        content.seek(0)
+    return Image.open(content)
+
+
+def decode(image: Image.Image) -> Image.Image:
+    """Decode an opened image once, straight to RGB
+
+    JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that still
+    covers the model input, so a multi-megapixel photo is never fully
+    decoded just to be downsampled to 224x224.
+    """
+    if image.format == "JPEG":
+        image.draft("RGB", (INPUT_SIZE, INPUT_SIZE))
+    return image.convert("RGB")
+
+
+def model_input_image(image: Image.Image) -> Image.Image:
+    """The 224x224 RGB image the model sees"""
+    if image.size != (INPUT_SIZE, INPUT_SIZE):
+        image = image.resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR)
+    return image
+
+
+def to_model_input(image: Image.Image, out: Optional["torch.Tensor"] = None) -> "torch.Tensor":
+    """Resize an RGB image and normalize it into a (3, 224, 224) float32 tensor
+
+    `out` may be a preallocated tensor, e.g. a row of a batch, to fill in place.
+    """
+    import numpy as np
+    import torch
+    scale, offset = _normalization()
+    pixels = np.asarray(model_input_image(image), dtype=np.float32).transpose(2, 0, 1)
+    if out is None:
+        out = torch.empty((3, INPUT_SIZE, INPUT_SIZE), dtype=torch.float32)
+    target = out.numpy()
+    np.multiply(pixels, scale, out=target)
+    target -= offset
+    return out
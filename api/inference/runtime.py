@@ -0,0 +1,353 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+
+from ..embeddings import EMBEDDINGS_ENABLED
+from .cache import PredictionCache
+
+# torch, transformers and the modules built on them are imported by load(),
+# off the event loop, so importing the app stays cheap
+
+logger = logging.getLogger("api-logger")
+
+# "startup" loads the model in the background as soon as the app starts,
+# "lazy" only when a predict route first needs it. Either way the app answers
+# other routes while the ML stack is imported. Profile the import cost with:
+# python -m api.benchmark.startup
+MODEL_LOADING = os.environ.get("MODEL_LOADING", "startup")
+# Seconds a predict request waits for a model that is still loading before
+# it is answered with 503; lazily loading servers wait for the first load
+MODEL_LOAD_WAIT = float(os.environ.get("MODEL_LOAD_WAIT", "60" if MODEL_LOADING == "lazy" else "0"))
+
+# Packaged model artifact (see api/inference/artifact.py); when it is missing
+# the raw checkpoint is downloaded from the Hugging Face Hub instead
+MODEL_ARTIFACT_DIR = os.environ.get("MODEL_ARTIFACT_DIR", "models/skincheck-vit")
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "true").lower() == "true"
+
+# Forward-pass engine: "eager" (float32), "int8" (dynamically quantized
+# Linear layers, CPU only) or "torchscript" (traced and frozen graph).
+# Check a change with: python -m api.inference.parity --images <folder>
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "eager")
+
+# Keep the artifact's weights on a file mapping instead of copying them, so
+# every uvicorn worker and inference process on the node shares one copy
+# through the page cache. Only the eager backend keeps them shared: int8 and
+# torchscript build their own private weights from the mapped ones. Deploy a
+# new artifact to a new path; overwriting a mapped file in place crashes the
+# workers reading it.
+# Check with: python -m api.inference.memory --parent <uvicorn pid>
+MODEL_SHARED_WEIGHTS = os.environ.get("MODEL_SHARED_WEIGHTS", "true").lower() == "true"
+
+# Micro-batching: largest stacked forward pass, and how long the first queued
+# image may wait for others to join it
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", "8"))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get("INFERENCE_MAX_WAIT_MS", "10"))
+
+# "thread" runs the model in this process on a background thread, "process"
+# runs INFERENCE_WORKERS model replicas in dedicated worker processes
+INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "thread")
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "2"))
+INFERENCE_TORCH_THREADS = int(os.environ.get("INFERENCE_TORCH_THREADS", "1"))
+
+# Stored autotune results (python -m api.inference.autotune): "apply" uses
+# the settings tuned for this host and model when there are any, "startup"
+# also tunes and stores them on boot when there are none, "off" ignores
+# them. Backend, batch size and thread count set in the environment always
+# win over tuned values.
+INFERENCE_AUTOTUNE = os.environ.get("INFERENCE_AUTOTUNE", "apply")
+INFERENCE_AUTOTUNE_OBJECTIVE = os.environ.get("INFERENCE_AUTOTUNE_OBJECTIVE", "throughput")
+# Defaults to autotune.DEFAULT_TARGET_MS
+INFERENCE_AUTOTUNE_TARGET_MS = os.environ.get("INFERENCE_AUTOTUNE_TARGET_MS")
+# uvicorn workers on this host; with INFERENCE_WORKERS it sets each model
+# process's share of the CPUs
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+# Prediction cache keyed by upload SHA-256 and model version
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "1024"))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", "3600"))
+
+if MODEL_LOADING not in ("startup", "lazy"):
+    raise ValueError("MODEL_LOADING must be 'startup' or 'lazy'")
+if INFERENCE_MODE not in ("thread", "process"):
+    raise ValueError("INFERENCE_MODE must be 'thread' or 'process'")
+if INFERENCE_AUTOTUNE not in ("apply", "startup", "off"):
+    raise ValueError("INFERENCE_AUTOTUNE must be 'apply', 'startup' or 'off'")
+
+# Tunable settings and the environment variables that override tuned values
+_TUNABLE = {
+    "backend": "INFERENCE_BACKEND",
+    "max_batch_size": "INFERENCE_MAX_BATCH_SIZE",
+    "torch_threads": "INFERENCE_TORCH_THREADS",
+}
+
+
+class Readiness:
+    """Model lifecycle: starting -> loading -> [tuning ->] warming -> ready, or failed
+
+    With lazy loading the model is "idle" until a predict route needs it.
+    """
+
+    def __init__(self):
+        self.state = "idle" if MODEL_LOADING == "lazy" else "starting"
+        self.error = None
+        self.changed_at = datetime.now(timezone.utc)
+
+    def set(self, state: str, error: Optional[str] = None) -> None:
+        self.state = state
+        self.error = error
+        self.changed_at = datetime.now(timezone.utc)
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def healthy(self) -> bool:
+        """Ready, or not needed yet because the model loads on demand"""
+        return self.state in ("ready", "idle")
+
+    def as_dict(self) -> dict:
+        info = {"state": self.state, "since": self.changed_at.isoformat()}
+        if self.error:
+            info["error"] = self.error
+        return info
+
+
+readiness = Readiness()
+predictor = None
+engine = None
+prediction_cache = None
+model_version = None
+settings = None
+device = None
+_lookup = None
+_loading = None
+
+
+def resolve_model_path() -> str:
+    from .artifact import is_artifact
+    if is_artifact(MODEL_ARTIFACT_DIR):
+        return MODEL_ARTIFACT_DIR
+    from huggingface_hub import hf_hub_download
+    logger.warning(f"No model artifact at {MODEL_ARTIFACT_DIR}, downloading the checkpoint instead")
+    return hf_hub_download(repo_id="Arif194/SkinCheck", filename="vit_checkpoint.pth")
+
+
+def resolve_model_version(model_path: str) -> str:
+    """MODEL_VERSION if set, else the artifact manifest's version or the checkpoint's hash"""
+    version = os.environ.get("MODEL_VERSION")
+    if version:
+        return version
+    from .artifact import is_artifact, read_manifest
+    from .predictor import checkpoint_version
+    return read_manifest(model_path)["model_version"] if is_artifact(model_path) else checkpoint_version(model_path)
+
+
+def tagged_version(model_version: str, backend: str) -> str:
+    """Version that results are cached and stored under
+
+    int8 and torchscript give slightly different probabilities than the
+    eager model, so their results carry the backend and are never served
+    to a deployment running another one.
+    """
+    return model_version if backend == "eager" else f"{model_version}-{backend}"
+
+
+def resolve_settings(model_path: str, version: str) -> dict:
+    """Backend, batch size and threads to serve with: environment, then autotune, then defaults"""
+    from . import autotune
+    torch_threads = INFERENCE_TORCH_THREADS
+    if INFERENCE_MODE == "thread" and "INFERENCE_TORCH_THREADS" not in os.environ:
+        # Thread mode keeps torch's own default unless told otherwise
+        torch_threads = None
+    resolved = {
+        "backend": INFERENCE_BACKEND,
+        "max_batch_size": INFERENCE_MAX_BATCH_SIZE,
+        "torch_threads": torch_threads,
+        "interop_threads": None,
+        "source": "environment",
+    }
+    if INFERENCE_AUTOTUNE == "off":
+        return resolved
+
+    processes = WEB_CONCURRENCY * (INFERENCE_WORKERS if INFERENCE_MODE == "process" else 1)
+    tuned = autotune.load_tuned(version, device, processes)
+    if tuned is None and INFERENCE_AUTOTUNE == "startup":
+        readiness.set("tuning")
+        tuned = autotune.ensure_tuned(
+            model_path,
+            version,
+            device=device,
+            processes=processes,
+            objective=INFERENCE_AUTOTUNE_OBJECTIVE,
+            target_ms=float(INFERENCE_AUTOTUNE_TARGET_MS or autotune.DEFAULT_TARGET_MS),
+            log=logger.info
+        )
+    if tuned is None:
+        return resolved
+
+    for key, variable in _TUNABLE.items():
+        if variable not in os.environ:
+            resolved[key] = tuned[key]
+    resolved["interop_threads"] = tuned.get("interop_threads")
+    resolved["source"] = f"autotune ({tuned['objective']}, {tuned['tuned_at']})"
+    return resolved
+
+
+def apply_threads(torch_threads: Optional[int], interop_threads: Optional[int]) -> None:
+    import torch
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Only allowed before the first inter-op parallel work in this process
+            logger.warning("Inter-op threads already started; keeping the current count")
+
+
+def load(lookup: Optional[Callable[[str, str], Optional[dict]]] = None) -> None:
+    """Import the ML stack, load and warm up the model, then open the predict routes"""
+    global predictor, engine, prediction_cache, model_version, settings, device
+    readiness.set("loading")
+    try:
+        import torch
+        from .batching import BatchingEngine
+        from .pool import InferenceWorkerPool
+        from .predictor import SkinCancerPredictor
+
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        model_path = resolve_model_path()
+        version = resolve_model_version(model_path)
+        chosen = resolve_settings(model_path, version)
+        version = tagged_version(version, chosen["backend"])
+        readiness.set("loading")
+
+        if INFERENCE_MODE == "process":
+            runner = InferenceWorkerPool(
+                model_path=model_path,
+                device=device,
+                backend=chosen["backend"],
+                shared_weights=MODEL_SHARED_WEIGHTS,
+                embeddings=EMBEDDINGS_ENABLED,
+                workers=INFERENCE_WORKERS,
+                torch_threads=chosen["torch_threads"]
+            )
+            runner.start()
+            readiness.set("warming")
+            runner.wait_ready()
+        else:
+            apply_threads(chosen["torch_threads"], chosen["interop_threads"])
+            runner = SkinCancerPredictor(
+                model_path=model_path,
+                device=device,
+                backend=chosen["backend"],
+                shared_weights=MODEL_SHARED_WEIGHTS,
+                embeddings=EMBEDDINGS_ENABLED
+            )
+            if MODEL_WARMUP:
+                readiness.set("warming")
+                runner.warmup(sorted({1, chosen["max_batch_size"]}))
+
+        predictor = runner
+        model_version = version
+        settings = chosen
+        engine = BatchingEngine(
+            runner,
+            max_batch_size=chosen["max_batch_size"],
+            max_wait_ms=INFERENCE_MAX_WAIT_MS,
+            concurrency=INFERENCE_WORKERS if INFERENCE_MODE == "process" else 1
+        )
+        prediction_cache = PredictionCache(
+            model_version=version,
+            max_entries=PREDICTION_CACHE_SIZE,
+            ttl=PREDICTION_CACHE_TTL,
+            lookup=lookup
+        )
+        readiness.set("ready")
+        logger.info(
+            f"Model {version} ready ({INFERENCE_MODE} mode, {chosen['backend']} backend, "
+            f"batches of {chosen['max_batch_size']}, settings from {chosen['source']})"
+        )
+    except Exception as e:
+        readiness.set("failed", error=str(e))
+        logger.error(f"Failed to load model: {e}")
+        raise
+
+
+def start(lookup: Optional[Callable[[str, str], Optional[dict]]] = None) -> None:
+    """Set up inference on app startup; with MODEL_LOADING=startup, begin loading the model"""
+    global _lookup
+    _lookup = lookup
+    if MODEL_LOADING == "startup":
+        begin_loading()
+
+
+def begin_loading() -> asyncio.Future:
+    """Load the model in the background so the app can answer other routes meanwhile"""
+    global _loading
+    if _loading is None:
+        _loading = asyncio.get_running_loop().run_in_executor(None, load, _lookup)
+        _loading.add_done_callback(_loaded)
+    return _loading
+
+
+def _loaded(future: asyncio.Future) -> None:
+    global _loading
+    # Failures are recorded on `readiness`; don't log them twice
+    failed = future.cancelled() or future.exception() is not None or not readiness.ready
+    if failed and _loading is future:
+        # The next predict request tries again, e.g. after a temporary download error
+        _loading = None
+
+
+def stop() -> None:
+    if INFERENCE_MODE == "process" and predictor is not None:
+        predictor.stop()
+
+
+async def require_ready():
+    """Return (engine, prediction_cache), or reject the request while the model is not ready
+
+    Starts loading a lazily loaded model, and waits up to MODEL_LOAD_WAIT
+    seconds for a load in progress.
+    """
+    if not readiness.ready:
+        loading = begin_loading()
+        if MODEL_LOAD_WAIT > 0:
+            try:
+                await asyncio.wait_for(asyncio.shield(loading), MODEL_LOAD_WAIT)
+            except Exception:
+                # Timed out, or failed and recorded on `readiness`
+                pass
+    if not readiness.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Prediction model is not ready ({readiness.state})",
+            headers={"Retry-After": "10"}
+        )
+    return engine, prediction_cache
+
+
+def stats() -> dict:
+    info = {
+        "mode": INFERENCE_MODE,
+        "loading": MODEL_LOADING,
+        "backend": settings["backend"] if settings else INFERENCE_BACKEND,
+        "shared_weights": MODEL_SHARED_WEIGHTS,
+        "model_version": model_version,
+        "readiness": readiness.as_dict(),
+    }
+    if settings is not None:
+        info["settings"] = settings
+    if engine is not None:
+        info["batching"] = engine.stats()
+    if prediction_cache is not None:
+        info["cache"] = prediction_cache.stats()
+    if INFERENCE_MODE == "process" and predictor is not None:
+        info["pool"] = predictor.stats()
+    return info
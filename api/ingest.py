@@ -0,0 +1,347 @@
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Request, status
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Bytes of an upload kept in memory before it spills to a temporary file
+UPLOAD_SPOOL_MEMORY = int(os.environ.get("UPLOAD_SPOOL_MEMORY", str(1024 * 1024)))
+MAX_FIELD_SIZE = 64 * 1024
+# Multipart boundaries and part headers on top of the file data itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+MAGIC_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+SNIFF_BYTES = 12
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """MIME type of an image from its leading magic bytes"""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in MAGIC_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return None
+
+
+class IngestStats:
+    """Memory held by uploads that are still being received or processed"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.memory_bytes = 0
+        self.peak_memory_bytes = 0
+        self.spilled_to_disk = 0
+        self.completed = 0
+        self.rejected = {}
+
+    def opened(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def closed(self, memory_bytes: int) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.memory_bytes -= memory_bytes
+
+    def buffered(self, size: int) -> None:
+        with self._lock:
+            self.memory_bytes += size
+            self.peak_memory_bytes = max(self.peak_memory_bytes, self.memory_bytes)
+
+    def spilled(self, memory_bytes: int) -> None:
+        with self._lock:
+            self.memory_bytes -= memory_bytes
+            self.spilled_to_disk += 1
+
+    def received(self, count: int) -> None:
+        with self._lock:
+            self.completed += count
+
+    def reject(self, reason: str) -> None:
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def as_dict(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "memory_bytes": self.memory_bytes,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "spool_memory_limit": UPLOAD_SPOOL_MEMORY,
+            "spilled_to_disk": self.spilled_to_disk,
+            "completed": self.completed,
+            "rejected": dict(self.rejected),
+        }
+
+
+ingest_stats = IngestStats()
+
+
+def _reject(reason: str, status_code: int, detail: str) -> HTTPException:
+    ingest_stats.reject(reason)
+    return HTTPException(status_code=status_code, detail=detail)
+
+
+class SpooledUpload:
+    """One uploaded file, hashed and size-checked as its bytes arrive
+
+    Data stays in memory up to UPLOAD_SPOOL_MEMORY and then moves to a
+    temporary file, so a slow or large upload never pins more than that
+    much memory while it is being received. When `strict` is False a failed
+    check is kept on `error` and the rest of the file is discarded instead of
+    failing the whole request.
+    """
+
+    def __init__(self, field_name: str, filename: str, content_type: str, max_size: int, strict: bool = True):
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self.max_size = max_size
+        self.size = 0
+        self.detected_type = None
+        self.strict = strict
+        self.error = None
+        self.file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY)
+        self._hash = hashlib.sha256()
+        self._header = b""
+        self._in_memory = 0
+        self._closed = False
+        ingest_stats.opened()
+
+    def fail(self, error: HTTPException) -> None:
+        """Reject this file; raises unless the upload is non-strict"""
+        if self.strict:
+            raise error
+        if self.error is None:
+            self.error = error
+            self.close()
+
+    def write(self, data: bytes) -> None:
+        if self.error is not None:
+            return
+        if self.size + len(data) > self.max_size:
+            return self.fail(_reject(
+                "too_large",
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"File too large. Maximum size allowed: {self.max_size // (1024*1024)}MB"
+            ))
+        if self.detected_type is None and len(self._header) < SNIFF_BYTES:
+            self._header += data[:SNIFF_BYTES - len(self._header)]
+            if len(self._header) >= SNIFF_BYTES and not self._sniff():
+                return
+        self._hash.update(data)
+        self.file.write(data)
+        self.size += len(data)
+        if self.size <= UPLOAD_SPOOL_MEMORY:
+            self._in_memory += len(data)
+            ingest_stats.buffered(len(data))
+        elif self._in_memory:
+            # SpooledTemporaryFile has just rolled over to disk
+            ingest_stats.spilled(self._in_memory)
+            self._in_memory = 0
+
+    def _sniff(self) -> bool:
+        self.detected_type = sniff_image_type(self._header)
+        if self.detected_type is None:
+            self.fail(_reject(
+                "not_an_image",
+                status.HTTP_400_BAD_REQUEST,
+                "File content is not a supported image"
+            ))
+        elif self.content_type and self.content_type != self.detected_type:
+            self.fail(_reject(
+                "type_mismatch",
+                status.HTTP_400_BAD_REQUEST,
+                "File content doesn't match the file type"
+            ))
+        return self.error is None
+
+    def finish(self) -> None:
+        if self.error is not None:
+            return
+        if self.size and self.detected_type is None:
+            self._sniff()
+        if self.error is None:
+            self.file.seek(0)
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def read_bytes(self) -> bytes:
+        self.file.seek(0)
+        content = self.file.read()
+        self.file.seek(0)
+        return content
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.file.close()
+            ingest_stats.closed(self._in_memory)
+            self._in_memory = 0
+
+
+class MultipartForm:
+    def __init__(self):
+        self.files = []
+        self.fields = {}
+
+    def file(self, name: str) -> Optional[SpooledUpload]:
+        return next((f for f in self.files if f.field_name == name), None)
+
+    def files_named(self, name: str) -> list[SpooledUpload]:
+        return [f for f in self.files if f.field_name == name]
+
+    def detach(self, upload: SpooledUpload) -> SpooledUpload:
+        """Hand `upload` over to the caller, who closes it; `close()` leaves it open"""
+        self.files.remove(upload)
+        return upload
+
+    def close(self) -> None:
+        for upload in self.files:
+            upload.close()
+
+
+async def read_multipart(
+    request: Request,
+    max_file_size: int,
+    max_files: int = 1,
+    validate_file: Optional[Callable[[str, str], None]] = None,
+    strict: bool = True
+) -> MultipartForm:
+    """Stream a multipart/form-data body into spooled, pre-validated uploads
+
+    `validate_file(filename, content_type)` runs as soon as a file part's
+    headers arrive, before any of its data is read. Size limits and magic
+    bytes are enforced chunk by chunk, so a bad upload is rejected without
+    buffering the rest of the body. With `strict=False` a bad file is marked
+    with its error and skipped, and the other files are still read.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise _reject("not_multipart", status.HTTP_400_BAD_REQUEST, "Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        if int(content_length) > max_files * max_file_size + MULTIPART_OVERHEAD:
+            raise _reject(
+                "too_large",
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"File too large. Maximum size allowed: {max_file_size // (1024*1024)}MB"
+            )
+
+    form = MultipartForm()
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part["headers"] = {}
+        part["field"] = b""
+        part["value"] = b""
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = b""
+        part["value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("latin-1")
+        if b"filename" not in disposition:
+            part["upload"] = None
+            part["data"] = bytearray()
+            part["name"] = name
+            return
+        if len(form.files) >= max_files:
+            raise _reject("too_many_files", status.HTTP_400_BAD_REQUEST, f"Too many files. Maximum: {max_files}")
+        filename = disposition[b"filename"].decode("utf-8", errors="replace")
+        file_type = part["headers"].get(b"content-type", b"").decode("latin-1")
+        upload = SpooledUpload(name, filename, file_type, max_file_size, strict=strict)
+        form.files.append(upload)
+        part["upload"] = upload
+        if validate_file is not None:
+            try:
+                validate_file(filename, file_type)
+            except HTTPException as e:
+                ingest_stats.reject("invalid_file")
+                upload.fail(e)
+
+    def on_part_data(data, start, end):
+        if part["upload"] is not None:
+            part["upload"].write(data[start:end])
+            return
+        if len(part["data"]) + end - start > MAX_FIELD_SIZE:
+            raise _reject("field_too_large", status.HTTP_400_BAD_REQUEST, "Form field too large")
+        part["data"] += data[start:end]
+
+    def on_part_end():
+        if part.get("upload") is not None:
+            part["upload"].finish()
+        elif "data" in part:
+            form.fields.setdefault(part["name"], []).append(part["data"].decode("utf-8", errors="replace"))
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                parser.write(chunk)
+        parser.finalize()
+    except HTTPException:
+        form.close()
+        raise
+    except Exception as e:
+        form.close()
+        raise _reject("malformed", status.HTTP_400_BAD_REQUEST, f"Malformed multipart upload: {str(e)}")
+
+    ingest_stats.received(sum(upload.error is None for upload in form.files))
+    return form
+
+
+def multipart_openapi(file_fields: dict, form_fields: Optional[dict] = None) -> dict:
+    """OpenAPI request body for routes that read the multipart stream themselves"""
+    properties = {
+        name: schema if "type" in schema else {"type": "string", "format": "binary", **schema}
+        for name, schema in file_fields.items()
+    }
+    for name, schema in (form_fields or {}).items():
+        properties[name] = schema
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {"type": "object", "properties": properties, "required": list(file_fields)}
+                }
+            }
+        }
+    }
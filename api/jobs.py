@@ -0,0 +1,244 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException, status
+
+from .telemetry import job_duration, percentile
+
+logger = logging.getLogger("api-logger")
+
+PHASES = ("queue", "run", "total")
+FINISHED = ("succeeded", "failed")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Job:
+    """One queued unit of work: queued -> running -> succeeded or failed"""
+
+    def __init__(
+        self,
+        owner: str,
+        work: Callable[[], Awaitable[Any]],
+        cleanup: Optional[Callable[[], None]] = None,
+        job_id: Optional[str] = None
+    ):
+        self.id = job_id or str(uuid.uuid4())
+        self.owner = owner
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self._finished = None
+        self._work = work
+        self._cleanup = cleanup
+        self._enqueued = time.perf_counter()
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    def _set(self, state: str) -> None:
+        self.status = state
+        # Wake everyone waiting for this change, then arm a fresh event for the next one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def next_change(self) -> asyncio.Event:
+        """Event set on the job's next state change; take it before reading the state"""
+        return self._changed
+
+    def release(self) -> None:
+        cleanup, self._cleanup, self._work = self._cleanup, None, None
+        if cleanup is not None:
+            try:
+                cleanup()
+            except Exception as e:
+                logger.error(f"Failed to release job {self.id}: {e}")
+
+    def as_dict(self) -> dict:
+        info = {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.result is not None:
+            info["result"] = self.result
+        if self.error is not None:
+            info["error"] = self.error
+        return info
+
+
+class JobQueue:
+    """Background workers for requests that answer 202 and report their result later
+
+    Jobs live in this process only: they are queued on an asyncio queue,
+    run by `workers` tasks, and kept for `result_ttl` seconds after they
+    finish so clients can fetch the outcome. A full queue rejects new jobs
+    with 503 instead of growing without bound.
+    """
+
+    def __init__(self, workers: int = 4, max_queued: int = 256, result_ttl: float = 600.0, window: int = 1024):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._queue = None
+        self._tasks = []
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._durations = {phase: deque(maxlen=window) for phase in PHASES}
+        self._running = 0
+        self._submitted = 0
+        self._succeeded = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        loop = asyncio.get_running_loop()
+        # Started from a clean context, so workers created during a request
+        # do not keep attributing their stage timings to that request
+        self._tasks = [
+            contextvars.Context().run(loop.create_task, self._work())
+            for _ in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait().release()
+
+    def submit(
+        self,
+        owner: str,
+        work: Callable[[], Awaitable[Any]],
+        cleanup: Optional[Callable[[], None]] = None,
+        job_id: Optional[str] = None
+    ) -> Job:
+        """Queue `work()`; `cleanup()` runs once the job has finished, or if it is never queued"""
+        self.start()
+        self._expire()
+        job = Job(owner, work, cleanup, job_id)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._rejected += 1
+            job.release()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many prediction jobs are queued, please retry shortly",
+                headers={"Retry-After": "5"}
+            )
+        self._jobs[job.id] = job
+        self._submitted += 1
+        return job
+
+    def get(self, job_id: str, owner: str) -> Optional[Job]:
+        """The job, if it exists here and belongs to `owner`"""
+        self._expire()
+        job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+    def _expire(self) -> None:
+        now = time.perf_counter()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job._finished is not None and now - job._finished > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _observe(self, phase: str, seconds: float) -> None:
+        job_duration.observe(seconds, phase)
+        with self._lock:
+            self._durations[phase].append(seconds)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        started = time.perf_counter()
+        self._observe("queue", started - job._enqueued)
+        self._running += 1
+        job.started_at = _now()
+        job._set("running")
+        try:
+            job.result = await job._work()
+            state = "succeeded"
+            self._succeeded += 1
+        except asyncio.CancelledError:
+            job.error = {"status_code": status.HTTP_503_SERVICE_UNAVAILABLE, "detail": "Server shutting down"}
+            self._failed += 1
+            self._finish(job, "failed", started)
+            raise
+        except HTTPException as e:
+            job.error = {"status_code": e.status_code, "detail": e.detail}
+            state = "failed"
+            self._failed += 1
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.error = {"status_code": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": "Prediction failed"}
+            state = "failed"
+            self._failed += 1
+        self._finish(job, state, started)
+
+    def _finish(self, job: Job, state: str, started: float) -> None:
+        self._running -= 1
+        finished = time.perf_counter()
+        self._observe("run", finished - started)
+        self._observe("total", finished - job._enqueued)
+        job._finished = finished
+        job.finished_at = _now()
+        job.release()
+        job._set(state)
+
+    def stats(self) -> dict:
+        with self._lock:
+            durations = {}
+            for phase, values in self._durations.items():
+                if values:
+                    ordered = sorted(values)
+                    durations[phase] = {
+                        "p50_ms": round(percentile(ordered, 0.5) * 1000, 2),
+                        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                    }
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queued": self.max_queued,
+            "running": self._running,
+            "submitted": self._submitted,
+            "succeeded": self._succeeded,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "retained": len(self._jobs),
+            "durations": durations,
+        }
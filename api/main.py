@@ -1,14 +1,37 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
+from datetime import datetime, timezone
 from .routers import auth, upload, signup, supabase_test, user
-from .middlewares.auth import auth_middleware
-from .middlewares.logger import log_requests
+from .middlewares.auth import CookieAuthMiddleware
+from .middlewares.logger import RequestLogMiddleware, log_sink
+from .middlewares.timing import ServerTimingMiddleware
+from . import content_store, embeddings, telemetry
+from .data import data
+from .inference import runtime
+from .ingest import ingest_stats
+from .pipeline import pipeline_stats
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await data.start()
+    upload.start_inference()
+    upload.prediction_jobs.start()
+    log_sink.start()
+    yield
+    await upload.prediction_jobs.stop()
+    await log_sink.stop()
+    upload.stop_inference()
+    await data.close()
+
 
 app = FastAPI(
     title="SkinCheck API",
     description="Production-level API for skin analysis",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Global exception handlers for production
@@ -72,9 +95,12 @@ async def general_exception_handler(request: Request, exc: Exception):
             "code": "INTERNAL_ERROR"
         }
     )
-# Middleware (order matters - added from bottom to top)
-app.middleware("http")(log_requests)
-app.middleware("http")(auth_middleware)
+# Middleware (order matters - added from bottom to top). All three are plain
+# ASGI, so responses stream through them and routes run in the request's task
+app.add_middleware(RequestLogMiddleware)
+app.add_middleware(CookieAuthMiddleware)
+# Outermost, so its timings include the other middlewares
+app.add_middleware(ServerTimingMiddleware)
 
 # Include routers
 app.include_router(auth.router)
@@ -95,9 +121,79 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Detailed health check"""
-    return {
-        "status": "healthy",
-        "timestamp": "2025-08-06T00:00:00Z",
-        "version": "1.0.0"
-    }
+    """Detailed health check; 503 until the prediction model is ready, unless it loads on demand"""
+    healthy = runtime.readiness.healthy
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "healthy" if healthy else runtime.readiness.state,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "version": "1.0.0",
+            "inference": runtime.stats(),
+            "uploads": ingest_stats.as_dict(),
+            "pipeline": pipeline_stats.as_dict(),
+            "storage": content_store.stats(),
+            "embeddings": embeddings.embedding_store.stats(),
+            "supabase": data.stats(),
+            "jobs": upload.prediction_jobs.stats(),
+            "admission": upload.admission.stats(),
+            "history_cache": upload.history_cache.stats() if upload.history_cache else None,
+            "logging": log_sink.stats()
+        }
+    )
+
+
+def component_metrics():
+    """Counters the inference, upload and logging components already keep, read at scrape time"""
+    inference = runtime.stats()
+    yield "skincheck_model_ready", "gauge", "1 once the prediction model is loaded and warm", [
+        ({}, int(runtime.readiness.ready))
+    ]
+    cache = inference.get("cache")
+    if cache:
+        yield "skincheck_prediction_cache_lookups_total", "counter", "Prediction lookups by where the result came from", [
+            ({"source": source}, cache[key])
+            for source, key in (("memory", "hits"), ("database", "database_hits"), ("coalesced", "coalesced"), ("inference", "misses"))
+        ]
+        yield "skincheck_prediction_cache_entries", "gauge", "Predictions held in memory", [({}, cache["entries"])]
+    batching = inference.get("batching")
+    if batching:
+        yield "skincheck_inference_queue_depth", "gauge", "Images waiting for a forward pass", [({}, batching["queue_depth"])]
+        yield "skincheck_inference_batches_in_flight", "gauge", "Forward passes currently running", [({}, batching["batches_in_flight"])]
+    uploads = ingest_stats.as_dict()
+    yield "skincheck_upload_memory_bytes", "gauge", "Memory held by uploads being received or processed", [({}, uploads["memory_bytes"])]
+    yield "skincheck_uploads_rejected_total", "counter", "Uploads rejected while streaming, by reason", [
+        ({"reason": reason}, count) for reason, count in uploads["rejected"].items()
+    ]
+    pipeline = pipeline_stats.as_dict()
+    yield "skincheck_orphaned_uploads_removed_total", "counter", "Stored objects deleted after a failed upload", [
+        ({}, pipeline["orphans_removed"])
+    ]
+    yield "skincheck_stored_images_total", "counter", "Content-addressed images by whether they were uploaded or already stored", [
+        ({"outcome": outcome}, content_store.counts[outcome]) for outcome in ("uploaded", "deduplicated")
+    ]
+    admission = upload.admission.stats()
+    yield "skincheck_admission_in_flight", "gauge", "Admitted prediction requests still running", [({}, admission["in_flight"])]
+    yield "skincheck_admission_decisions_total", "counter", "Prediction requests by admission outcome", [
+        ({"outcome": outcome}, admission[outcome]) for outcome in ("admitted", "rate_limited", "overloaded")
+    ]
+    jobs = upload.prediction_jobs.stats()
+    yield "skincheck_jobs_queued", "gauge", "Prediction jobs waiting for a worker", [({}, jobs["queued"])]
+    yield "skincheck_jobs_running", "gauge", "Prediction jobs being processed", [({}, jobs["running"])]
+    yield "skincheck_jobs_total", "counter", "Prediction jobs by outcome", [
+        ({"outcome": outcome}, jobs[outcome]) for outcome in ("succeeded", "failed", "rejected")
+    ]
+    logging_stats = log_sink.stats()
+    yield "skincheck_request_logs_total", "counter", "Request log records by outcome", [
+        ({"outcome": outcome}, logging_stats[outcome]) for outcome in ("enqueued", "flushed", "dropped", "failed")
+    ]
+    yield "skincheck_auth_cache_entries", "gauge", "Verified access tokens cached", [({}, len(auth.verified_claims))]
+
+
+telemetry.register_collector(component_metrics)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics for this worker process"""
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
@@ -1,28 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException,Request, status
-import jwt
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from ..schemas import SignUpRequest, AuthResponse
-from ..supabase import supabase
-from gotrue.errors import AuthApiError
-from os import getenv
-# to be used later for JWT secret
+from starlette.datastructures import Headers
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-supabase_jwt_secret: str = getenv("SUPABASE_JWT_SECRET")
-security = HTTPBearer()
 
-router = APIRouter(
-    tags=["Authentication"],
-    prefix="/auth"  # Prefix for all routes in this router
-    )
+class CookieAuthMiddleware:
+    """Use the `access_token` cookie set by /auth/ as the bearer token
 
+    Requests that already send an Authorization header are left alone. The
+    token is not verified here; the get_current_user dependency does that,
+    once, on the routes that need it.
+    """
 
-async def auth_middleware(request: Request, call_next):
-    print("Auth middleware triggered")
-    token = request.cookies.get("access_token")
-    if token and token.startswith("Bearer "):
-        token = token.split(" ")[1]  # Extract the actual token
-        request.headers.__dict__["_list"].append(
-            (b"authorization", f"Bearer {token}".encode())
-        )
-    response = await call_next(request)
-    return response
\ No newline at end of file
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            if "authorization" not in headers and "cookie" in headers:
+                token = cookie_parser(headers["cookie"]).get("access_token", "")
+                if token.startswith("Bearer "):
+                    # In place, so outer middlewares see what routing adds to this scope
+                    scope["headers"] = [*scope["headers"], (b"authorization", token.encode("latin-1"))]
+        await self.app(scope, receive, send)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger("api-logger")
+
+
+class LogSink:
+    """Buffers request log records and bulk-inserts them in the background
+
+    Middleware calls `put` and never waits on the database. A flusher task
+    writes up to `batch_size` records at a time, at least every
+    `flush_interval` seconds. When the queue is full the "drop" policy
+    discards the record immediately and the "block" policy waits up to
+    `block_timeout` seconds for room before discarding it.
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[list[dict]], Any],
+        max_queue: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 2.0,
+        policy: str = "drop",
+        block_timeout: float = 0.5
+    ):
+        if policy not in ("drop", "block"):
+            raise ValueError("policy must be 'drop' or 'block'")
+        self.writer = writer
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue = None
+        self._flusher = None
+        # Records taken off the queue but not yet handed to a write
+        self._collecting = []
+        self._writing = None
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+
+    async def put(self, record: dict) -> None:
+        self.start()
+        try:
+            if self.policy == "block":
+                await asyncio.wait_for(self._queue.put(record), self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+            self.enqueued += 1
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.dropped += 1
+
+    async def _next_batch(self) -> list[dict]:
+        batch = self._collecting = []
+        batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: list[dict]) -> None:
+        try:
+            if asyncio.iscoroutinefunction(self.writer):
+                await self.writer(batch)
+            else:
+                await run_in_threadpool(self.writer, batch)
+            self.flushed += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to log {len(batch)} records to Supabase: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            self._collecting = []
+            self._writing = asyncio.ensure_future(self._write(batch))
+            # Shielded so that shutdown never abandons a batch halfway
+            await asyncio.shield(self._writing)
+
+    async def stop(self) -> None:
+        """Stop the flusher and write out everything still queued"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._writing is not None:
+            await self._writing
+        if self._collecting:
+            batch, self._collecting = self._collecting, []
+            await self._write(batch)
+        if self._queue is None:
+            return
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._write(batch)
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
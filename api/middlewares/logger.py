@@ -1,20 +1,14 @@
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
 import logging
 import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from ..routers.auth import get_current_user
-from fastapi.security import HTTPAuthorizationCredentials
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .log_sink import LogSink
+from ..data import data
 
-# Load environment variables
-load_dotenv()
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Request logs are buffered and bulk-inserted off the request path
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2.0"))
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop")
 
 logger = logging.getLogger("api-logger")
 if not logger.handlers:
@@ -26,48 +20,56 @@ if not logger.handlers:
     logger.addHandler(handler)
     logger.setLevel(logging.INFO)
 
-async def log_requests(request: Request, call_next):
-    ip = request.client.host
-    auth_header = request.headers.get("authorization", "")
-    email = "anonymous"
-    user_uuid = None
 
-    if auth_header.startswith("Bearer "):
-        try:
-            # Create credentials object for get_current_user
-            from fastapi.security import HTTPAuthorizationCredentials
-            credentials = HTTPAuthorizationCredentials(
-                scheme="Bearer",
-                credentials=auth_header.replace("Bearer ", "")
-            )
-            
-            # Use the auth router's get_current_user function
-            user_data = get_current_user(credentials)
-            user_uuid = user_data.get("sub")
-            email = user_data.get("email", "no_email")
-            
-        except Exception as e:
-            # If authentication fails, keep defaults
-            email = "auth_failed"
-            user_uuid = None
-    
-    response = await call_next(request)
-    logger.info(f"Response: {response.status_code} for {request.method} {request.url.path}")
+async def write_logs(records: list[dict]) -> None:
+    await data.insert_logs(records)
+
+
+log_sink = LogSink(
+    write_logs,
+    max_queue=LOG_QUEUE_SIZE,
+    batch_size=LOG_BATCH_SIZE,
+    flush_interval=LOG_FLUSH_INTERVAL,
+    policy=LOG_QUEUE_POLICY
+)
 
-    # Log complete request and response to Supabase
-    try:
-        supabase.table("logs").insert({
-            "method": request.method,
-            "path": request.url.path,
-            "user_uuid": user_uuid,
-            "ip": ip,
-            "status_code": response.status_code,
-        }).execute()
-    except Exception as e:
-        logger.error(f"Failed to log to Supabase: {e}")
+class RequestLogMiddleware:
+    """Log every response and queue a record of it for the `logs` table
 
-    return response
+    The caller is read from request state, where the get_current_user
+    dependency leaves the identity it verified; this never verifies a token
+    itself, so unauthenticated routes are logged as anonymous.
+    """
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        return await log_requests(request, call_next)
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # request.state of the route handling this request; get_current_user fills in "user"
+        state = scope.setdefault("state", {})
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                logger.info(f"Response: {status_code} for {scope['method']} {scope['path']}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            user = state.get("user") or {}
+            client = scope.get("client")
+            # Queue the request log; the sink writes it to Supabase in bulk
+            await log_sink.put({
+                "method": scope["method"],
+                "path": scope["path"],
+                "user_uuid": user.get("sub"),
+                "ip": client[0] if client else None,
+                "status_code": status_code,
+            })
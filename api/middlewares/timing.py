@@ -0,0 +1,50 @@
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .. import telemetry
+
+
+class ServerTimingMiddleware:
+    """Collect per-stage timings for the request, report them in Server-Timing and /metrics
+
+    Timings are taken when the response starts, so a streamed response is
+    measured up to its headers, and its body passes through unbuffered.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = telemetry.start_request()
+        spans = telemetry.current_spans()
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status_code: int) -> float:
+            nonlocal recorded
+            recorded = True
+            elapsed = time.perf_counter() - started
+            # The route template, not the raw path, keeps label cardinality bounded
+            route_path = getattr(scope.get("route"), "path", "unmatched")
+            telemetry.http_requests.inc(scope["method"], route_path, str(status_code))
+            telemetry.http_request_duration.observe(elapsed, scope["method"], route_path)
+            return elapsed
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                elapsed = record(message["status"])
+                MutableHeaders(scope=message).append("Server-Timing", telemetry.server_timing(spans, total=elapsed))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if not recorded:
+                record(500)
+            telemetry.finish_request(token)
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from .telemetry import percentile
+
+logger = logging.getLogger("api-logger")
+
+# "concurrent" overlaps inference with the storage upload, "sequential" runs
+# inference, upload and insert one after the other (the original flow). Flip
+# it and compare "pipeline" in /health to measure the latency saved.
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "concurrent")
+PIPELINE_STATS_WINDOW = int(os.environ.get("PIPELINE_STATS_WINDOW", "1024"))
+
+if PIPELINE_MODE not in ("concurrent", "sequential"):
+    raise ValueError("PIPELINE_MODE must be 'concurrent' or 'sequential'")
+
+STAGES = ("inference", "storage", "insert", "total")
+
+
+class PipelineStats:
+    """Per-stage latency over the most recent requests, split by route and pipeline mode"""
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._window = window
+        self.reset()
+
+    def reset(self) -> None:
+        self._samples = {}
+        self.requests = 0
+        self.failures = 0
+        self.compensations = 0
+        self.compensation_failures = 0
+
+    def record(self, route: str, mode: str, timings: dict) -> None:
+        with self._lock:
+            self.requests += 1
+            samples = self._samples.setdefault((route, mode), {stage: deque(maxlen=self._window) for stage in STAGES})
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+
+    def failed(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def compensated(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.compensations += 1
+            else:
+                self.compensation_failures += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            routes = {}
+            for (route, mode), samples in self._samples.items():
+                entry = routes.setdefault(route, {})[mode] = {"requests": len(samples["total"])}
+                for stage, values in samples.items():
+                    if values:
+                        ordered = sorted(values)
+                        entry[stage] = {
+                            "p50_ms": round(percentile(ordered, 0.5) * 1000, 2),
+                            "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                        }
+            return {
+                "mode": PIPELINE_MODE,
+                "requests": self.requests,
+                "failures": self.failures,
+                "orphans_removed": self.compensations,
+                "orphan_removal_failures": self.compensation_failures,
+                "routes": routes,
+            }
+
+
+pipeline_stats = PipelineStats(window=PIPELINE_STATS_WINDOW)
+_cleanups = set()
+
+
+async def _timed(stage: str, timings: dict, step: Callable[[], Awaitable[Any]]) -> Any:
+    started = time.perf_counter()
+    try:
+        return await step()
+    finally:
+        timings[stage] = time.perf_counter() - started
+
+
+async def _remove(stored: Any, compensate: Callable[[Any], Awaitable[None]]) -> None:
+    try:
+        await compensate(stored)
+        pipeline_stats.compensated(True)
+    except Exception as e:
+        pipeline_stats.compensated(False)
+        logger.error(f"Failed to remove orphaned upload: {e}")
+
+
+async def _discard_when_stored(store_task: asyncio.Future, compensate: Callable[[Any], Awaitable[None]]) -> None:
+    try:
+        stored = await store_task
+    except BaseException:
+        return
+    await _remove(stored, compensate)
+
+
+def discard(store_task: asyncio.Future, compensate: Callable[[Any], Awaitable[None]]) -> None:
+    """Undo a storage upload in the background once it has finished, if it succeeded
+
+    The upload runs in a worker thread and cannot be interrupted, so instead
+    of cancelling it we wait for it and delete whatever it wrote.
+    """
+    cleanup = asyncio.ensure_future(_discard_when_stored(store_task, compensate))
+    _cleanups.add(cleanup)
+    cleanup.add_done_callback(_cleanups.discard)
+
+
+async def run_upload_pipeline(
+    infer: Callable[[], Awaitable[Any]],
+    store: Callable[[], Awaitable[Any]],
+    insert: Callable[[Any, Any], Awaitable[Any]],
+    compensate: Callable[[Any], Awaitable[None]],
+    mode: str = PIPELINE_MODE,
+    route: str = "predict"
+) -> tuple[Any, Any, Any]:
+    """Run inference and the storage upload, then insert the metadata row
+
+    In concurrent mode inference and the upload overlap. A failed upload
+    cancels inference; a failed inference lets the upload finish and deletes
+    it with `compensate`. A failed insert also deletes the stored object.
+    Returns (inference result, stored object, inserted row).
+    """
+    timings = {}
+    started = time.perf_counter()
+    store_task = None
+    try:
+        if mode == "sequential":
+            result = await _timed("inference", timings, infer)
+            store_task = asyncio.ensure_future(_timed("storage", timings, store))
+            stored = await store_task
+        else:
+            infer_task = asyncio.ensure_future(_timed("inference", timings, infer))
+            store_task = asyncio.ensure_future(_timed("storage", timings, store))
+            try:
+                done, _ = await asyncio.wait({infer_task, store_task}, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()
+                # No failure, so both have finished
+                result, stored = infer_task.result(), store_task.result()
+            except BaseException:
+                infer_task.cancel()
+                raise
+        row = await _timed("insert", timings, lambda: insert(result, stored))
+    except BaseException:
+        pipeline_stats.failed()
+        if store_task is not None:
+            discard(store_task, compensate)
+        raise
+    timings["total"] = time.perf_counter() - started
+    pipeline_stats.record(route, mode, timings)
+    return result, stored, row
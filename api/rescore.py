@@ -0,0 +1,253 @@
+"""Re-score stored uploads with the current model
+
+    python -m api.rescore [--batch-size 64] [--page-size 256] [--workers 8] [--limit N]
+                          [--checkpoint rescore-checkpoint.json] [--embeddings]
+
+After a model change, rows of `uploads` keep the prediction of the model
+that scored them, tagged with its `model_version`. This pages by id through
+the rows of any other version, downloads their originals from storage with
+`--workers` parallel downloads (decoding each into the model input on the
+same thread) and runs them through the model in batches of `--batch-size`.
+The next page downloads while the current one is scored and written, so
+neither storage nor the model waits on the other.
+
+Each page is written back with one call to this function, which sets only
+the prediction columns and only on rows still at the version they were
+read with. A row changed in the meantime, for example by another run, is
+left as it is and counted as changed:
+
+    create or replace function rescore_uploads(updates jsonb) returns setof bigint
+    language sql as $$
+      update uploads set
+        prediction_result = u.prediction_result,
+        prediction_confidence = u.prediction_confidence,
+        model_version = u.model_version
+      from jsonb_to_recordset(updates) as u(
+        id bigint, previous_version text, prediction_result text,
+        prediction_confidence double precision, model_version text)
+      where uploads.id = u.id and uploads.model_version is not distinct from u.previous_version
+      returning uploads.id
+    $$;
+
+The update moves each row's updated_at, so history ETags change and
+clients revalidating their history get the new predictions.
+
+Progress goes to the `--checkpoint` file after every written page, and a
+run picks up after the last id in it, so it can be stopped and restarted at
+any point. Uploads whose image cannot be read keep their old prediction and
+are stepped past; delete the checkpoint to retry them. A checkpoint of a
+different model version is ignored. With `--embeddings` (default: the
+EMBEDDINGS_ENABLED setting) each upload's embedding is also added to the
+embedding store, so similarity search covers uploads made before the change.
+
+The model comes from MODEL_ARTIFACT_DIR and its version from MODEL_VERSION
+or the artifact, tagged with the backend, as for the API; run it with the
+artifact and backend the API serves.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import torch
+
+from .embeddings import EMBEDDINGS_ENABLED, embedding_store, split_embedding
+from .inference import runtime
+from .inference.predictor import SkinCancerPredictor
+from .inference.preprocess import decode, open_image, to_model_input
+
+logger = logging.getLogger("api-logger")
+
+CHECKPOINT_FILE = os.environ.get("RESCORE_CHECKPOINT", "rescore-checkpoint.json")
+# processed = updated + changed + failed; changed rows were rewritten by someone else meanwhile
+COUNTS = ("processed", "updated", "changed", "failed", "images")
+
+
+def read_checkpoint(path: Optional[str], model_version: str) -> Optional[dict]:
+    """The saved progress of an earlier run for the same model version, if any"""
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint.get("model_version") != model_version:
+        logger.warning(f"Ignoring checkpoint {path} of model {checkpoint.get('model_version')}")
+        return None
+    return checkpoint
+
+
+def write_checkpoint(path: str, checkpoint: dict) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary, path)
+
+
+def rescore(client, bucket_name: str, predictor: SkinCancerPredictor, model_version: str,
+            batch_size: int = 64, page_size: int = 256, workers: int = 8, limit: Optional[int] = None,
+            checkpoint: Optional[str] = CHECKPOINT_FILE, embeddings: bool = False) -> dict:
+    """Score `uploads` rows of other model versions with `predictor` and store the results"""
+    bucket = client.storage.from_(bucket_name)
+    prefix = f"{bucket_name}/"
+    saved = read_checkpoint(checkpoint, model_version)
+    last_id = saved["last_id"] if saved else None
+    # Progress up to the last written page; only the writer thread changes it
+    committed = dict.fromkeys(COUNTS, 0)
+    committed.update(saved["counts"] if saved else {})
+    images_before = committed["images"]
+    # Quoted, as versions may contain characters PostgREST treats as syntax
+    other_version = f"model_version.is.null,model_version.neq.{json.dumps(model_version)}"
+
+    def next_page(after: Optional[int], size: int) -> list[dict]:
+        query = client.table("uploads").select(
+            "id, file_name, file_hash, url, user_uuid, model_version"
+        ).or_(other_version)
+        if after is not None:
+            query = query.gt("id", after)
+        return query.order("id").limit(size).execute().data
+
+    def image_key(row: dict) -> str:
+        # Rows of the same bytes share one download and one forward pass
+        return row.get("file_hash") or row.get("url") or row["file_name"]
+
+    def load(row: dict) -> Optional[torch.Tensor]:
+        url = row.get("url") or ""
+        file_name = url[len(prefix):] if url.startswith(prefix) else row["file_name"]
+        try:
+            return to_model_input(decode(open_image(bucket.download(file_name))))
+        except Exception as e:
+            logger.error(f"Skipping upload {row['id']}: cannot read {file_name}: {e}")
+            return None
+
+    def fetch(rows: list[dict]) -> dict[str, Future]:
+        """Start loading a page: one download per distinct image, in row order"""
+        loads = {}
+        for row in rows:
+            key = image_key(row)
+            if key not in loads:
+                loads[key] = loader.submit(load, row)
+        return loads
+
+    def score(loads: dict[str, Future]) -> dict[str, dict]:
+        results = {}
+        pending = list(loads.items())
+        for start in range(0, len(pending), batch_size):
+            loaded = [(key, future.result()) for key, future in pending[start:start + batch_size]]
+            loaded = [(key, tensor) for key, tensor in loaded if tensor is not None]
+            if not loaded:
+                continue
+            batch = predictor.predict_tensor(torch.stack([tensor for _, tensor in loaded]))
+            results.update((key, result) for (key, _), result in zip(loaded, batch))
+        return results
+
+    def write(page: dict, updates: list[dict], vectors: dict, position: int) -> None:
+        """Store a scored page and record it in the checkpoint; runs on the writer thread, in page order"""
+        written = set(client.rpc("rescore_uploads", {"updates": updates}).execute().data or []) if updates else set()
+        for user_uuid, entries in vectors.items():
+            entries = [(upload_id, vector) for upload_id, vector in entries if upload_id in written]
+            if entries:
+                embedding_store.append(model_version, user_uuid, [upload_id for upload_id, _ in entries],
+                                       [vector for _, vector in entries])
+        for key, value in page.items():
+            committed[key] += value
+        committed["updated"] += len(written)
+        committed["changed"] += len(updates) - len(written)
+        if checkpoint:
+            write_checkpoint(checkpoint, {"model_version": model_version, "last_id": position, "counts": committed})
+        rate = (committed["images"] - images_before) / (time.perf_counter() - started)
+        logger.info(f"Rescore: {committed}, {rate:.1f} images/s")
+
+    fetched = 0
+
+    def read_page(after: Optional[int]) -> list[dict]:
+        nonlocal fetched
+        size = page_size if limit is None else min(page_size, limit - fetched)
+        rows = next_page(after, size) if size > 0 else []
+        fetched += len(rows)
+        return rows
+
+    started = time.perf_counter()
+    writes = []
+    with ThreadPoolExecutor(max_workers=workers) as loader, ThreadPoolExecutor(max_workers=1) as writer:
+        rows = read_page(last_id)
+        loads = fetch(rows)
+        while rows:
+            last_id = rows[-1]["id"]
+            # Start downloading the next page before scoring this one
+            upcoming = read_page(last_id)
+            upcoming_loads = fetch(upcoming)
+
+            results = score(loads)
+            updates, vectors = [], defaultdict(list)
+            for row in rows:
+                result = results.get(image_key(row))
+                if result is None:
+                    continue
+                prediction, embedding = split_embedding(result)
+                updates.append({
+                    "id": row["id"],
+                    "previous_version": row.get("model_version"),
+                    "prediction_result": prediction["prediction"],
+                    "prediction_confidence": prediction["confidence"],
+                    "model_version": model_version,
+                })
+                if embeddings and embedding is not None and row.get("user_uuid"):
+                    vectors[row["user_uuid"]].append((row["id"], embedding))
+            page = {"processed": len(rows), "failed": len(rows) - len(updates), "images": len(results)}
+
+            # Writes go out in order on their own thread; waiting for all
+            # but the latest keeps failures from going unnoticed
+            writes.append(writer.submit(write, page, updates, dict(vectors), last_id))
+            while len(writes) > 1:
+                writes.pop(0).result()
+            rows, loads = upcoming, upcoming_loads
+        for pending in writes:
+            pending.result()
+
+    elapsed = time.perf_counter() - started
+    counts = dict(committed)
+    counts["images_per_second"] = round((counts["images"] - images_before) / elapsed, 1) if elapsed else 0.0
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score stored uploads with the current model")
+    parser.add_argument("--bucket", default=os.environ.get("SUPABASE_BUCKET"))
+    parser.add_argument("--backend", default=runtime.INFERENCE_BACKEND, help="eager, int8 or torchscript")
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per forward pass")
+    parser.add_argument("--page-size", type=int, default=256, help="Rows read and written per request")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel image downloads")
+    parser.add_argument("--threads", type=int, help="Torch intra-op threads (default: torch's own)")
+    parser.add_argument("--limit", type=int, help="Stop after this many uploads")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Progress file to resume from")
+    parser.add_argument("--embeddings", action=argparse.BooleanOptionalAction, default=EMBEDDINGS_ENABLED,
+                        help="Also add each upload's embedding to the embedding store")
+    args = parser.parse_args(argv)
+
+    if not args.bucket:
+        parser.error("--bucket or SUPABASE_BUCKET is required")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    runtime.apply_threads(args.threads, None)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model_path = runtime.resolve_model_path()
+    model_version = runtime.tagged_version(runtime.resolve_model_version(model_path), args.backend)
+    predictor = SkinCancerPredictor(model_path, device, backend=args.backend, embeddings=args.embeddings)
+    logger.info(f"Re-scoring uploads with model {model_version} ({args.backend} backend on {device})")
+
+    from .supabase import supabase
+    counts = rescore(supabase, args.bucket, predictor, model_version, args.batch_size, args.page_size,
+                     args.workers, args.limit, args.checkpoint, args.embeddings)
+    print(counts)
+
+
+if __name__ == "__main__":
+    main()
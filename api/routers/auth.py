@@ -2,15 +2,36 @@ from fastapi import APIRouter, Depends, HTTPException,Request, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from starlette.responses import Response
 import jwt
+import logging
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from ..schemas import SignUpRequest, AuthResponse
-from ..supabase import supabase
+from ..data import data
 from gotrue.errors import AuthApiError
 from os import getenv
+import time
+from typing import Optional
+from ..cache import TTLCache
+from ..telemetry import span
 
 
 supabase_jwt_secret: str = getenv("SUPABASE_JWT_SECRET")
 security = HTTPBearer()
+logger = logging.getLogger("api-logger")
+
+# "local" checks access tokens against SUPABASE_JWT_SECRET in-process,
+# "remote" asks Supabase Auth on every request
+AUTH_VERIFY_MODE = getenv("AUTH_VERIFY_MODE", "local" if supabase_jwt_secret else "remote")
+AUTH_AUDIENCE = getenv("AUTH_AUDIENCE", "authenticated")
+AUTH_CACHE_SIZE = int(getenv("AUTH_CACHE_SIZE", "4096"))
+AUTH_CACHE_TTL = float(getenv("AUTH_CACHE_TTL", "300"))
+
+if AUTH_VERIFY_MODE not in ("local", "remote"):
+    raise ValueError("AUTH_VERIFY_MODE must be 'local' or 'remote'")
+if AUTH_VERIFY_MODE == "local" and not supabase_jwt_secret:
+    raise ValueError("SUPABASE_JWT_SECRET must be set when AUTH_VERIFY_MODE is 'local'")
+
+# Verified claims keyed by token; entries never outlive the token's exp
+verified_claims = TTLCache(max_entries=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
 
 router = APIRouter(
     tags=["Authentication"],
@@ -29,15 +50,19 @@ router = APIRouter(
 #     return response
 
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def _bearer_token(credentials: HTTPAuthorizationCredentials) -> str:
+    token = credentials.credentials
+    # Remove 'Bearer ' prefix if present
+    if token.startswith("Bearer "):
+        token = token.split(" ")[1]
+    return token
+
+
+async def verify_token_remote(token: str) -> dict:
+    """Verify a token with Supabase Auth, which also catches revoked sessions"""
     try:
-        token = credentials.credentials
-        # Remove 'Bearer ' prefix if present
-        if token.startswith("Bearer "):
-            token = token.split(" ")[1]
-        
         # Use Supabase's built-in user verification
-        user_response = supabase.auth.get_user(token)
+        user_response = await data.get_user(token)
         
         if user_response and user_response.user:
             # Return user data in a format similar to JWT payload
@@ -62,15 +87,72 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
             detail="Could not validate credentials"
         )
 
+
+def verify_token_local(token: str) -> Optional[dict]:
+    """Verify signature, exp and aud of a Supabase access token without a network call
+
+    Returns None for tokens the shared secret cannot check, which are then
+    verified remotely.
+    """
+    cached = verified_claims.get(token)
+    if cached is not None:
+        return cached
+
+    try:
+        payload = jwt.decode(
+            token,
+            supabase_jwt_secret,
+            algorithms=["HS256"],
+            audience=AUTH_AUDIENCE,
+            options={"require": ["exp", "sub"]}
+        )
+    except jwt.InvalidAlgorithmError:
+        # Projects on asymmetric signing keys cannot be checked with the shared secret
+        return None
+    except jwt.PyJWTError as e:
+        logger.warning(f"Rejected access token: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials"
+        )
+
+    claims = {
+        "sub": payload["sub"],
+        "email": payload.get("email"),
+        "aud": payload.get("aud", AUTH_AUDIENCE),
+        "role": payload.get("role", "authenticated"),
+        "user_metadata": payload.get("user_metadata", {}),
+        "app_metadata": payload.get("app_metadata", {})
+    }
+    remaining = payload["exp"] - time.time()
+    verified_claims.set(token, claims, expires_at=time.monotonic() + remaining)
+    return claims
+
+
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Claims of the verified caller, checked at most once per request
+
+    The result is kept in request state, where the request log middleware
+    reads it and later dependencies reuse it.
+    """
+    claims = getattr(request.state, "user", None)
+    if claims is not None:
+        return claims
+    token = _bearer_token(credentials)
+    with span("auth"):
+        claims = verify_token_local(token) if AUTH_VERIFY_MODE == "local" else None
+        if claims is None:
+            claims = await verify_token_remote(token)
+    request.state.user = claims
+    return claims
+
+
 @router.post("/", status_code=status.HTTP_200_OK)
 async def authenticate_user(response: Response, email: str, password: str):
     """Authenticate user with Supabase and return session info"""
     try:
         # Attempt to sign in with Supabase
-        auth_response = supabase.auth.sign_in_with_password({
-            "email": email, 
-            "password": password
-        })
+        auth_response = await data.sign_in(email, password)
         
         if auth_response.user and auth_response.session:
             access_token = auth_response.session.access_token
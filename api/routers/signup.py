@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, status
 from ..schemas import CreateUser, CreateUserResponse
-from ..supabase import supabase
+from ..data import data
 from gotrue.errors import AuthApiError
 
 router = APIRouter(
@@ -13,15 +13,9 @@ async def sign_up_user(request: CreateUser):
     """Sign up a new user using Supabase Auth"""
     try:
         # Use Supabase authentication to create user
-        auth_response = supabase.auth.sign_up({
-            "email": request.email,
-            "password": request.password,
-            "options": {
-                "data": {
-                    "username": request.username,
-                    "age": request.age
-                }
-            }
+        auth_response = await data.sign_up(request.email, request.password, {
+            "username": request.username,
+            "age": request.age
         })
 
         if auth_response.user:
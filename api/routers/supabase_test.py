@@ -1,4 +1,4 @@
-from api.supabase import supabase
+from api.data import data
 from fastapi import Depends, HTTPException, status, APIRouter
 from typing import List
 from api import schemas
@@ -13,8 +13,7 @@ router = APIRouter(
 async def get_items(current_user: dict = Depends(get_current_user)):
     """Get all items"""
     try:
-        response = supabase.table("items").select("*").execute()
-        return response.data
+        return await data.list_items()
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -24,9 +23,9 @@ async def get_items(current_user: dict = Depends(get_current_user)):
 @router.get("/{item_id}",  status_code=status.HTTP_200_OK)
 async def get_item(item_id: int):
     """Get item by ID"""
-    response = supabase.table("items").select("*").eq("id", item_id).execute()
-    if response.data:
-        return response.data[0]
+    item = await data.get_item(item_id)
+    if item is not None:
+        return item
     raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Item not found"
@@ -34,9 +33,9 @@ async def get_item(item_id: int):
 
 @router.post("/",status_code=status.HTTP_201_CREATED)    
 async def create_item(content:str):
-    response = supabase.table("items").insert({"content": content}).execute()
-    if response.data:
-        return response.data[0]
+    item = await data.insert_item(content)
+    if item is not None:
+        return item
     raise HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST,
         detail="Failed to create item"
@@ -1,23 +1,31 @@
+import asyncio
+import base64
+import json
 import os
 import requests
 import warnings
 import hashlib
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 from datetime import datetime
 from ..schemas import PredictionRequest
-from fastapi import APIRouter, HTTPException, UploadFile, status, File, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Query, Request, status, Depends
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from PIL import Image
 import io
 import uuid
 from .auth import get_current_user
+from .. import content_store, derivatives, embeddings
+from ..admission import AdmissionController, AdmissionSlot
+from ..cache import ResponseCache
+from ..telemetry import span
 from ..schemas import FileUploadResponse, FileValidationError
-from ..supabase import supabase
-import torch
-from torchvision import transforms
-from transformers import ViTForImageClassification
-import io
-from huggingface_hub import hf_hub_download
+from ..data import data
+from starlette.concurrency import run_in_threadpool
+from ..inference import runtime
+from ..inference.preprocess import decode, open_image, to_model_input
+from ..jobs import JobQueue
+from ..pipeline import run_upload_pipeline
+from ..ingest import MultipartForm, SpooledUpload, multipart_openapi, read_multipart
 
 router = APIRouter(
     tags=["Upload and Predict"],
@@ -35,72 +43,110 @@ ALLOWED_IMAGE_TYPES = {
     "image/tiff": [".tiff", ".tif"]
 }
 ALLOWED_EXTENSIONS = [ext for extensions in ALLOWED_IMAGE_TYPES.values() for ext in extensions]
+ALLOWED_IMAGE_FORMATS = {"JPEG", "PNG", "WEBP", "BMP", "TIFF"}
+# Images accepted by one /predict/batch request
+MAX_BATCH_IMAGES = int(os.environ.get("MAX_BATCH_IMAGES", "16"))
+
+# Let the prediction cache reuse results stored with earlier identical uploads.
+# Stored results carry no embedding, so this is off while EMBEDDINGS_ENABLED
+# is set; a repeat upload then goes through the model and gets indexed too.
+PREDICTION_CACHE_DB_FALLBACK = os.environ.get("PREDICTION_CACHE_DB_FALLBACK", "true").lower() == "true"
+
+# Upload history pages, and the columns a client may project
+HISTORY_DEFAULT_LIMIT = int(os.environ.get("HISTORY_DEFAULT_LIMIT", "20"))
+HISTORY_MAX_LIMIT = int(os.environ.get("HISTORY_MAX_LIMIT", "100"))
+HISTORY_FIELDS = {
+    "id", "created_at", "file_name", "file_hash", "localization", "url",
+    "prediction_result", "prediction_confidence", "model_version",
+    "thumbnail_url", "model_input_url"
+}
+# Storage paths that history turns into links under IMAGE_BASE_URL
+HISTORY_URL_FIELDS = ("url", "thumbnail_url", "model_input_url")
+# History ETags also cover the latest `updated_at` of the user's uploads, so
+# rows rewritten after they were inserted (content_store dedupe, derivatives
+# backfill, rescore) change them too. A trigger keeps the column current:
+#
+#   alter table uploads add column updated_at timestamptz not null default now();
+#   create index on uploads (user_uuid, updated_at desc);
+#   create function touch_updated_at() returns trigger language plpgsql
+#     as $$ begin new.updated_at = now(); return new; end $$;
+#   create trigger uploads_updated_at before update on uploads
+#     for each row execute function touch_updated_at();
+#
+# Serialized history pages kept per user, dropped when that user uploads.
+# Other workers only see a new upload, and nothing sees the offline commands'
+# rewrites, until their copy expires, so keep it short; 0 disables
+HISTORY_CACHE_TTL = float(os.environ.get("HISTORY_CACHE_TTL", "30"))
+HISTORY_CACHE_SIZE = int(os.environ.get("HISTORY_CACHE_SIZE", "1024"))
+history_cache = ResponseCache(max_owners=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL) if HISTORY_CACHE_TTL > 0 else None
+
+# Prediction jobs (POST /predict/jobs): background workers per process, how
+# many jobs may wait for one, and how long finished jobs stay retrievable
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "256"))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "600"))
+# Seconds between keep-alive comments on an idle job event stream
+JOB_EVENTS_HEARTBEAT = float(os.environ.get("JOB_EVENTS_HEARTBEAT", "15"))
+prediction_jobs = JobQueue(workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, result_ttl=JOB_RESULT_TTL)
+
+# Admission control for the predict routes, decided after auth and before the
+# body is read. Each user may start ADMISSION_USER_RATE predictions per second
+# (per worker process) in bursts of ADMISSION_USER_BURST, or gets 429. Requests
+# are shed with 503 while ADMISSION_MAX_IN_FLIGHT predictions are running or
+# the inference queue holds more than ADMISSION_MAX_QUEUE_WAIT_MS of work.
+# A prediction job holds its slot until it finishes, so queued and running
+# jobs count against ADMISSION_MAX_IN_FLIGHT as well as JOB_QUEUE_SIZE.
+# Keep the in-flight limit well below the threadpool size (40 threads), so
+# auth and history requests always find a free thread.
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_USER_RATE = float(os.environ.get("ADMISSION_USER_RATE", "2"))
+ADMISSION_USER_BURST = float(os.environ.get("ADMISSION_USER_BURST", "10"))
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "16"))
+ADMISSION_MAX_QUEUE_WAIT_MS = float(os.environ.get("ADMISSION_MAX_QUEUE_WAIT_MS", "2000"))
+admission = AdmissionController(
+    rate=ADMISSION_USER_RATE,
+    burst=ADMISSION_USER_BURST,
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    max_queue_wait_ms=ADMISSION_MAX_QUEUE_WAIT_MS,
+    queue_wait=lambda: runtime.engine.estimated_wait() if runtime.engine is not None else 0.0
+)
 
 base_url = os.environ.get("IMAGE_BASE_URL")
 
 # Suppress warnings for deprecated features
 warnings.filterwarnings("ignore")
 
-# pretrained model
-# MODEL_URL = os.environ.get("MODEL_URL")
-# MODEL_PATH = os.environ.get("MODEL_PATH")
-MODEL_PATH = hf_hub_download(repo_id="Arif194/SkinCheck", filename="vit_checkpoint.pth")
-DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-
-
-class SkinCancerPredictor:
-    def __init__(self, model_path, device='cpu'):
-        self.device = device
-        self.model = self._load_model(model_path)
-        self.transform = self._get_transform()
-        self.binary_class_names = {0: "Benign", 1: "Malignant"}
-        self.benign_indices = [0, 3, 4, 6]
-        self.malignant_indices = [1, 2, 5]
-
-    def _load_model(self, model_path):
-        model = ViTForImageClassification.from_pretrained(
-            'google/vit-base-patch16-224-in21k',
-            num_labels=7,
-            ignore_mismatched_sizes=True
-        )
-        model.load_state_dict(torch.load(model_path, map_location=self.device))
-        model.to(self.device)
-        model.eval()
-        return model
-
-    def _get_transform(self):
-        return transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-
-    def predict(self, image: Image.Image):
-        input_tensor = self.transform(image).unsqueeze(0).to(self.device)
-        with torch.no_grad():
-            outputs = self.model(input_tensor)
-            probabilities_7_class = torch.softmax(outputs.logits, dim=1).squeeze(0)
-        prob_benign = probabilities_7_class[self.benign_indices].sum().item()
-        prob_malignant = probabilities_7_class[self.malignant_indices].sum().item()
-        total_prob = prob_benign + prob_malignant
-        if total_prob > 0:
-            prob_benign /= total_prob
-            prob_malignant /= total_prob
-        predicted_index = 0 if prob_benign > prob_malignant else 1
-        predicted_class = self.binary_class_names[predicted_index]
-        confidence = max(prob_benign, prob_malignant)
-        return {
-            "prediction": predicted_class,
-            "confidence": round(confidence, 4),
-            "probabilities": {
-            "Benign": round(prob_benign, 4),
-            "Malignant": round(prob_malignant, 4)
-            }
+async def find_stored_prediction(file_hash: str, model_version: str) -> Optional[dict]:
+    """Rebuild a prediction from an earlier upload of the same bytes"""
+    row = await data.find_prediction(file_hash, model_version)
+    return prediction_from_row(row) if row is not None else None
+
+
+def prediction_from_row(row: dict) -> Optional[dict]:
+    """The prediction response for an `uploads` row, or None if the row has none"""
+    if row.get("prediction_result") not in ("Benign", "Malignant") or row.get("prediction_confidence") is None:
+        return None
+    confidence = round(float(row["prediction_confidence"]), 4)
+    other = round(1 - confidence, 4)
+    benign_first = row["prediction_result"] == "Benign"
+    return {
+        "prediction": row["prediction_result"],
+        "confidence": confidence,
+        "probabilities": {
+            "Benign": confidence if benign_first else other,
+            "Malignant": other if benign_first else confidence
         }
+    }
+
+
+def start_inference() -> None:
+    """Begin loading the model in the background"""
+    database_tier = PREDICTION_CACHE_DB_FALLBACK and not embeddings.EMBEDDINGS_ENABLED
+    runtime.start(lookup=find_stored_prediction if database_tier else None)
 
-# Load model at startup
-predictor = SkinCancerPredictor(model_path=MODEL_PATH, device=DEVICE)
 
+def stop_inference() -> None:
+    runtime.stop()
 
 
 class ImageValidator:
@@ -139,30 +185,57 @@ class ImageValidator:
             )
     
     @staticmethod
-    async def validate_image_content(file_content: bytes) -> None:
-        """Validate actual image content using PIL"""
+    def validate_upload_headers(filename: str, content_type: str) -> None:
+        """Checks that only need the part headers, run before any file data is read"""
+        if not filename or filename.strip() == "":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid file: filename is empty"
+            )
+        ImageValidator.validate_file_type(content_type, filename)
+        ImageValidator.validate_filename(filename)
+
+    @staticmethod
+    async def validate_image_content(file_content) -> Image.Image:
+        """Validate image content (bytes or a file object) and return it decoded to RGB
+
+        Format and dimensions are checked from the header alone, so oversized
+        images are rejected before any pixel data is decoded. The image is
+        then decoded exactly once (at reduced scale for JPEG) off the event
+        loop; a corrupt or truncated file fails here.
+        """
+        with span("validate"):
+            try:
+                img = open_image(file_content)
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid image file: {str(e)}"
+                )
+
+            if img.format not in ALLOWED_IMAGE_FORMATS:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid image file: unsupported format {img.format}"
+                )
+
+            # Check image dimensions (optional)
+            width, height = img.size
+            if width < 100 or height < 100:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Image too small. Minimum dimensions: 100x100 pixels"
+                )
+
+            if width > 4096 or height > 4096:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Image too large. Maximum dimensions: 4096x4096 pixels"
+                )
+
         try:
-            with Image.open(io.BytesIO(file_content)) as img:
-                # Verify it's a valid image
-                img.verify()
-                
-                # Reset image for further processing
-                img = Image.open(io.BytesIO(file_content))
-                
-                # Check image dimensions (optional)
-                width, height = img.size
-                if width < 100 or height < 100:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Image too small. Minimum dimensions: 100x100 pixels"
-                    )
-                
-                if width > 4096 or height > 4096:
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Image too large. Maximum dimensions: 4096x4096 pixels"
-                    )
-                    
+            with span("decode"):
+                return await run_in_threadpool(decode, img)
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -197,119 +270,761 @@ class ImageValidator:
     
         return filename
 
+async def store_upload(bucket_name: str, file_name: str, upload: SpooledUpload, upsert: bool = False) -> str:
+    """Upload a received file to Supabase storage; returns its bucket/path"""
+    content = await run_in_threadpool(upload.read_bytes)
+    full_path = await data.upload_object(bucket_name, file_name, content, upload.content_type, upsert)
+    if not full_path:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Something went wrong. Failed to upload file to storage"
+        )
+    return full_path
+
+class StoredUpload(NamedTuple):
+    url: str            # bucket/path of the original, as kept in uploads.url
+    derivatives: dict   # `uploads` columns of its derivatives
+    created: List[str]  # objects written for this upload, removed again if its row is not saved
+    file_hash: Optional[str] = None  # set when the objects are content-addressed and may be shared
+
+async def store_with_derivatives(bucket_name: str, file_name: str, upload: SpooledUpload,
+                                 image_rgb: Image.Image) -> StoredUpload:
+    """Upload the original and its derivatives side by side
+
+    Derivatives are best effort and never fail the upload; if the original
+    fails, the derivatives already written are removed again. With
+    content-addressed storage, an image some row already references is not
+    uploaded again (see api/content_store.py).
+    """
+    file_hash = None
+    if content_store.CONTENT_ADDRESSED_STORAGE:
+        file_hash = upload.sha256
+        file_name = content_store.object_key(file_hash, file_name)
+        existing = await data.find_upload_by_object(file_hash, f"{bucket_name}/{file_name}")
+        if existing is not None:
+            content_store.counts["deduplicated"] += 1
+            shared = content_store.stored_columns(existing)
+            # Only derivatives enabled since the object was first stored need writing
+            missing = [kind for kind in derivatives.enabled_kinds() if derivatives.COLUMNS[kind] not in shared]
+            paths = {}
+            if missing:
+                paths = await derivatives.store_async(bucket_name, file_name, image_rgb, missing, upsert=True)
+            return StoredUpload(
+                existing["url"], {**shared, **derivatives.columns(bucket_name, paths)}, list(paths.values()), file_hash
+            )
+
+    # Content addresses always hold the same bytes, so overwriting one is harmless
+    upsert = file_hash is not None
+    stored_derivatives = asyncio.ensure_future(
+        derivatives.store_async(bucket_name, file_name, image_rgb, upsert=upsert)
+    )
+    try:
+        full_path = await store_upload(bucket_name, file_name, upload, upsert)
+    except BaseException:
+        paths = list((await stored_derivatives).values())
+        await data.remove_objects(bucket_name, paths)
+        raise
+    paths = await stored_derivatives
+    if file_hash is not None:
+        content_store.counts["uploaded"] += 1
+    return StoredUpload(
+        full_path, derivatives.columns(bucket_name, paths), [file_name, *paths.values()], file_hash
+    )
+
+async def release_stored(bucket_name: str, stored: StoredUpload) -> None:
+    """Remove what an upload wrote if its row was not saved
+
+    Content-addressed objects are left in place: another upload of the same
+    image may be about to insert a row referencing them. `python -m
+    api.content_store dedupe` sweeps the ones no row ever came to reference.
+    """
+    if stored.file_hash is not None:
+        return
+    await data.remove_objects(bucket_name, stored.created)
+
+def upload_record(file_name: str, file_hash: str, user_uuid: str, localization: str,
+                  stored: StoredUpload, prediction_result: dict, model_version: str) -> dict:
+    """Row of the `uploads` table for one stored and scored image"""
+    return {
+        **stored.derivatives,
+        "file_name": file_name,
+        "file_hash": file_hash,
+        "user_uuid": user_uuid,
+        "localization": localization,
+        "url": stored.url,
+        "prediction_result": prediction_result.get("prediction"),
+        "prediction_confidence": prediction_result.get("confidence"),
+        "model_version": model_version,
+    }
+
+async def insert_records(records: List[dict]) -> List[dict]:
+    rows = await data.insert_uploads(records)
+    if len(rows) != len(records):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to save file metadata in database"
+        )
+    return rows
+
 def calculate_file_hash(content: bytes) -> str:
     """Calculate SHA-256 hash of file content"""
     return hashlib.sha256(content).hexdigest()
 
-@router.post("/")
-async def upload_file(
-    image: UploadFile = File(...),  # Required field
-    current_user: dict = Depends(get_current_user),
-    prediction_request: PredictionRequest = Depends()
-):
-    """Upload an image file to Supabase storage"""
-    # Production-level validation for file upload
-    if not image:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="No file provided"
-        )
-    
-    if not image.filename or image.filename.strip() == "":
+async def _read_image_form(request: Request) -> tuple[MultipartForm, SpooledUpload]:
+    form = await read_multipart(
+        request,
+        max_file_size=MAX_FILE_SIZE,
+        max_files=1,
+        validate_file=ImageValidator.validate_upload_headers
+    )
+    image = form.file("image")
+    if image is None:
+        form.close()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid file: filename is empty"
+            detail="Image file is required"
         )
-    
-    if not image.size or image.size == 0:
+    return form, image
+
+async def read_image_upload(request: Request):
+    """Stream the `image` part of the request body, rejecting bad uploads early"""
+    form, image = await _read_image_form(request)
+    try:
+        yield image
+    finally:
+        form.close()
+
+async def admit_prediction(current_user: dict = Depends(get_current_user)):
+    """Admit a prediction request or answer 429/503 with Retry-After, before its body is read"""
+    if not ADMISSION_ENABLED:
+        yield AdmissionSlot(lambda: None)
+        return
+    admission.admit(current_user.get("sub"))
+    slot = AdmissionSlot(admission.release)
+    try:
+        yield slot
+    finally:
+        if not slot.handed_over:
+            admission.release()
+
+async def read_job_form(request: Request):
+    """Same as read_image_upload, but yields the form so a job can take the image over"""
+    form, _ = await _read_image_form(request)
+    try:
+        yield form
+    finally:
+        # Leaves a detached image open for the job
+        form.close()
+
+async def predict_upload(inference, user_uuid: str, localization: str, image: SpooledUpload,
+                         file_id: Optional[str] = None, route: str = "predict") -> dict:
+    """Validate, score, store and record one uploaded image
+
+    Shared by POST /predict/ and prediction jobs. Returns the prediction,
+    where it came from, and the stored file's name, hash and URL.
+    """
+    engine, prediction_cache = inference
+
+    # Production-level validation for file upload
+    if not image.size:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid file: file is empty"
         )
-    
-    # Validate file size
-    ImageValidator.validate_file_size(image.size)
-    
-    # Validate file type and extension
-    ImageValidator.validate_file_type(image.content_type, image.filename)
-    
-    # Read file content
-    file_content = await image.read()
 
-    # Validate image content
-    await ImageValidator.validate_image_content(file_content)
-    image_rgb = Image.open(io.BytesIO(file_content)).convert('RGB')
+    # Validate image content; this is the only time the image is decoded
+    image_rgb = await ImageValidator.validate_image_content(image.file)
+    # Hashed while streaming, so repeated uploads skip inference
+    file_hash = image.sha256
+
+    async def run_inference() -> dict:
+        # Resize and normalize off the event loop
+        with span("transform"):
+            input_tensor = await run_in_threadpool(to_model_input, image_rgb)
+        # Predict skin cancer using the loaded model, batched with concurrent requests
+        with span("inference"):
+            return await engine.submit(input_tensor)
 
-    # Predict skin cancer using the loaded model
-    prediction_result = predictor.predict(image_rgb)
     # Sanitize and validate filename
     sanitized_filename = ImageValidator.validate_filename(image.filename)
     # Create a unique filename to avoid collisions
-    sanitized_filename = f"{uuid.uuid4()}_{sanitized_filename}"
-    # Calculate file hash
-    file_hash = calculate_file_hash(file_content)
-
-    # Upload to Supabase storage
+    sanitized_filename = f"{file_id or uuid.uuid4()}_{sanitized_filename}"
     bucket_name = os.environ.get("SUPABASE_BUCKET")
-    upload_response = supabase.storage.from_(bucket_name).upload(
-        f"{sanitized_filename}",
-        file_content,
-        {"content_type": image.content_type}
+
+    async def insert_metadata(prediction, stored: StoredUpload):
+        prediction_result, _ = prediction
+        return await insert_records([upload_record(
+            sanitized_filename,
+            file_hash,
+            user_uuid,
+            localization,
+            stored,
+            prediction_result,
+            prediction_cache.model_version
+        )])
+
+    # Inference and the storage upload overlap; the row is inserted once both succeed
+    (prediction_result, prediction_source), _, rows = await run_upload_pipeline(
+        infer=lambda: prediction_cache.get_or_compute(file_hash, run_inference),
+        store=lambda: store_with_derivatives(bucket_name, sanitized_filename, image, image_rgb),
+        insert=insert_metadata,
+        compensate=lambda stored: release_stored(bucket_name, stored),
+        route=route
     )
-    if not upload_response.path:
+    if history_cache is not None:
+        history_cache.invalidate(user_uuid)
+    row = rows[0]
+    prediction_result, embedding = embeddings.split_embedding(prediction_result)
+    await embeddings.index_uploads(prediction_cache.model_version, user_uuid, [(row["id"], embedding)])
+
+    if not base_url:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Something went wrong. Failed to upload file to storage"
+            detail="IMAGE_BASE_URL environment variable is not set"
         )
-    response = supabase.table("uploads").insert({
+    return {
+        "prediction": prediction_result,
+        "source": prediction_source,
         "file_name": sanitized_filename,
         "file_hash": file_hash,
-        "user_uuid": current_user.get("sub"),  # Assuming user_id is obtained from the current user context
-        "localization": prediction_request.localization,
-        "url": upload_response.fullPath,
-        "prediction_result": prediction_result.get("prediction"),
-        "prediction_confidence": prediction_result.get("confidence"),
-    }).execute()
-    if not response.data:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to save file metadata in database"
-        )
+        "url": f"{base_url}/{row['url']}",
+        "thumbnail_url": f"{base_url}/{row['thumbnail_url']}" if row.get("thumbnail_url") else None,
+    }
 
+@router.post("/", openapi_extra=multipart_openapi({"image": {}}))
+async def upload_file(
+    inference=Depends(runtime.require_ready),
+    current_user: dict = Depends(get_current_user),
+    prediction_request: PredictionRequest = Depends(),
+    admitted=Depends(admit_prediction),
+    image: SpooledUpload = Depends(read_image_upload)  # Required field, read after auth and admission
+):
+    """Upload an image file to Supabase storage"""
+    outcome = await predict_upload(
+        inference,
+        current_user.get("sub"),  # Assuming user_id is obtained from the current user context
+        prediction_request.localization,
+        image
+    )
+    headers = {
+        "X-File-Name": outcome["file_name"],
+        "X-File-Hash": outcome["file_hash"],
+        "X-File-URL": outcome["url"],
+        "X-Prediction-Source": outcome["source"]
+    }
+    if outcome["thumbnail_url"]:
+        headers["X-Thumbnail-URL"] = outcome["thumbnail_url"]
+    return JSONResponse(content=outcome["prediction"], status_code=status.HTTP_201_CREATED, headers=headers)
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED, openapi_extra=multipart_openapi({"image": {}}))
+async def create_prediction_job(
+    inference=Depends(runtime.require_ready),
+    current_user: dict = Depends(get_current_user),
+    prediction_request: PredictionRequest = Depends(),
+    admitted: AdmissionSlot = Depends(admit_prediction),
+    form: MultipartForm = Depends(read_job_form)
+):
+    """Accept an image and score it in the background
+
+    Answers 202 as soon as the upload is received. Poll the job URL or
+    follow its event stream for the result, which has the same fields as
+    the POST /predict/ response and headers.
+    """
+    user_uuid = current_user.get("sub")
+    image = form.detach(form.file("image"))
+    # The job id doubles as the stored file's prefix, so any worker can find the finished job
+    job_id = str(uuid.uuid4())
+    # The job keeps the admission slot until it finishes, not just until the 202
+    release_slot = admitted.hand_over()
+
+    def cleanup() -> None:
+        try:
+            image.close()
+        finally:
+            release_slot()
+
+    job = prediction_jobs.submit(
+        user_uuid,
+        lambda: predict_upload(
+            inference, user_uuid, prediction_request.localization, image, file_id=job_id, route="job"
+        ),
+        cleanup=cleanup,
+        job_id=job_id
+    )
+    location = f"{router.prefix}/jobs/{job.id}"
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={**job.as_dict(), "status_url": location, "events_url": f"{location}/events"},
+        headers={"Location": location}
+    )
+
+async def find_finished_job(job_id: str, user_uuid: str) -> Optional[dict]:
+    """A job finished by another worker process, rebuilt from its `uploads` row"""
+    row = await data.find_upload_by_prefix(user_uuid, f"{job_id}_")
+    if row is None:
+        return None
+    return {
+        "id": job_id,
+        "status": "succeeded",
+        "created_at": row.get("created_at"),
+        "started_at": None,
+        "finished_at": row.get("created_at"),
+        "result": {
+            "prediction": prediction_from_row(row),
+            "file_name": row.get("file_name"),
+            "file_hash": row.get("file_hash"),
+            "url": f"{base_url}/{row['url']}" if base_url else row.get("url"),
+            "thumbnail_url": f"{base_url}/{row['thumbnail_url']}" if base_url and row.get("thumbnail_url") else None,
+        },
+    }
+
+async def job_snapshot(job_id: str, user_uuid: str) -> dict:
+    """State of a job from this process, else from the database; 404 if neither knows it"""
+    try:
+        job_id = str(uuid.UUID(job_id))
+    except ValueError:
+        job_id = None
+    if job_id is not None:
+        job = prediction_jobs.get(job_id, user_uuid)
+        if job is not None:
+            return job.as_dict()
+        stored = await find_finished_job(job_id, user_uuid)
+        if stored is not None:
+            return stored
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Prediction job not found"
+    )
+
+def _job_event(snapshot: dict) -> str:
+    return f"event: {snapshot['status']}\ndata: {json.dumps(snapshot, separators=(',', ':'))}\n\n"
+
+@router.get("/jobs/{job_id}")
+async def get_prediction_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Current state of a prediction job, with its result once it has finished
+
+    Queued and running jobs are only known to the worker process that
+    accepted them; finished ones are found from any worker.
+    """
+    return await job_snapshot(job_id, current_user.get("sub"))
+
+@router.get("/jobs/{job_id}/events")
+async def stream_prediction_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Server-sent events with the job's state on every change, until it finishes"""
+    user_uuid = current_user.get("sub")
+    snapshot = await job_snapshot(job_id, user_uuid)
+    job = prediction_jobs.get(snapshot["id"], user_uuid)
+
+    async def events():
+        if job is None:
+            yield _job_event(snapshot)
+            return
+        while True:
+            changed = job.next_change()
+            current = job.as_dict()
+            yield _job_event(current)
+            if job.done:
+                return
+            while True:
+                try:
+                    await asyncio.wait_for(changed.wait(), JOB_EVENTS_HEARTBEAT)
+                    break
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+async def read_batch_upload(request: Request):
+    """Stream every `images` part of the request body; a bad file fails only its own item"""
+    form = await read_multipart(
+        request,
+        max_file_size=MAX_FILE_SIZE,
+        max_files=MAX_BATCH_IMAGES,
+        validate_file=ImageValidator.validate_upload_headers,
+        strict=False
+    )
+    try:
+        yield form
+    finally:
+        form.close()
+
+def _item_error(index: int, upload: SpooledUpload, error: HTTPException) -> dict:
+    return {
+        "index": index,
+        "filename": upload.filename,
+        "status_code": error.status_code,
+        "error": error.detail
+    }
+
+def _batch_status(errors: dict, total: int) -> int:
+    """Status of a batch response from its per-image errors, see upload_batch"""
+    if not errors:
+        return status.HTTP_201_CREATED
+    server_errors = sum(1 for error in errors.values() if error.status_code >= 500)
+    if len(errors) < total or 0 < server_errors < len(errors):
+        return status.HTTP_207_MULTI_STATUS
+    return status.HTTP_500_INTERNAL_SERVER_ERROR if server_errors else status.HTTP_400_BAD_REQUEST
+
+@router.post("/batch", openapi_extra=multipart_openapi(
+    {"images": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+    {"localization": {
+        "type": "array",
+        "items": {"type": "string"},
+        "description": "One localization per image, in order, or a single one for all images"
+    }}
+))
+async def upload_batch(
+    inference=Depends(runtime.require_ready),
+    current_user: dict = Depends(get_current_user),
+    admitted=Depends(admit_prediction),
+    form: MultipartForm = Depends(read_batch_upload)  # Read after auth and admission
+):
+    """Upload and predict several images in one request
+
+    The images share one stacked forward pass and are uploaded to storage
+    concurrently, and their metadata rows are written with a single insert.
+    Each item gets its own result or error; the response is 201 when every
+    image succeeded and 207 when only some did. When none did, it is 400 if
+    every failure was the client's, 500 if every one was a storage or
+    database error (worth retrying) and 207 for a mix.
+    """
+    engine, prediction_cache = inference
     if not base_url:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="IMAGE_BASE_URL environment variable is not set"
         )
-    # Return the file upload response
-    live_url = f"{base_url}/{response.data[0]['url']}"
 
-    return JSONResponse(content=prediction_result,status_code=status.HTTP_201_CREATED, headers={
-        "X-File-Name": sanitized_filename,
-        "X-File-Hash": file_hash,
-        "X-File-URL": live_url
+    images = form.files_named("images")
+    if ADMISSION_ENABLED and len(images) > 1:
+        # Admission took one token; the other images are paid for from the user's next requests
+        admission.buckets.charge(current_user.get("sub"), len(images) - 1)
+    if not images:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="At least one image file is required"
+        )
+    localizations = form.fields.get("localization", [])
+    if len(localizations) == 1:
+        localizations = localizations * len(images)
+    if len(localizations) != len(images):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide one localization per image, or a single localization for all images"
+        )
+
+    errors = {}
+    for index, upload in enumerate(images):
+        if upload.error is not None:
+            errors[index] = upload.error
+        elif not upload.size:
+            errors[index] = HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid file: file is empty"
+            )
+
+    # Decode every image concurrently, once each
+    pending = [index for index in range(len(images)) if index not in errors]
+    decoded = await asyncio.gather(
+        *(ImageValidator.validate_image_content(images[index].file) for index in pending),
+        return_exceptions=True
+    )
+    images_rgb = {}
+    for index, outcome in zip(pending, decoded):
+        if isinstance(outcome, HTTPException):
+            errors[index] = outcome
+        elif isinstance(outcome, Exception):
+            raise outcome
+        else:
+            images_rgb[index] = outcome
+
+    valid = [index for index in pending if index in images_rgb]
+    if not valid:
+        return JSONResponse(status_code=_batch_status(errors, len(images)), content={
+            "results": [_item_error(index, images[index], errors[index]) for index in range(len(images))],
+            "succeeded": 0,
+            "failed": len(images)
+        })
+
+    bucket_name = os.environ.get("SUPABASE_BUCKET")
+    file_names = {
+        index: f"{uuid.uuid4()}_{ImageValidator.validate_filename(images[index].filename)}"
+        for index in valid
+    }
+    by_hash = {images[index].sha256: images_rgb[index] for index in valid}
+
+    async def run_inference(file_hashes: List[str]) -> List[dict]:
+        # Resize and normalize in parallel, then submit together so the engine stacks them
+        with span("transform"):
+            tensors = await asyncio.gather(*(run_in_threadpool(to_model_input, by_hash[h]) for h in file_hashes))
+        with span("inference"):
+            return await engine.submit_many(list(tensors))
+
+    async def store_all():
+        return await asyncio.gather(
+            *(store_with_derivatives(bucket_name, file_names[index], images[index], images_rgb[index]) for index in valid),
+            return_exceptions=True
+        )
+
+    async def insert_metadata(predictions, stored):
+        records = []
+        for index, (prediction_result, _), item in zip(valid, predictions, stored):
+            if isinstance(item, HTTPException):
+                errors[index] = item
+            elif isinstance(item, Exception):
+                errors[index] = HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to upload file to storage: {str(item)}"
+                )
+            else:
+                records.append(upload_record(
+                    file_names[index],
+                    images[index].sha256,
+                    current_user.get("sub"),
+                    localizations[index],
+                    item,
+                    prediction_result,
+                    prediction_cache.model_version
+                ))
+        return await insert_records(records) if records else []
+
+    async def release_all(stored) -> None:
+        await asyncio.gather(*(
+            release_stored(bucket_name, item) for item in stored if not isinstance(item, BaseException)
+        ))
+
+    predictions, _, inserted = await run_upload_pipeline(
+        infer=lambda: prediction_cache.get_or_compute_many([images[index].sha256 for index in valid], run_inference),
+        store=store_all,
+        insert=insert_metadata,
+        compensate=release_all,
+        route="batch"
+    )
+    if inserted and history_cache is not None:
+        history_cache.invalidate(current_user.get("sub"))
+
+    rows = {row["file_name"]: row for row in inserted}
+    outcomes = dict(zip(valid, predictions))
+    results = []
+    indexed = []
+    for index, upload in enumerate(images):
+        if index in errors:
+            results.append(_item_error(index, upload, errors[index]))
+            continue
+        prediction_result, prediction_source = outcomes[index]
+        prediction_result, embedding = embeddings.split_embedding(prediction_result)
+        indexed.append((rows[file_names[index]]["id"], embedding))
+        results.append({
+            "index": index,
+            "filename": upload.filename,
+            "status_code": status.HTTP_201_CREATED,
+            "file_name": file_names[index],
+            "file_hash": upload.sha256,
+            "url": f"{base_url}/{rows[file_names[index]]['url']}",
+            "thumbnail_url": (
+                f"{base_url}/{rows[file_names[index]]['thumbnail_url']}"
+                if rows[file_names[index]].get("thumbnail_url") else None
+            ),
+            "prediction_source": prediction_source,
+            **prediction_result
+        })
+
+    await embeddings.index_uploads(prediction_cache.model_version, current_user.get("sub"), indexed)
+
+    failed = len(errors)
+    return JSONResponse(status_code=_batch_status(errors, len(images)), content={
+        "results": results,
+        "succeeded": len(images) - failed,
+        "failed": failed
     })
 
+def encode_history_cursor(row: dict) -> str:
+    payload = json.dumps({"created_at": row["created_at"], "id": row["id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> dict:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(position, dict) or not {"created_at", "id"} <= position.keys():
+            raise ValueError("incomplete cursor")
+        return position
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def parse_history_fields(fields: Optional[str]) -> str:
+    """PostgREST select list for the requested columns; the cursor columns are always included"""
+    if not fields:
+        return "*"
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = sorted(set(requested) - HISTORY_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {unknown}. Allowed fields: {sorted(HISTORY_FIELDS)}"
+        )
+    columns = ["id", "created_at"] + [field for field in requested if field not in ("id", "created_at")]
+    return ",".join(dict.fromkeys(columns))
+
+def history_etag(newest: Optional[dict], updated_at: Optional[str], page_key: tuple) -> str:
+    """Strong ETag of a history page, from the newest row it can contain and the user's latest change"""
+    newest_key = f"{newest['id']}:{newest['created_at']}" if newest else "empty"
+    digest = hashlib.sha256(f"{newest_key}|{updated_at}|{page_key}|{base_url}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def link_history_urls(row: dict) -> dict:
+    """Turn a row's storage paths into links under IMAGE_BASE_URL"""
+    for field in HISTORY_URL_FIELDS:
+        if row.get(field) and base_url:
+            row[field] = f"{base_url}/{row[field]}"
+    return row
+
+def history_response(body: bytes, etag: str, status_code: int = status.HTTP_200_OK) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if status_code == status.HTTP_304_NOT_MODIFIED:
+        return Response(status_code=status_code, headers=headers)
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
 @router.get("/history", status_code=status.HTTP_200_OK)
-async def get_upload_history(current_user: dict = Depends(get_current_user)):
-    """Get upload history for the current user"""
+async def get_upload_history(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return")
+):
+    """Get upload history for the current user, newest first
+
+    Pages are keyset-paginated on (created_at, id). Each page carries a strong
+    ETag derived from the newest row it can contain and the last time any of
+    the user's uploads changed, so a conditional request is answered with 304
+    without fetching or serializing the page.
+    """
     user_uuid = current_user.get("sub")
     if not user_uuid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not authenticated"
         )
-    
+
+    position = decode_history_cursor(cursor) if cursor else None
+    columns = parse_history_fields(fields)
+    page_key = (cursor, limit, columns)
+    if_none_match = request.headers.get("if-none-match")
+
+    if history_cache is not None:
+        cached = history_cache.get(user_uuid, page_key)
+        if cached is not None:
+            etag, body = cached
+            if etag_matches(if_none_match, etag):
+                return history_response(b"", etag, status.HTTP_304_NOT_MODIFIED)
+            return history_response(body, etag)
+        token = history_cache.token()
+
     try:
-        response = supabase.table("uploads").select("*").eq("user_uuid", user_uuid).execute()
-        if not response.data:
-            return {"message": "No uploads found for this user"}
-        user_uploads = response.data
-        for upload in user_uploads:
-            upload['url'] = f"{base_url}/{upload['url']}" if base_url else upload['url']
-        return {"uploads": user_uploads}
+        if if_none_match:
+            # Only the newest row and the latest change decide the ETag, so check them before loading the page
+            newest, updated_at = await asyncio.gather(
+                data.upload_history(user_uuid, "id,created_at", position, 1),
+                data.latest_update(user_uuid)
+            )
+            etag = history_etag(newest[0] if newest else None, updated_at, page_key)
+            if etag_matches(if_none_match, etag):
+                return history_response(b"", etag, status.HTTP_304_NOT_MODIFIED)
+        else:
+            # Read before the page, so the ETag never claims a change the body does not have
+            updated_at = await data.latest_update(user_uuid)
+
+        user_uploads = await data.upload_history(user_uuid, columns, position, limit + 1)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error retrieving upload history: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+    has_more = len(user_uploads) > limit
+    user_uploads = user_uploads[:limit]
+    etag = history_etag(user_uploads[0] if user_uploads else None, updated_at, page_key)
+    for upload in user_uploads:
+        link_history_urls(upload)
+
+    content = {
+        "uploads": user_uploads,
+        "next_cursor": encode_history_cursor(user_uploads[-1]) if has_more else None,
+        "has_more": has_more
+    }
+    if not user_uploads and position is None:
+        content["message"] = "No uploads found for this user"
+    body = json.dumps(content, separators=(",", ":")).encode()
+
+    if history_cache is not None:
+        history_cache.set(user_uuid, page_key, (etag, body), token)
+    if etag_matches(if_none_match, etag):
+        return history_response(b"", etag, status.HTTP_304_NOT_MODIFIED)
+    return history_response(body, etag)
+
+async def require_embeddings():
+    if not embeddings.EMBEDDINGS_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Similar-image search is not enabled"
+        )
+
+@router.post("/history/similar", openapi_extra=multipart_openapi({"image": {}}))
+async def find_similar_uploads(
+    enabled=Depends(require_embeddings),
+    inference=Depends(runtime.require_ready),
+    current_user: dict = Depends(get_current_user),
+    admitted=Depends(admit_prediction),
+    limit: int = Query(10, ge=1, le=HISTORY_MAX_LIMIT),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    image: SpooledUpload = Depends(read_image_upload)
+):
+    """The current user's past uploads that look most like the given image, most similar first
+
+    The image runs through the model once for its embedding, which is
+    compared against the stored embeddings of the user's uploads; nothing
+    is stored. Each upload carries its cosine similarity (-1 to 1).
+    """
+    engine, prediction_cache = inference
+    user_uuid = current_user.get("sub")
+    if not image.size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file: file is empty"
+        )
+    image_rgb = await ImageValidator.validate_image_content(image.file)
+    with span("transform"):
+        input_tensor = await run_in_threadpool(to_model_input, image_rgb)
+    with span("inference"):
+        _, embedding = embeddings.split_embedding(await engine.submit(input_tensor))
+    if embedding is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The prediction model is not producing embeddings"
+        )
+
+    with span("embeddings.search"):
+        matches = await run_in_threadpool(
+            embeddings.embedding_store.search, prediction_cache.model_version, user_uuid, embedding, limit
+        )
+    rows = await data.uploads_by_ids(user_uuid, [upload_id for upload_id, _ in matches], parse_history_fields(fields))
+    by_id = {row["id"]: row for row in rows}
+    return {
+        "uploads": [
+            {**link_history_urls(by_id[upload_id]), "similarity": similarity}
+            for upload_id, similarity in matches if upload_id in by_id
+        ],
+        "model_version": prediction_cache.model_version
+    }
@@ -1,5 +1,4 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from ..supabase import supabase
 from .auth import get_current_user
 
 router = APIRouter(
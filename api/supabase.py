@@ -9,7 +9,8 @@ from datetime import datetime
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Supabase client
+# Blocking client for the maintenance commands (derivatives backfill,
+# content_store dedupe); the API itself goes through api/data.py
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 
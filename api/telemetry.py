@@ -0,0 +1,189 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+# Seconds; the range covers a cached JWT check up to a cold multi-image upload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage timings of the request being handled; None outside a request
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank `q` quantile (0 to 1) of a sorted, non-empty list"""
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for label_values, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+http_requests = Counter(
+    "skincheck_http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")
+)
+http_request_duration = Histogram(
+    "skincheck_http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+stage_duration = Histogram(
+    "skincheck_stage_duration_seconds", "Time spent in each request stage", ("stage",)
+)
+inference_batch_size = Histogram(
+    "skincheck_inference_batch_size", "Images per model forward pass", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+inference_batch_duration = Histogram(
+    "skincheck_inference_batch_duration_seconds", "Model forward pass latency per batch"
+)
+job_duration = Histogram(
+    "skincheck_job_duration_seconds", "Prediction job time spent queued, running and in total", ("phase",)
+)
+
+METRICS = [
+    http_requests, http_request_duration, stage_duration, inference_batch_size, inference_batch_duration, job_duration
+]
+_collectors = []
+
+
+def register_collector(collect: Callable[[], Iterable[tuple]]) -> None:
+    """Add metrics computed at scrape time
+
+    `collect()` yields (name, type, help, samples) where samples is a list of
+    (labels dict, value). Use it for state that other components already
+    count, so the request path pays nothing extra.
+    """
+    _collectors.append(collect)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, metric_type, documentation, samples in collect():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def start_request() -> contextvars.Token:
+    """Begin collecting stage timings for the current request"""
+    return _request_spans.set([])
+
+
+def current_spans() -> list:
+    """The current request's list of stages, which keeps filling as they finish"""
+    spans = _request_spans.get()
+    return spans if spans is not None else []
+
+
+def finish_request(token: contextvars.Token) -> list:
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def record(name: str, seconds: float) -> None:
+    """Add a finished stage to the current request and to the stage histogram"""
+    stage_duration.observe(seconds, name)
+    spans = _request_spans.get()
+    if spans is not None:
+        # list.append is atomic, and worker threads share the request's list
+        spans.append((name, seconds))
+
+
+@contextmanager
+def span(name: str):
+    """Time a block as one request stage; works in async code and in worker threads"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def server_timing(spans: list, total: Optional[float] = None) -> str:
+    """Server-Timing header value; repeated stages are summed"""
+    durations = {}
+    for name, seconds in spans:
+        durations[name] = durations.get(name, 0.0) + seconds
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in durations.items())